@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+from settings import get_download_setting, get_state_path
+from urls import track_id_from_url
+
+logger = logging.getLogger(__name__)
+
+class DownloadArchive:
+    """SQLite record of every track downloaded, keyed by (platform, track id).
+
+    Shared by the CLI and the GUI so that a track fetched by either is
+    skipped by both without any network work.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                platform TEXT NOT NULL,
+                track_id TEXT NOT NULL,
+                url TEXT,
+                files TEXT,
+                downloaded_at REAL,
+                PRIMARY KEY (platform, track_id)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, platform: str, track_id: str) -> Optional[Dict]:
+        """Return the archive entry for a track, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT platform, track_id, url, files, downloaded_at FROM downloads "
+                "WHERE platform = ? AND track_id = ?", (platform, track_id)
+            ).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def contains(self, platform: str, track_id: str) -> bool:
+        """Check if a track is in the archive."""
+        return self.get(platform, track_id) is not None
+
+    def add(self, platform: str, track_id: str, url: str, files: List[str]):
+        """Record a downloaded track (replacing any previous entry)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads (platform, track_id, url, files, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (platform, track_id, url, json.dumps(files), time.time())
+            )
+            self._conn.commit()
+
+    def remove(self, platform: str, track_id: str):
+        """Forget a track so it is downloaded again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM downloads WHERE platform = ? AND track_id = ?", (platform, track_id))
+            self._conn.commit()
+
+    def entries(self, platform: Optional[str] = None) -> List[Dict]:
+        """List archive entries, newest first."""
+        query = "SELECT platform, track_id, url, files, downloaded_at FROM downloads"
+        params = ()
+        if platform:
+            query += " WHERE platform = ?"
+            params = (platform,)
+        query += " ORDER BY downloaded_at DESC"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_to_entry(row) -> Dict:
+        return {
+            "platform": row[0],
+            "track_id": row[1],
+            "url": row[2],
+            "files": json.loads(row[3] or "[]"),
+            "downloaded_at": row[4],
+        }
+
+_archive: Optional[DownloadArchive] = None
+_archive_lock = threading.Lock()
+
+def get_archive() -> Optional[DownloadArchive]:
+    """Return the shared archive, or None when disabled in config."""
+    global _archive
+    if not get_download_setting("use_archive", True):
+        return None
+    with _archive_lock:
+        if _archive is None:
+            path = get_download_setting("archive_file") or get_state_path("archive.db")
+            try:
+                _archive = DownloadArchive(os.path.expanduser(path))
+            except Exception as e:
+                logger.warning(f"Download archive unavailable: {e}")
+                return None
+        return _archive
+
+def find_archived(platform: str, url: str, output_format: Optional[str] = None) -> Optional[List[str]]:
+    """Return the files of an archived track if they are all still on disk.
+
+    Returns None if the URL isn't a single known track, if it was archived in
+    a different format, or if its files were removed since (in which case it
+    should be downloaded again).
+    """
+    archive = get_archive()
+    track_id = track_id_from_url(platform, url)
+    if archive is None or track_id is None:
+        return None
+    entry = archive.get(platform, track_id)
+    if entry is None or not entry["files"]:
+        return None
+    if output_format and not all(f.endswith(f".{output_format}") for f in entry["files"]):
+        return None
+    if not all(os.path.exists(f) for f in entry["files"]):
+        return None
+    return entry["files"]
+
+def record_download(platform: str, url: str, files: List[str]):
+    """Add a finished single-track download to the archive."""
+    archive = get_archive()
+    track_id = track_id_from_url(platform, url)
+    if archive is None or track_id is None or not files:
+        return
+    try:
+        archive.add(platform, track_id, url, files)
+    except Exception as e:
+        logger.warning(f"Could not update download archive: {e}")
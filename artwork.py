@@ -0,0 +1,277 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from settings import get_download_setting, get_state_path
+from metrics import ARTWORK, get_metrics
+from ratelimit import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "UniversalMusicDownloader/2.0"
+
+# Background cover fetches started while the audio is still downloading
+PREFETCH_WORKERS = 4
+# URLs remembered as already prefetched (progress events repeat them many times)
+PREFETCH_MEMORY = 1024
+# Fixed set of per-URL fetch locks, picked by hash, so the lock table never grows
+URL_LOCK_STRIPES = 64
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Shared HTTP session so artwork fetches reuse pooled keep-alive connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+        return _session
+
+def image_mime(data: bytes) -> str:
+    """Guess the MIME type of image bytes for the APIC frame."""
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    return "image/jpeg"
+
+class ArtworkCache:
+    """Content-addressed on-disk artwork cache with an in-memory LRU in front.
+
+    Images are stored once per SHA-256 of their bytes, so covers shared by
+    every track of an album (or served from several URLs) take one slot.
+    The URL index keeps ETag/Last-Modified for conditional revalidation,
+    and the least recently used images are evicted past ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 200 * 1024 * 1024,
+                 memory_items: int = 64, revalidate_after: float = 7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.revalidate_after = revalidate_after
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._url_locks = [threading.Lock() for _ in range(URL_LOCK_STRIPES)]
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL
+            );
+        """)
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Return the image bytes for ``url``, fetching or revalidating as needed."""
+        with self._lock:
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                get_metrics().count("artwork_cache", result="memory")
+                return data
+            url_lock = self._url_locks[hash(url) % URL_LOCK_STRIPES]
+
+        # One fetch per URL at a time; other tracks of the album wait and hit memory
+        with url_lock:
+            with self._lock:
+                data = self._memory.get(url)
+            if data is not None:
+                get_metrics().count("artwork_cache", result="memory")
+            else:
+                data = self._load_or_fetch(url)
+                if data is not None:
+                    self._remember(url, data)
+            return data
+
+    def _load_or_fetch(self, url: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash, etag, last_modified, checked_at FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+
+        cached = self._read_blob(row[0]) if row else None
+        if cached is not None and time.time() - (row[3] or 0) < self.revalidate_after:
+            self._touch(row[0])
+            get_metrics().count("artwork_cache", result="disk")
+            return cached
+
+        headers = {}
+        if cached is not None:
+            if row[1]:
+                headers["If-None-Match"] = row[1]
+            if row[2]:
+                headers["If-Modified-Since"] = row[2]
+
+        limiter = get_rate_limiter()
+        try:
+            with limiter.host_slot(url), get_session().get(url, headers=headers, timeout=10,
+                                                           stream=True) as response:
+                if response.status_code == 304 and cached is not None:
+                    with self._lock:
+                        self._conn.execute("UPDATE urls SET checked_at = ? WHERE url = ?", (time.time(), url))
+                        self._conn.commit()
+                    self._touch(row[0])
+                    get_metrics().count("artwork_cache", result="revalidated")
+                    return cached
+                response.raise_for_status()
+                data = limiter.read_body(response)
+        except Exception as e:
+            logger.warning(f"Failed to download album art: {e}")
+            get_metrics().count("artwork_cache", result="error")
+            return cached  # Stale artwork beats no artwork
+
+        get_metrics().count("artwork_cache", result="fetched")
+        self._store(url, data, response.headers.get("ETag"),
+                    response.headers.get("Last-Modified") or formatdate(usegmt=True))
+        return data
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _read_blob(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, url: str, data: bytes, etag: Optional[str], last_modified: Optional[str]):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO urls (url, hash, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?)",
+                    (url, digest, etag, last_modified, now)
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)",
+                    (digest, len(data), now)
+                )
+                self._conn.commit()
+            self._evict()
+        except Exception as e:
+            logger.warning(f"Could not cache album art: {e}")
+
+    def _touch(self, digest: str):
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (time.time(), digest))
+            self._conn.commit()
+
+    def _remember(self, url: str, data: bytes):
+        with self._lock:
+            self._memory[url] = data
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _evict(self):
+        """Drop least recently used images until the cache fits in max_bytes."""
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute("SELECT hash, size FROM blobs ORDER BY last_used ASC").fetchall()
+            for digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._blob_path(digest))
+                except OSError:
+                    pass
+                self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                self._conn.execute("DELETE FROM urls WHERE hash = ?", (digest,))
+                total -= size
+            self._conn.commit()
+
+_cache: Optional[ArtworkCache] = None
+_cache_lock = threading.Lock()
+
+def get_artwork_cache() -> Optional[ArtworkCache]:
+    """Return the shared artwork cache, or None if it couldn't be opened."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                max_mb = get_download_setting("artwork_cache_mb", 200)
+                _cache = ArtworkCache(get_state_path("artwork"), max_bytes=int(max_mb * 1024 * 1024))
+            except Exception as e:
+                logger.warning(f"Artwork cache unavailable: {e}")
+                return None
+        return _cache
+
+def fetch_artwork(url: str) -> Optional[bytes]:
+    """Get album art bytes, from the cache when possible."""
+    with get_metrics().timed(ARTWORK):
+        cache = get_artwork_cache()
+        if cache is not None:
+            return cache.get(url)
+        limiter = get_rate_limiter()
+        try:
+            with limiter.host_slot(url), get_session().get(url, timeout=10, stream=True) as response:
+                response.raise_for_status()
+                return limiter.read_body(response)
+        except Exception as e:
+            logger.warning(f"Failed to download album art: {e}")
+            return None
+
+_prefetch_pool: Optional[ThreadPoolExecutor] = None
+_prefetched: "OrderedDict[str, None]" = OrderedDict()
+_prefetch_lock = threading.Lock()
+
+def prefetch_artwork(url: Optional[str]):
+    """Start fetching a cover into the artwork cache in the background.
+
+    Called as soon as a job knows its cover URL (stored metadata, playlist
+    entries, yt-dlp progress), so the artwork stage finds the image in
+    memory instead of fetching it after the download. A fetch the stage
+    asks for while the prefetch is running waits for it rather than
+    requesting the URL again.
+    """
+    global _prefetch_pool
+    if not url or get_artwork_cache() is None:
+        return
+    with _prefetch_lock:
+        if url in _prefetched:
+            _prefetched.move_to_end(url)
+            return
+        _prefetched[url] = None
+        while len(_prefetched) > PREFETCH_MEMORY:
+            _prefetched.popitem(last=False)
+        if _prefetch_pool is None:
+            _prefetch_pool = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="artwork-prefetch")
+        pool = _prefetch_pool
+    pool.submit(fetch_artwork, url)
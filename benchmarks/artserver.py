@@ -0,0 +1,69 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+from fakemedia import cover_bytes
+
+class ArtServer(ThreadingHTTPServer):
+    """Local stand-in for a CDN serving cover art, with ETags and a simulated latency."""
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.02, cover_size: int = 300 * 1024):
+        super().__init__(("127.0.0.1", 0), _ArtHandler)
+        self.latency = latency
+        self.cover_size = cover_size
+        self.requests = 0
+        self.not_modified = 0
+        self._covers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def cover(self, name: str) -> bytes:
+        with self._lock:
+            if name not in self._covers:
+                self._covers[name] = cover_bytes(name, self.cover_size)
+            return self._covers[name]
+
+class _ArtHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like a real CDN
+
+    def do_GET(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        time.sleep(server.latency)
+        if not self.path.startswith("/cover/"):
+            self.send_error(404)
+            return
+        name = self.path[len("/cover/"):]
+        etag = f'"{name}"'
+        if self.headers.get("If-None-Match") == etag:
+            with server._lock:
+                server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = server.cover(name)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "max-age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_art_server(latency: float = 0.02) -> Tuple[ArtServer, threading.Thread]:
+    """Serve covers on an ephemeral localhost port from a background thread."""
+    server = ArtServer(latency=latency)
+    thread = threading.Thread(target=server.serve_forever, name="art-server", daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+End-to-end check of the download daemon over the fake tools.
+
+Starts ``daemon.py serve`` on a free local port with benchmarks/fakebin
+first on PATH and scratch state, then drives the HTTP API the way a
+client would: submit, poll, cancel a queued and a running job, read the
+/events stream, and check that bad requests get 4xx answers. Exits with
+status 1 if anything is off.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from run_benchmarks import fake_environment  # noqa: E402
+
+# Simulated download time: long enough to cancel a job while it runs
+TOOL_SECONDS = 2.0
+STARTUP_TIMEOUT = 30
+JOB_TIMEOUT = 60
+
+# -- daemon (run in the child process) ------------------------------------
+
+def serve(port: int, workdir: str):
+    """Run the daemon on ``port`` with scratch state and the subprocess engine."""
+    sys.path.insert(0, REPO_DIR)
+    from settings import load_config, set_download_setting
+    load_config()["state_dir"] = os.path.join(workdir, "state")
+    set_download_setting("ytdlp_engine", "subprocess")
+    set_download_setting("retry_backoff_seconds", 0)
+    import daemon
+    sys.argv = ["daemon.py", "--host", "127.0.0.1", "--port", str(port), "serve", "--workers", "1"]
+    daemon.main()
+
+# -- client ---------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def request(base_url: str, method: str, path: str, payload: Optional[Dict] = None) -> Tuple[int, object]:
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+def raw_request(port: int, data: bytes) -> int:
+    """Send hand-written request bytes and return the response status."""
+    with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+        sock.sendall(data)
+        status_line = sock.makefile('rb').readline().decode('latin-1')
+    return int(status_line.split()[1])
+
+def wait_for(predicate, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError(f"Timed out waiting for {what}")
+
+class EventReader(threading.Thread):
+    """Collects the events of one /events connection."""
+
+    def __init__(self, base_url: str):
+        super().__init__(daemon=True)
+        self.response = urllib.request.urlopen(base_url + "/events", timeout=STARTUP_TIMEOUT)
+        self.events: List[Dict] = []
+
+    def run(self):
+        try:
+            for raw in self.response:
+                line = raw.decode('utf-8').rstrip('\n')
+                if line.startswith('data: '):
+                    self.events.append(json.loads(line[len('data: '):]))
+        except (OSError, ValueError):
+            pass
+
+    def statuses(self, job_id: int) -> List[str]:
+        """The job's state changes, leaving out its progress events."""
+        return [event['event'] for event in list(self.events)
+                if event['job']['id'] == job_id and event['event'] != "progress"]
+
+    def progress(self, job_id: int) -> List[Dict]:
+        return [event['job']['progress'] for event in list(self.events)
+                if event['job']['id'] == job_id and event['event'] == "progress"]
+
+def run_checks(port: int, workdir: str):
+    base_url = f"http://127.0.0.1:{port}"
+    output_dir = os.path.join(workdir, "out")
+
+    def check(condition: bool, message: str):
+        if not condition:
+            raise AssertionError(message)
+        print(f"ok   {message}", flush=True)
+
+    def job(job_id: int) -> Dict:
+        return request(base_url, "GET", f"/jobs/{job_id}")[1]
+
+    def submit(name: str) -> Dict:
+        status, view = request(base_url, "POST", "/jobs", {
+            'url': f"https://soundcloud.com/check/{name}", 'format': "mp3", 'output_dir': output_dir})
+        check(status == 201, f"POST /jobs queues {name}")
+        return view
+
+    wait_for(lambda: _healthy(base_url), STARTUP_TIMEOUT, "the daemon to start")
+    events = EventReader(base_url)
+    events.start()
+
+    # One worker: the first job runs while the second waits in the queue
+    running, queued = submit("track-1"), submit("track-2")
+    wait_for(lambda: job(running['id'])['status'] == "running", JOB_TIMEOUT, "the first job to start")
+    status, view = request(base_url, "DELETE", f"/jobs/{queued['id']}")
+    check(status == 200 and view['status'] == "cancelled", "DELETE cancels a queued job")
+    status, view = request(base_url, "DELETE", f"/jobs/{running['id']}")
+    check(status == 200, "DELETE accepts a running job")
+    view = wait_for(lambda: _finished(job(running['id'])), JOB_TIMEOUT, "the running job to stop")
+    check(view['status'] == "cancelled", "a cancelled running job ends as cancelled")
+
+    done = submit("track-3")
+    view = wait_for(lambda: _finished(job(done['id'])), JOB_TIMEOUT, "the download to finish")
+    check(view['status'] == "done", f"the download finishes ({view.get('error') or 'no error'})")
+    check(len(view['files']) == 1 and os.path.exists(view['files'][0]), "the job reports its MP3")
+
+    status, jobs = request(base_url, "GET", "/jobs")
+    check(status == 200 and [j['id'] for j in jobs] == [running['id'], queued['id'], done['id']],
+          "GET /jobs lists every job")
+    status, progress = request(base_url, "GET", "/progress")
+    check(status == 200 and 'jobs' in progress, "GET /progress answers")
+
+    wait_for(lambda: "done" in events.statuses(done['id']), 5, "the done event")
+    check(events.statuses(running['id']) == ["queued", "running", "cancelled"],
+          "/events reports the running job's start and cancellation")
+    check(events.statuses(queued['id']) == ["queued", "cancelled"], "/events reports the queued job's cancellation")
+    check(events.statuses(done['id']) == ["queued", "running", "done"], "/events reports the finished download")
+    updates = events.progress(done['id'])
+    check(bool(updates) and all(update and update.get('stage') for update in updates),
+          f"/events streams the download's progress ({len(updates)} updates)")
+
+    check(request(base_url, "GET", "/jobs/999")[0] == 404, "an unknown job is 404")
+    check(request(base_url, "DELETE", f"/jobs/{done['id']}")[0] == 409, "cancelling a finished job is 409")
+    check(request(base_url, "POST", "/jobs", {'url': "https://example.com/x"})[0] == 400,
+          "an unsupported URL is 400")
+    check(raw_request(port, b"POST /jobs HTTP/1.1\r\nContent-Length: abc\r\n\r\n") == 400,
+          "a malformed Content-Length is 400")
+    check(raw_request(port, b"POST /jobs HTTP/1.1\r\nContent-Length: -5\r\n\r\n") == 400,
+          "a negative Content-Length is 400")
+    check(raw_request(port, b"POST /jobs HTTP/1.1\r\nContent-Length: 8\r\n\r\nnot json") == 400,
+          "a body that isn't JSON is 400")
+
+def _healthy(base_url: str) -> bool:
+    try:
+        return request(base_url, "GET", "/health")[0] == 200
+    except urllib.error.URLError:
+        return False
+
+def _finished(view: Dict) -> Optional[Dict]:
+    return view if view['status'] in ("done", "failed", "cancelled") else None
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end check of the download daemon over the fake tools")
+    parser.add_argument('--verbose', action='store_true', help="Show the daemon's log")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.workdir)
+        return
+
+    if os.name == 'nt':
+        sys.exit("The fake tools are POSIX scripts; run the check under WSL or another POSIX shell")
+
+    from artserver import start_art_server
+    server, _ = start_art_server()
+    workdir = tempfile.mkdtemp(prefix="umd-daemon-check-")
+    port = free_port()
+    output = None if args.verbose else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port), "--workdir", workdir],
+        env=fake_environment(TOOL_SECONDS, server.url), stdout=output, stderr=output, cwd=workdir)
+    try:
+        run_checks(port, workdir)
+    except AssertionError as e:
+        print(f"FAIL {e}")
+        sys.exit(1)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\nDaemon check passed")
+
+if __name__ == "__main__":
+    main()
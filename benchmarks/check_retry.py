@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Regression check for retry.classify_error.
+
+Feeds it the failures the download tools actually produce, including
+commands whose options name ffmpeg, and checks which class each one gets
+and that with_retries retries the transient ones. Exits with status 1 if
+any case is off. Needs no tools or network.
+"""
+
+import os
+import sys
+import subprocess
+from typing import List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from procrunner import ProcessStalled, ProcessTimeout  # noqa: E402
+from retry import (EXTRACTOR, FFMPEG, LOCAL, NETWORK, THROTTLED, UNKNOWN, CANCELLED,  # noqa: E402
+                   OperationCancelled, classify_error, with_retries)
+
+URL = "https://soundcloud.com/check/track-1"
+# What the app runs: both commands name ffmpeg in their options
+YTDLP_CMD = ["yt-dlp", "--extract-audio", "--audio-format", "mp3", "--ffmpeg-location", "/opt/ffmpeg/bin/ffmpeg",
+             "-o", "%(title)s.%(ext)s", "--postprocessor-args", "ffmpeg:-b:a 320k -ar 44100", URL]
+SPOTDL_CMD = ["spotdl", "download", "https://open.spotify.com/track/abc", "--ffmpeg", "/opt/ffmpeg/bin/ffmpeg"]
+
+def failed(cmd: List[str], stderr: str = "") -> subprocess.CalledProcessError:
+    return subprocess.CalledProcessError(1, cmd, output="", stderr=stderr)
+
+CASES = [
+    ("yt-dlp failure without a known cause", failed(YTDLP_CMD, "ERROR: something odd happened"), UNKNOWN),
+    ("yt-dlp extractor failure", failed(YTDLP_CMD, "ERROR: [soundcloud] track-1: Unable to extract info"),
+     EXTRACTOR),
+    ("spotdl failure without a known cause", failed(SPOTDL_CMD, "Traceback (most recent call last):"), UNKNOWN),
+    ("spotdl failure with no output", failed(SPOTDL_CMD), UNKNOWN),
+    ("yt-dlp throttled", failed(YTDLP_CMD, "ERROR: HTTP Error 429: Too Many Requests"), THROTTLED),
+    ("yt-dlp network failure", failed(YTDLP_CMD, "ERROR: Connection reset by peer"), NETWORK),
+    ("ffmpeg conversion failure", failed(YTDLP_CMD, "ERROR: Postprocessing: Conversion failed!"), FFMPEG),
+    ("transcode failure", failed(["ffmpeg", "-i", "in.mp3", "out.wav"], "in.mp3: Invalid data found"), FFMPEG),
+    ("stalled transfer", ProcessStalled(YTDLP_CMD, "stalled: no progress for 120 seconds"), NETWORK),
+    ("timed-out tool", ProcessTimeout(YTDLP_CMD, 600), NETWORK),
+    ("cancelled job", OperationCancelled("Cancelled: yt-dlp"), CANCELLED),
+    ("missing executable", FileNotFoundError(2, "No such file or directory", "yt-dlp"), LOCAL),
+]
+
+def main():
+    failures = 0
+    for name, error, expected in CASES:
+        kind = classify_error(error)
+        ok = kind == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {kind}" + ("" if ok else f" (expected {expected})"))
+
+    # An unknown failure is transient: the command is tried again
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise failed(YTDLP_CMD, "ERROR: something odd happened")
+        return "done"
+    ok = with_retries(flaky, retries=1, on_retry=lambda _: None, sleep=lambda _: None) == "done"
+    failures += not ok
+    print(f"{'ok  ' if ok else 'FAIL'} unknown failures are retried ({len(calls)} attempts)")
+
+    if failures:
+        sys.exit(1)
+    print("\nRetry check passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import wave
+import random
+from typing import Dict, Optional
+
+# Silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, mono, no padding
+_MP3_HEADER = b"\xff\xfb\x90\xc0"
+_MP3_FRAME_BYTES = 144 * 128000 // 44100
+_MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+def track_seconds() -> float:
+    """Length of generated tracks (UMD_BENCH_TRACK_SECONDS, default 10)."""
+    return float(os.environ.get("UMD_BENCH_TRACK_SECONDS", "10"))
+
+def mp3_bytes(seconds: Optional[float] = None) -> bytes:
+    """A decodable-enough MP3 stream that mutagen accepts."""
+    seconds = track_seconds() if seconds is None else seconds
+    frame = _MP3_HEADER + b"\x00" * (_MP3_FRAME_BYTES - len(_MP3_HEADER))
+    return frame * max(1, int(seconds * _MP3_FRAMES_PER_SECOND))
+
+def write_mp3(path: str, tags: Optional[Dict[str, str]] = None, seconds: Optional[float] = None,
+              cover: Optional[bytes] = None):
+    """Write a silent MP3, tagged the way spotdl or yt-dlp would if ``tags``/``cover`` are given."""
+    with open(path, 'wb') as f:
+        f.write(mp3_bytes(seconds))
+    if tags or cover:
+        from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TDRC, WOAS
+        id3 = ID3()
+        if tags:
+            id3.add(TIT2(encoding=3, text=tags.get("title", "")))
+            id3.add(TPE1(encoding=3, text=tags.get("artist", "")))
+            if tags.get("album"):
+                id3.add(TALB(encoding=3, text=tags["album"]))
+            if tags.get("year"):
+                id3.add(TDRC(encoding=3, text=tags["year"]))
+            if tags.get("url"):
+                id3.add(WOAS(url=tags["url"]))
+        if cover:
+            id3.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover))
+        id3.save(path)
+
+def write_wav(path: str, seconds: Optional[float] = None):
+    """Write silent CD-quality WAV (16-bit stereo, 44.1 kHz)."""
+    seconds = track_seconds() if seconds is None else seconds
+    frames = int(seconds * 44100)
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(b"\x00\x00\x00\x00" * frames)
+
+def cover_bytes(name: str, size: int = 300 * 1024) -> bytes:
+    """Deterministic JPEG-looking cover art of ``size`` bytes, distinct per name."""
+    rng = random.Random(name)
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(size - 6) + b"\xff\xd9"
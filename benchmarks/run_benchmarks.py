@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the downloader's own overhead.
+
+Fake yt-dlp/spotdl/ffmpeg executables (benchmarks/fakebin) produce realistic
+output and files without touching the network, and a local HTTP server
+stands in for the artwork CDN. Each case runs in a fresh interpreter so
+caches and singletons start cold, and results are saved to
+benchmarks/results/ and compared with the previous run.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKEBIN_DIR = os.path.join(BENCH_DIR, "fakebin")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Timings that got slower by more than this are flagged as regressions
+DEFAULT_THRESHOLD_PERCENT = 10.0
+STARTUP_RUNS = 5
+SCAN_FILES = 10_000
+TAGGING_FILES = 200
+
+def fake_environment(tool_seconds: float, art_url: Optional[str] = None) -> Dict[str, str]:
+    """Environment that puts the fake tools first on PATH."""
+    env = dict(os.environ)
+    env["PATH"] = FAKEBIN_DIR + os.pathsep + env.get("PATH", "")
+    env["UMD_BENCH_TOOL_SECONDS"] = str(tool_seconds)
+    if art_url:
+        env["UMD_BENCH_ART_URL"] = art_url
+    return env
+
+# -- cases (run inside a worker process) ----------------------------------
+
+def _setup_worker(workdir: str):
+    """Point the app at scratch state and the fake tools, and import it."""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from settings import load_config, set_download_setting
+    load_config()["state_dir"] = os.path.join(workdir, "state")
+    set_download_setting("ytdlp_engine", "subprocess")
+    set_download_setting("retry_backoff_seconds", 0)
+    import logging
+    import downloader  # noqa: F401  (configures logging on import)
+    logging.getLogger().setLevel(logging.WARNING)
+
+def _run_batch(workdir: str, urls: List[str], fmt: str, output_dir: Optional[str] = None) -> Dict:
+    """Time downloader.run_batch (the scheduler path the GUI queue also uses) over fake tools."""
+    from artserver import start_art_server
+    import downloader
+    from metrics import get_metrics
+
+    server, _ = start_art_server()
+    os.environ.update(fake_environment(float(os.environ["UMD_BENCH_TOOL_SECONDS"]), server.url))
+    output_dir = output_dir or os.path.join(workdir, "out")
+    batch_file = os.path.join(workdir, "urls.txt")
+    with open(batch_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(urls) + "\n")
+
+    start = time.perf_counter()
+    failed = downloader.run_batch(batch_file, fmt, output_dir)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    snapshot = get_metrics().snapshot()
+    files = sum(entry['value'] for entry in snapshot['counters'].get('files', []))
+    return {
+        'seconds': elapsed,
+        'details': {
+            'urls': len(urls),
+            'files': files,
+            'failed': failed,
+            'files_per_second': round(files / elapsed, 2) if elapsed else None,
+            'artwork_requests': server.requests,
+            'stages': snapshot['stages'],
+        },
+    }
+
+def case_batch_soundcloud_mp3(workdir: str) -> Dict:
+    urls = [f"https://soundcloud.com/bench/track-{i}" for i in range(50)]
+    return _run_batch(workdir, urls, "mp3")
+
+def case_batch_soundcloud_set(workdir: str) -> Dict:
+    # One set URL resolved up front and fanned out into per-track jobs
+    return _run_batch(workdir, ["https://soundcloud.com/bench/sets/mix"], "mp3")
+
+def case_batch_spotify_wav(workdir: str) -> Dict:
+    urls = [f"https://open.spotify.com/track/bench{i}" for i in range(20)]
+    return _run_batch(workdir, urls, "wav")
+
+def case_scan_10k_files(workdir: str) -> Dict:
+    """Same batch as batch.soundcloud_mp3, into a folder that already holds 10k files."""
+    output_dir = os.path.join(workdir, "out")
+    os.makedirs(output_dir)
+    for i in range(SCAN_FILES):
+        ext = (".mp3", ".info.json", ".jpg", ".wav")[i % 4]
+        with open(os.path.join(output_dir, f"existing-{i}{ext}"), "wb") as f:
+            f.write(b"\0" * 64)
+    urls = [f"https://soundcloud.com/bench/track-{i}" for i in range(50)]
+    return _run_batch(workdir, urls, "mp3", output_dir)
+
+def case_tagging(workdir: str) -> Dict:
+    """Per-file cost of embedding tags and cover art, as the pipelines do after download."""
+    from tagging import read_mp3_tags, write_mp3_tags, write_wav_tags
+    from fakemedia import cover_bytes, write_mp3, write_wav
+
+    cover = cover_bytes("tagging")
+    metadata = {"title": "Title", "artist": "Artist", "album": "Album", "year": "2024"}
+    mp3s, wavs = [], []
+    for i in range(TAGGING_FILES):
+        mp3s.append(os.path.join(workdir, f"{i}.mp3"))
+        write_mp3(mp3s[-1])
+        wavs.append(os.path.join(workdir, f"{i}.wav"))
+        write_wav(wavs[-1], seconds=2)
+
+    start = time.perf_counter()
+    for path in mp3s:
+        write_mp3_tags(path, metadata, cover_data=cover)
+    mp3_seconds = (time.perf_counter() - start) / len(mp3s)
+
+    # Same tags again, as on a re-run over files that are already tagged: the write is skipped
+    start = time.perf_counter()
+    for path in mp3s:
+        write_mp3_tags(path, metadata, cover_data=cover)
+    unchanged_seconds = (time.perf_counter() - start) / len(mp3s)
+
+    start = time.perf_counter()
+    for path in mp3s:
+        read_mp3_tags(path)
+    read_seconds = (time.perf_counter() - start) / len(mp3s)
+
+    start = time.perf_counter()
+    for path in wavs:
+        write_wav_tags(path, metadata)
+    wav_seconds = (time.perf_counter() - start) / len(wavs)
+
+    # Check the tags really landed
+    import mutagen
+    def tagged(paths: List[str]) -> int:
+        return sum(1 for path in paths if mutagen.File(path).tags)
+
+    return {
+        'timings': {
+            'tagging.mp3_embed_per_file': mp3_seconds,
+            'tagging.mp3_unchanged_per_file': unchanged_seconds,
+            'tagging.mp3_read_per_file': read_seconds,
+            'tagging.wav_embed_per_file': wav_seconds,
+        },
+        'details': {'files': TAGGING_FILES, 'cover_bytes': len(cover),
+                    'mp3_tagged': tagged(mp3s), 'wav_tagged': tagged(wavs)},
+    }
+
+WORKER_CASES: Dict[str, Callable[[str], Dict]] = {
+    "batch.soundcloud_mp3": case_batch_soundcloud_mp3,
+    "batch.soundcloud_set": case_batch_soundcloud_set,
+    "batch.spotify_wav": case_batch_spotify_wav,
+    "scan.10k_files": case_scan_10k_files,
+    "tagging": case_tagging,
+}
+
+def run_worker(case: str, workdir: str, result_file: str):
+    _setup_worker(workdir)
+    result = WORKER_CASES[case](workdir)
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+# -- driver ---------------------------------------------------------------
+
+def run_case(case: str, tool_seconds: float, verbose: bool) -> Dict:
+    """Run one case in a fresh interpreter with scratch state."""
+    workdir = tempfile.mkdtemp(prefix="umd-bench-")
+    try:
+        result_file = os.path.join(workdir, "result.json")
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", case,
+               "--workdir", workdir, "--result-file", result_file]
+        output = None if verbose else subprocess.DEVNULL
+        subprocess.run(cmd, env=fake_environment(tool_seconds), stdout=output, stderr=output,
+                       cwd=workdir, check=True)
+        with open(result_file, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def measure_startup(tool_seconds: float) -> Dict[str, float]:
+    """Median wall time to start each entry point (cold interpreter each run)."""
+    commands = {
+        "startup.cli_help": [sys.executable, os.path.join(REPO_DIR, "downloader.py"), "--help"],
+        "startup.daemon_help": [sys.executable, os.path.join(REPO_DIR, "daemon.py"), "--help"],
+    }
+    try:
+        import tkinter  # noqa: F401
+        commands["startup.gui_import"] = [sys.executable, "-c", "import downloader_gui"]
+    except ImportError:
+        pass
+
+    timings = {}
+    env = fake_environment(tool_seconds)
+    for name, cmd in commands.items():
+        runs = []
+        for _ in range(STARTUP_RUNS):
+            start = time.perf_counter()
+            subprocess.run(cmd, env=env, cwd=REPO_DIR, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+            runs.append(time.perf_counter() - start)
+        timings[name] = statistics.median(runs)
+    return timings
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_all(only: List[str], repeat: int, tool_seconds: float, verbose: bool) -> Dict:
+    def selected(name: str) -> bool:
+        return not only or any(name.startswith(prefix) for prefix in only)
+
+    timings: Dict[str, float] = {}
+    details: Dict[str, Dict] = {}
+    if selected("startup"):
+        print("startup ...", flush=True)
+        timings.update(measure_startup(tool_seconds))
+
+    for case in WORKER_CASES:
+        if not selected(case):
+            continue
+        print(f"{case} ...", flush=True)
+        runs = [run_case(case, tool_seconds, verbose) for _ in range(repeat)]
+        if 'seconds' in runs[0]:
+            timings[case] = statistics.median(run['seconds'] for run in runs)
+        for name in runs[0].get('timings', {}):
+            timings[name] = statistics.median(run['timings'][name] for run in runs)
+        details[case] = runs[-1].get('details', {})
+
+    return {
+        'version': git_revision(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {'tool_seconds': tool_seconds, 'repeat': repeat},
+        'timings': {name: round(value, 6) for name, value in timings.items()},
+        'details': details,
+    }
+
+def latest_result(exclude: Optional[str] = None) -> Optional[str]:
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    paths = [os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR) if name.endswith(".json")]
+    paths = [path for path in paths if path != exclude]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def compare(current: Dict, previous: Dict, threshold: float) -> int:
+    """Print a comparison table and return the number of regressions."""
+    print(f"\n{'benchmark':<30} {previous['version']:>14} {current['version']:>14} {'change':>9}")
+    if previous.get('settings') != current.get('settings'):
+        print(f"⚠️  Settings differ ({previous.get('settings')} vs {current.get('settings')}), "
+              f"comparison is approximate")
+    regressions = 0
+    for name, value in current['timings'].items():
+        old = previous['timings'].get(name)
+        if not old:
+            print(f"{name:<30} {'-':>14} {value:>14.4f}")
+            continue
+        change = 100.0 * (value - old) / old
+        flag = ""
+        if change > threshold:
+            flag = "  ⚠️ regression"
+            regressions += 1
+        print(f"{name:<30} {old:>14.4f} {value:>14.4f} {change:>+8.1f}%{flag}")
+    return regressions
+
+def print_result(result: Dict):
+    print(f"\n{'benchmark':<30} {'seconds':>12}")
+    for name, value in result['timings'].items():
+        print(f"{name:<30} {value:>12.4f}")
+    scan, baseline = result['timings'].get("scan.10k_files"), result['timings'].get("batch.soundcloud_mp3")
+    if scan and baseline:
+        print(f"\nDownloading into a folder of {SCAN_FILES} files costs {scan / baseline:.2f}x an empty one")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks with fake downloaders and a local artwork server")
+    parser.add_argument('--only', nargs='+', default=[], metavar='PREFIX',
+                        help='Run only benchmarks whose name starts with PREFIX (e.g. batch, startup)')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the median is recorded')
+    parser.add_argument('--tool-seconds', type=float, default=0.1,
+                        help='Simulated network time of each fake yt-dlp/spotdl track download')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<date>-<revision>.json)')
+    parser.add_argument('--no-save', action='store_true', help="Don't write a results file")
+    parser.add_argument('--compare', help='Results file to compare against (default: the most recent one)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD_PERCENT,
+                        help='Percent slowdown reported as a regression')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of each case')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.workdir, args.result_file)
+        return
+
+    if os.name == 'nt':
+        sys.exit("The fake tools are POSIX scripts; run the benchmarks under WSL or another POSIX shell")
+
+    result = run_all(args.only, args.repeat, args.tool_seconds, args.verbose)
+    print_result(result)
+
+    output = None
+    if not args.no_save:
+        output = args.output or os.path.join(
+            RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{result['version']}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved {output}")
+
+    previous_path = args.compare or latest_result(exclude=output)
+    if previous_path:
+        with open(previous_path, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(result, previous, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from settings import get_download_setting, get_state_path
+from dedup import AUDIO_EXTENSIONS
+from tagging import read_tags
+
+logger = logging.getLogger(__name__)
+
+# Rows written per transaction during a rescan
+SCAN_BATCH = 500
+
+COLUMNS = ("path", "size", "mtime_ns", "format", "title", "artist", "album", "year", "scanned_at")
+
+def _walk_audio(root: str):
+    """Yield (path, stat) for every audio file under ``root``, using the stat from scandir."""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            logger.warning(f"Could not list {folder}: {e}")
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                    yield entry.path, entry.stat()
+            except OSError:
+                continue
+
+class LibraryCatalog:
+    """SQLite catalog of the audio files in the output library.
+
+    One row per file with its size, mtime and the tags the tagging stage
+    writes, so "do we already have this artist/album?" is a query instead
+    of a walk that opens every file. ``rescan`` only re-reads files whose
+    size or mtime changed; finished downloads are added with ``update``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                format TEXT,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                year TEXT,
+                scanned_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist COLLATE NOCASE)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album COLLATE NOCASE)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row(path: str, st: os.stat_result) -> tuple:
+        try:
+            tags = read_tags(path)
+        except Exception as e:
+            logger.debug(f"Could not read tags of {path}: {e}")
+            tags = {}
+        return (path, st.st_size, st.st_mtime_ns, os.path.splitext(path)[1].lstrip(".").lower(),
+                tags.get("title", ""), tags.get("artist", ""), tags.get("album", ""), tags.get("year", ""),
+                time.time())
+
+    def _upsert(self, rows: List[tuple]):
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO tracks ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            self._conn.commit()
+
+    def update(self, paths: Iterable[str]):
+        """Catalog (or re-catalog) specific files, e.g. the ones a download just produced."""
+        rows = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                rows.append(self._row(path, os.stat(path)))
+            except OSError:
+                self.remove([path])
+        if rows:
+            self._upsert(rows)
+
+    def remove(self, paths: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
+
+    def rescan(self, root: str) -> Dict[str, int]:
+        """Bring the rows under ``root`` up to date with the files on disk.
+
+        Files whose size and mtime match their row are not opened. Returns
+        counts of added, updated, unchanged and removed files.
+        """
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        with self._lock:
+            # Every path starting with prefix sorts between prefix and prefix + U+10FFFF
+            known = {row[0]: (row[1], row[2]) for row in self._conn.execute(
+                "SELECT path, size, mtime_ns FROM tracks WHERE path >= ? AND path < ?",
+                (prefix, prefix + "\U0010ffff"))}
+
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        rows = []
+        for path, st in _walk_audio(root):
+            previous = known.pop(path, None)
+            if previous == (st.st_size, st.st_mtime_ns):
+                stats["unchanged"] += 1
+                continue
+            stats["updated" if previous else "added"] += 1
+            rows.append(self._row(path, st))
+            if len(rows) >= SCAN_BATCH:
+                self._upsert(rows)
+                rows = []
+        if rows:
+            self._upsert(rows)
+
+        # Whatever wasn't seen on disk is gone
+        if known:
+            self.remove(known)
+        stats["removed"] = len(known)
+        return stats
+
+    def search(self, text: Optional[str] = None, artist: Optional[str] = None,
+               album: Optional[str] = None) -> List[Dict]:
+        """Tracks whose artist/album/title contain ``text`` (case-insensitive), or that match
+        ``artist``/``album`` exactly (also case-insensitive), ordered by artist, album and title."""
+        clauses, params = [], []
+        if text:
+            clauses.append("(artist LIKE ? OR album LIKE ? OR title LIKE ?)")
+            params.extend([f"%{text}%"] * 3)
+        if artist:
+            clauses.append("artist = ? COLLATE NOCASE")
+            params.append(artist)
+        if album:
+            clauses.append("album = ? COLLATE NOCASE")
+            params.append(album)
+        query = f"SELECT {', '.join(COLUMNS)} FROM tracks"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY artist COLLATE NOCASE, album COLLATE NOCASE, title COLLATE NOCASE"
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_catalog: Optional[LibraryCatalog] = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> Optional[LibraryCatalog]:
+    """Return the shared library catalog, or None when disabled in config or unavailable."""
+    global _catalog
+    if not get_download_setting("use_library_catalog", True):
+        return None
+    with _catalog_lock:
+        if _catalog is None:
+            path = get_download_setting("library_catalog_file") or get_state_path("library.db")
+            try:
+                _catalog = LibraryCatalog(os.path.expanduser(path))
+            except Exception as e:
+                logger.warning(f"Library catalog unavailable: {e}")
+                return None
+        return _catalog
+
+def catalog_files(files: List[str]):
+    """Add a finished job's files to the catalog; failures only log a warning."""
+    catalog = get_catalog()
+    if catalog is None or not files:
+        return
+    try:
+        catalog.update(files)
+    except Exception as e:
+        logger.warning(f"Could not update library catalog: {e}")
@@ -0,0 +1,442 @@
+"""Long-running download service with a small local HTTP API.
+
+    python daemon.py serve [--host HOST] [--port PORT]
+    python daemon.py submit URL --format mp3 [--output DIR]
+    python daemon.py list | status ID | cancel ID | events
+
+Endpoints (JSON unless noted):
+    POST   /jobs             submit {"url", "format", "output_dir"?, "platform"?}
+    GET    /jobs             list all jobs
+    GET    /jobs/<id>        one job
+    DELETE /jobs/<id>        cancel a job (a running one has its processes killed)
+    GET    /events           Server-Sent Events stream of job state changes and progress
+    GET    /progress         aggregate throughput plus progress of each running job
+    GET    /metrics          Prometheus text format (GET /metrics.json for JSON)
+    GET    /health           liveness check
+
+Jobs run on the same DownloadScheduler and pipelines as the CLI, in one
+process, so the yt-dlp engine, HTTP session, artwork cache and archive stay
+warm between requests.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from pipeline import BACKENDS, start_download
+from archive import get_archive
+from artwork import get_artwork_cache, get_session
+from scheduler import DownloadScheduler, RUNNING, DONE, FAILED, CANCELLED
+from settings import load_config, set_download_setting
+from procrunner import cancel_scope
+from progress import JobProgress, get_tracker, progress_scope
+from metrics import get_metrics
+from retry import CANCELLED as CANCELLED_CLASS
+from urls import detect_platform
+from ytdlp_engine import get_engine, use_inprocess_engine
+
+logger = logging.getLogger("daemon")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Finished jobs kept for status queries; older ones are forgotten
+MAX_FINISHED_JOBS = 1000
+# Idle SSE connections get a comment line this often so dead clients are noticed
+HEARTBEAT_SECONDS = 15
+# At most one progress event per job this often (stage changes always go out)
+PROGRESS_EVENT_SECONDS = 1.0
+# Events buffered for one SSE client; a client this far behind is disconnected
+SUBSCRIBER_QUEUE_SIZE = 256
+MAX_BODY_BYTES = 1 << 20
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def job_view(job: Dict) -> Dict:
+    """Public JSON view of a job dict."""
+    return {
+        'id': job['id'],
+        'url': job['url'],
+        'platform': job['platform'],
+        'format': job['format'],
+        'output_dir': job['output_dir'],
+        'status': job.get('status'),
+        'files': job.get('result') or [],
+        'error': job.get('error'),
+        'error_class': job.get('error_class'),
+        'attempts': job.get('attempts'),
+        'submitted_at': job.get('submitted_at'),
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at'),
+        'progress': _job_progress(job),
+    }
+
+def _job_progress(job: Dict) -> Optional[Dict]:
+    progress = get_tracker().get(job.get('id'))
+    return progress.to_dict() if progress is not None else None
+
+class DownloadDaemon:
+    """Owns the scheduler and job table and serves them over HTTP."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.jobs: "OrderedDict[int, Dict]" = OrderedDict()
+        self.scheduler = DownloadScheduler(self._run_job, max_workers=workers, status_callback=self._on_status)
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._progress_sent: Dict[int, Tuple[float, str]] = {}
+        self._progress_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def warm_up(self):
+        """Create the shared engine, HTTP session, caches and archive before the first job."""
+        get_session()
+        get_artwork_cache()
+        get_archive()
+        if use_inprocess_engine():
+            get_engine()
+
+    # -- jobs (scheduler threads) -----------------------------------------
+
+    def _run_job(self, job: Dict):
+        # The Future lets the slot take the next download while this one is converted and tagged
+        with cancel_scope(job['cancel_event']), progress_scope(job['id'], job['url']):
+            return start_download(job['platform'], job['url'], job['format'], job['output_dir'])
+
+    def _on_status(self, job: Dict, status: str, detail: str):
+        # Tracks a set fans out into finish with the set's job, not as jobs of their own
+        if 'parent' in job:
+            return
+        if status == FAILED and job.get('error_class') == CANCELLED_CLASS:
+            status = job['status'] = CANCELLED
+        if status == RUNNING:
+            job['started_at'] = time.time()
+        elif status in (DONE, FAILED, CANCELLED):
+            job['finished_at'] = time.time()
+            with self._progress_lock:
+                self._progress_sent.pop(job['id'], None)
+        event = {'event': status, 'detail': detail, 'job': job_view(job)}
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, event)
+
+    def _on_progress(self, progress: JobProgress):
+        """Tracker listener: publish a job's progress, throttled per job."""
+        job = self.jobs.get(progress.key)
+        if job is None or self._loop is None or job.get('status') != RUNNING:
+            return
+        now = time.monotonic()
+        with self._progress_lock:
+            sent_at, stage = self._progress_sent.get(progress.key, (0.0, None))
+            if stage == progress.stage and now - sent_at < PROGRESS_EVENT_SECONDS:
+                return
+            self._progress_sent[progress.key] = (now, progress.stage)
+        event = {'event': 'progress', 'detail': progress.describe(), 'job': job_view(job)}
+        self._loop.call_soon_threadsafe(self._publish, event)
+
+    def _publish(self, event: Dict):
+        for subscriber in list(self._subscribers):
+            if not subscriber.full():
+                subscriber.put_nowait(event)
+            elif event['event'] != 'progress':
+                # Progress ticks a slow client misses are simply dropped; a state change
+                # that doesn't fit disconnects it, and it resyncs with GET /jobs
+                self._subscribers.discard(subscriber)
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                subscriber.put_nowait(None)
+
+    def submit(self, payload: Dict) -> Dict:
+        """Validate a submission and hand it to the scheduler."""
+        url = str(payload.get('url') or '').strip()
+        if not url:
+            raise HttpError(400, "'url' is required")
+        output_format = payload.get('format') or load_config().get("default_format", "mp3")
+        if output_format not in ('mp3', 'wav'):
+            raise HttpError(400, "'format' must be mp3 or wav")
+        platform = payload.get('platform') or detect_platform(url)
+        if platform not in BACKENDS:
+            raise HttpError(400, f"Unsupported URL: {url}")
+        output_dir = os.path.expanduser(payload.get('output_dir') or load_config().get("default_output_dir", "."))
+
+        job = {
+            'url': url,
+            'platform': platform,
+            'format': output_format,
+            'output_dir': output_dir,
+            'submitted_at': time.time(),
+            'cancel_event': threading.Event(),
+        }
+        self.scheduler.submit(job)
+        self.jobs[job['id']] = job
+        self._forget_old_jobs()
+        return job
+
+    def cancel(self, job_id: int) -> Dict:
+        """Drop a queued job, or kill the processes of a running one."""
+        job = self.get(job_id)
+        if self.scheduler.cancel(job_id):
+            return job
+        if job.get('status') != RUNNING:
+            raise HttpError(409, f"Job {job_id} is {job.get('status')} and can no longer be cancelled")
+        job['cancel_event'].set()
+        return job
+
+    def get(self, job_id: int) -> Dict:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HttpError(404, f"No job {job_id}")
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job.get('status') in (DONE, FAILED, CANCELLED)]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    # -- HTTP (event loop) ------------------------------------------------
+
+    async def serve_forever(self):
+        self._loop = asyncio.get_running_loop()
+        await self._loop.run_in_executor(None, self.warm_up)
+        self.scheduler.start()
+        get_tracker().add_listener(self._on_progress)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"Download daemon listening on http://{self.host}:{self.port}")
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self.scheduler.shutdown(wait=False)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await self._read_request(reader)
+            if method == "GET" and path == "/events":
+                await self._stream_events(writer)
+                return
+            if method == "GET" and path == "/metrics":
+                await self._write_body(writer, 200, get_metrics().to_prometheus().encode('utf-8'),
+                                       "text/plain; version=0.0.4; charset=utf-8")
+                writer.close()
+                return
+            status, payload = self._route(method, path, body)
+        except HttpError as e:
+            status, payload = e.status, {'error': str(e)}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logger.exception("Request failed")
+            status, payload = 500, {'error': str(e)}
+
+        try:
+            await self._write_json(writer, status, payload)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        method, path = parts[0].upper(), parts[1].split('?', 1)[0]
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HttpError(400, "Malformed Content-Length")
+        if length < 0:
+            raise HttpError(400, "Malformed Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b''
+        return method, path, body
+
+    def _route(self, method: str, path: str, body: bytes) -> Tuple[int, object]:
+        segments = [s for s in path.split('/') if s]
+
+        if segments == ['health']:
+            return 200, {'status': 'ok', 'pending': self.scheduler.pending_count(),
+                         'active': self.scheduler.active_count()}
+
+        if segments == ['metrics.json'] and method == "GET":
+            return 200, get_metrics().snapshot()
+
+        if segments == ['progress'] and method == "GET":
+            tracker = get_tracker()
+            return 200, dict(tracker.aggregate(), jobs=[job.to_dict() for job in tracker.jobs()])
+
+        if segments == ['jobs']:
+            if method == "GET":
+                return 200, [job_view(job) for job in self.jobs.values()]
+            if method == "POST":
+                try:
+                    payload = json.loads(body or b'{}')
+                except ValueError:
+                    raise HttpError(400, "Body must be JSON")
+                if not isinstance(payload, dict):
+                    raise HttpError(400, "Body must be a JSON object")
+                return 201, job_view(self.submit(payload))
+            raise HttpError(405, f"{method} not allowed on /jobs")
+
+        if len(segments) == 2 and segments[0] == 'jobs':
+            try:
+                job_id = int(segments[1])
+            except ValueError:
+                raise HttpError(404, f"No job {segments[1]}")
+            if method == "GET":
+                return 200, job_view(self.get(job_id))
+            if method == "DELETE":
+                return 200, job_view(self.cancel(job_id))
+            raise HttpError(405, f"{method} not allowed on /jobs/<id>")
+
+        raise HttpError(404, f"Unknown path {path}")
+
+    async def _write_json(self, writer: asyncio.StreamWriter, status: int, payload: object):
+        await self._write_body(writer, status, json.dumps(payload).encode('utf-8'), "application/json")
+
+    async def _write_body(self, writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str):
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _stream_events(self, writer: asyncio.StreamWriter):
+        """Push job events to one client until it disconnects."""
+        subscriber: asyncio.Queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(subscriber)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    if event is None:
+                        writer.write(b": too far behind, reconnect and resync with GET /jobs\n\n")
+                        await writer.drain()
+                        break
+                    writer.write(f"event: {event['event']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._subscribers.discard(subscriber)
+            writer.close()
+
+# -- client ---------------------------------------------------------------
+
+def _request(base_url: str, method: str, path: str, payload: Optional[Dict] = None):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        message = json.loads(e.read() or b'{}').get('error', e.reason)
+        raise SystemExit(f"Error {e.code}: {message}")
+    except urllib.error.URLError as e:
+        raise SystemExit(f"Daemon not reachable at {base_url}: {e.reason}")
+
+def follow_events(base_url: str):
+    """Print each event from the daemon's stream as one JSON line."""
+    try:
+        with urllib.request.urlopen(base_url + "/events") as response:
+            for raw in response:
+                line = raw.decode('utf-8').rstrip('\n')
+                if line.startswith('data: '):
+                    print(line[len('data: '):], flush=True)
+    except urllib.error.URLError as e:
+        raise SystemExit(f"Daemon not reachable at {base_url}: {e.reason}")
+
+def main():
+    daemon_config = load_config().get("daemon", {})
+
+    parser = argparse.ArgumentParser(description='Universal Music Downloader service and client')
+    parser.add_argument('--host', default=daemon_config.get("host", DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=daemon_config.get("port", DEFAULT_PORT))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Run the daemon')
+    serve.add_argument('--workers', type=int, help='Concurrent downloads (default: max_concurrent_downloads)')
+
+    submit = commands.add_parser('submit', help='Queue a download')
+    submit.add_argument('url')
+    submit.add_argument('--format', choices=['mp3', 'wav'])
+    submit.add_argument('--output', help='Output directory (default: default_output_dir)')
+
+    commands.add_parser('list', help='List jobs')
+    status = commands.add_parser('status', help='Show one job')
+    status.add_argument('job_id', type=int)
+    cancel = commands.add_parser('cancel', help='Cancel a queued job')
+    cancel.add_argument('job_id', type=int)
+    commands.add_parser('events', help='Follow job events (one JSON object per line)')
+
+    args = parser.parse_args()
+    base_url = f"http://{args.host}:{args.port}"
+
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        if args.workers:
+            # The bandwidth cap is split across this many slots
+            set_download_setting("max_concurrent_downloads", args.workers)
+        try:
+            asyncio.run(DownloadDaemon(args.host, args.port, args.workers).serve_forever())
+        except KeyboardInterrupt:
+            logger.info("Daemon stopped")
+        return
+
+    if args.command == 'events':
+        follow_events(base_url)
+        return
+
+    if args.command == 'submit':
+        payload = {'url': args.url}
+        if args.format:
+            payload['format'] = args.format
+        if args.output:
+            payload['output_dir'] = args.output
+        result = _request(base_url, 'POST', '/jobs', payload)
+    elif args.command == 'list':
+        result = _request(base_url, 'GET', '/jobs')
+    elif args.command == 'status':
+        result = _request(base_url, 'GET', f'/jobs/{args.job_id}')
+    else:
+        result = _request(base_url, 'DELETE', f'/jobs/{args.job_id}')
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
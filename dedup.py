@@ -0,0 +1,205 @@
+import os
+import mmap
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import List, Optional, Tuple
+
+from settings import get_download_setting, get_state_path
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# What to do with a file whose audio is already in the library
+OFF = "off"
+HARDLINK = "hardlink"  # Replace the new copy with a hard link to the existing file
+SKIP = "skip"  # Delete the new copy and use the existing file as the job's result
+MODES = (OFF, HARDLINK, SKIP)
+
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+HASH_CHUNK = 1024 * 1024
+
+def _id3v2_end(view, size: int) -> int:
+    """Offset just past any ID3v2 tags (including padding) at the start of the file."""
+    offset = 0
+    while size - offset >= 10 and view[offset:offset + 3] == b"ID3":
+        header = view[offset:offset + 10]
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        footer = 10 if header[5] & 0x10 else 0
+        offset += 10 + tag_size + footer
+    return min(offset, size)
+
+def _wav_data_range(view, size: int) -> Optional[Tuple[int, int]]:
+    """Start and end of the ``data`` chunk of a RIFF/WAVE file, or None."""
+    if size < 12 or view[0:4] != b"RIFF" or view[8:12] != b"WAVE":
+        return None
+    offset = 12
+    while offset + 8 <= size:
+        chunk_id = view[offset:offset + 4]
+        chunk_size = int.from_bytes(view[offset + 4:offset + 8], "little")
+        if chunk_id == b"data":
+            return offset + 8, min(offset + 8 + chunk_size, size)
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+def payload_range(view, size: int) -> Tuple[int, int]:
+    """The bytes that hold audio: a WAV's data chunk, or an MP3 minus its ID3v2/ID3v1 tags."""
+    wav = _wav_data_range(view, size)
+    if wav is not None:
+        return wav
+    start = _id3v2_end(view, size)
+    end = size
+    if end - start >= 128 and view[end - 128:end - 125] == b"TAG":
+        end -= 128
+    return start, end
+
+def audio_digest(path: str) -> str:
+    """Hash of a file's audio payload, so copies that only differ in tags match."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                start, end = payload_range(view, size)
+                for offset in range(start, end, HASH_CHUNK):
+                    digest.update(view[offset:min(offset + HASH_CHUNK, end)])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+class DedupIndex:
+    """SQLite index of audio payload hashes for every file the downloader kept.
+
+    ``dedupe`` looks a new file up by its hash and, when the same audio is
+    already stored, replaces the new copy with a hard link (or drops it).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER,
+                added_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_digest ON files (digest)")
+        self._conn.commit()
+        # Held while deciding on a file, so two copies finishing together still meet
+        self._decide_lock = threading.Lock()
+
+    def paths_for(self, digest: str) -> List[str]:
+        """Indexed files with this audio hash, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM files WHERE digest = ? ORDER BY added_at",
+                                      (digest,)).fetchall()
+        return [row[0] for row in rows]
+
+    def add(self, path: str, digest: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO files (path, digest, size, added_at) VALUES (?, ?, ?, ?)",
+                               (path, digest, os.path.getsize(path), time.time()))
+            self._conn.commit()
+
+    def remove(self, path: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._conn.commit()
+
+    def dedupe(self, path: str, mode: str = HARDLINK) -> Tuple[str, Optional[str], int]:
+        """Index ``path`` and deal with it if its audio is already stored.
+
+        Returns ``(path to use, existing copy or None, bytes reclaimed)``.
+        Candidates are re-hashed before anything is touched, and a copy that
+        can't be linked (other filesystem, no permission) is simply kept.
+        """
+        path = os.path.abspath(path)
+        digest = audio_digest(path)
+        with self._decide_lock:
+            for existing in self.paths_for(digest):
+                if existing == path:
+                    continue
+                try:
+                    if os.path.samefile(existing, path):
+                        self.add(path, digest)
+                        return path, existing, 0  # Already linked
+                    if audio_digest(existing) != digest:
+                        self.remove(existing)  # Replaced by other audio since
+                        continue
+                except OSError:
+                    self.remove(existing)  # Deleted or unreadable
+                    continue
+
+                size = os.path.getsize(path)
+                if mode == SKIP:
+                    os.remove(path)
+                    return existing, existing, size
+                link = path + ".umd-link"
+                try:
+                    os.link(existing, link)
+                    os.replace(link, path)
+                except OSError as e:
+                    logger.info(f"Could not hard-link {path} to {existing}: {e}")
+                    if os.path.exists(link):
+                        os.remove(link)
+                    continue
+                self.add(path, digest)
+                return path, existing, size
+
+            self.add(path, digest)
+            return path, None, 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_index: Optional[DedupIndex] = None
+_index_lock = threading.Lock()
+
+def dedup_mode() -> str:
+    """Configured ``dedup_mode``; unknown values count as off."""
+    mode = get_download_setting("dedup_mode", OFF) or OFF
+    return mode if mode in MODES else OFF
+
+def get_dedup_index() -> Optional[DedupIndex]:
+    """Return the shared dedup index, or None if it couldn't be opened."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            try:
+                _index = DedupIndex(get_state_path("dedup.db"))
+            except Exception as e:
+                logger.warning(f"Dedup index unavailable: {e}")
+                return None
+        return _index
+
+def dedupe_file(path: str, mode: Optional[str] = None) -> Tuple[str, Optional[str], int]:
+    """Dedupe one file with the shared index and count the result; see DedupIndex.dedupe."""
+    mode = mode or dedup_mode()
+    index = get_dedup_index()
+    if mode == OFF or index is None:
+        return path, None, 0
+    result = index.dedupe(path, mode)
+    if result[2]:
+        get_metrics().count("dedup_files", mode=mode)
+        get_metrics().count("dedup_bytes", result[2], mode=mode)
+    return result
+
+def reclaimed_summary() -> Optional[str]:
+    """One-line report of the space deduplication saved in this run, or None."""
+    counters = get_metrics().snapshot()['counters']
+    files = sum(entry['value'] for entry in counters.get('dedup_files', []))
+    if not files:
+        return None
+    reclaimed = sum(entry['value'] for entry in counters.get('dedup_bytes', []))
+    return f"♻️ {int(files)} duplicate file(s), {reclaimed / (1024 * 1024):.1f} MB reclaimed"
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import importlib.util
+from typing import Dict, List, Optional
+
+from settings import get_state_path
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = "dependencies.json"
+CACHE_VERSION = 1
+
+# Executable name -> Python module that can stand in for it (run as python -m)
+PYTHON_MODULES = {
+    "yt-dlp": "yt_dlp",
+    "spotdl": "spotdl",
+}
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _module_location(module: str) -> Optional[str]:
+    """Where a module is installed, found without importing it."""
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None:
+        return None
+    if spec.submodule_search_locations:
+        return list(spec.submodule_search_locations)[0]
+    return spec.origin or module  # Frozen builds may not expose a file
+
+def probe(name: str, local_path: Optional[str] = None) -> Dict:
+    """Find one dependency: a bundled binary, an executable on PATH, or a Python module.
+
+    Returns ``{'name', 'available', 'source', 'path'}`` where source is
+    ``local``, ``path``, ``module`` or None.
+    """
+    if local_path and os.path.exists(local_path):
+        return {'name': name, 'available': True, 'source': 'local', 'path': local_path}
+    found = shutil.which(name)
+    if found:
+        return {'name': name, 'available': True, 'source': 'path', 'path': os.path.realpath(found)}
+    module = PYTHON_MODULES.get(name)
+    location = _module_location(module) if module else None
+    if location:
+        return {'name': name, 'available': True, 'source': 'module', 'path': location}
+    return {'name': name, 'available': False, 'source': None, 'path': None}
+
+def _environment_key() -> Dict:
+    # A different interpreter or PATH can change every answer
+    return {'version': CACHE_VERSION, 'python': sys.executable, 'PATH': os.environ.get('PATH', '')}
+
+def _still_valid(result: Dict, local_path: Optional[str]) -> bool:
+    """A cached hit stays valid while the file it pointed at is unchanged."""
+    if not result.get('available'):
+        return False  # Always look again for missing tools, they may have been installed
+    if local_path and result['source'] != 'local' and os.path.exists(local_path):
+        return False  # A bundled binary appeared and takes precedence
+    path = result.get('path')
+    if path and os.path.exists(path):
+        return _mtime(path) == result.get('mtime')
+    return result['source'] == 'module' and not os.path.isabs(path or '')
+
+def _load_cache(path: str) -> Dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('environment') != _environment_key():
+        return {}
+    return cache.get('results', {})
+
+def detect_dependencies(names: List[str], local_paths: Optional[Dict[str, str]] = None,
+                        cache_path: Optional[str] = None) -> Dict[str, Dict]:
+    """Probe dependencies, reusing cached answers whose executable/package is unchanged.
+
+    Nothing is imported: Python modules are located with ``find_spec``, and
+    a cached hit only costs a ``stat`` of the file or package directory it
+    was found at.
+    """
+    local_paths = local_paths or {}
+    if cache_path is None:
+        cache_path = get_state_path(CACHE_FILE)
+    cached = _load_cache(cache_path)
+
+    results = {}
+    changed = False
+    for name in names:
+        local_path = local_paths.get(name)
+        result = cached.get(name)
+        if result is None or not _still_valid(result, local_path):
+            result = probe(name, local_path)
+            if result['path'] and os.path.exists(result['path']):
+                result['mtime'] = _mtime(result['path'])
+            changed = True
+        results[name] = result
+
+    if changed:
+        try:
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'environment': _environment_key(), 'results': results}, f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write dependency cache {cache_path}: {e}")
+    return results
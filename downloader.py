@@ -5,12 +5,22 @@ import sys
 import shutil
 import json
 import logging
-from pathlib import Path
-from typing import Dict, List, Optional
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC, TDRC
-from mutagen.wave import WAVE
-import requests
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from ytdlp_engine import use_inprocess_engine
+from archive import find_archived, get_archive
+from catalog import get_catalog
+from dedup import AUDIO_EXTENSIONS, HARDLINK, OFF as DEDUP_OFF, dedup_mode, dedupe_file, reclaimed_summary
+from settings import get_download_setting, set_download_setting
+from scheduler import DownloadScheduler, RUNNING, DONE, FAILED
+from urls import detect_platform
+from pipeline import BACKENDS, download, start_download
+from metrics import export_metrics, get_metrics
+from progress import DOWNLOADING, ProgressEvent, format_bytes, format_eta, progress_scope
+from ratelimit import parse_rate
 
 # Setup logging
 logging.basicConfig(
@@ -23,260 +33,178 @@ def is_exe(name: str) -> bool:
     """Check if an executable is available in PATH."""
     return shutil.which(name) is not None
 
-def download_image(url: str, output_path: str) -> bool:
-    """Download album art from URL."""
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        return True
-    except Exception as e:
-        logger.error(f"Failed to download album art: {e}")
-        return False
+# Minimum seconds between progress log lines for one download
+PROGRESS_LOG_INTERVAL = 5.0
 
-def get_track_metadata(file_path: str, platform: str) -> Dict:
-    """Extract metadata from downloaded file using yt-dlp info."""
-    metadata = {
-        "title": "",
-        "artist": "Unknown Artist",
-        "album": "Unknown Album",
-        "year": "",
-        "artwork_url": None
-    }
+def progress_logger() -> Callable[[ProgressEvent], None]:
+    """Progress callback for one download that logs at most every PROGRESS_LOG_INTERVAL seconds."""
+    last_logged = [0.0]
     
-    try:
-        # Try to get metadata from yt-dlp info json
-        info_file = file_path.replace('.mp3', '.info.json').replace('.wav', '.info.json')
-        if os.path.exists(info_file):
-            with open(info_file, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-                metadata['title'] = info.get('title', os.path.basename(file_path))
-                metadata['artist'] = info.get('artist') or info.get('uploader', 'Unknown Artist')
-                metadata['album'] = info.get('album', 'Unknown Album')
-                metadata['year'] = str(info.get('release_year', ''))
-                metadata['artwork_url'] = info.get('thumbnail')
-    except Exception as e:
-        logger.warning(f"Could not extract metadata from info file: {e}")
-        # Fallback to filename
-        metadata['title'] = os.path.splitext(os.path.basename(file_path))[0]
+    def log_progress(event: ProgressEvent):
+        now = time.time()
+        if event.stage != DOWNLOADING or event.downloaded_bytes is None or now - last_logged[0] < PROGRESS_LOG_INTERVAL:
+            return
+        last_logged[0] = now
+        logger.info(f"  {format_bytes(event.downloaded_bytes)} of {format_bytes(event.total_bytes)} "
+                    f"at {format_bytes(event.speed)}/s, ETA {format_eta(event.eta)}")
     
-    return metadata
-
-def embed_metadata_mp3(file_path: str, metadata: Dict, artwork_path: Optional[str] = None):
-    """Embed metadata into MP3 file."""
-    try:
-        audio = MP3(file_path, ID3=ID3)
-        try:
-            audio.add_tags()
-        except:
-            pass
-        
-        audio.tags["TIT2"] = TIT2(encoding=3, text=metadata["title"])
-        audio.tags["TPE1"] = TPE1(encoding=3, text=metadata["artist"])
-        audio.tags["TALB"] = TALB(encoding=3, text=metadata["album"])
-        
-        if metadata.get("year"):
-            audio.tags["TDRC"] = TDRC(encoding=3, text=metadata["year"])
-        
-        # Embed album art
-        if artwork_path and os.path.exists(artwork_path):
-            with open(artwork_path, 'rb') as img:
-                audio.tags.add(
-                    APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,
-                        desc='Cover',
-                        data=img.read()
-                    )
-                )
-        
-        audio.save()
-        logger.info(f"Embedded metadata into: {file_path}")
-    except Exception as e:
-        logger.error(f"Failed to embed MP3 metadata: {e}")
+    return log_progress
 
-def embed_metadata_wav(file_path: str, metadata: Dict):
-    """Embed metadata into WAV file."""
-    try:
-        audio = WAVE(file_path)
-        audio["INAM"] = metadata["title"]
-        audio["IART"] = metadata["artist"]
-        audio["IPRD"] = metadata["album"]
-        if metadata.get("year"):
-            audio["ICRD"] = metadata["year"]
-        audio.save()
-        logger.info(f"Embedded metadata into: {file_path}")
-    except Exception as e:
-        logger.error(f"Failed to embed WAV metadata: {e}")
+def download_url(platform: str, url: str, output_format: str, output_dir: str = ".") -> List[str]:
+    """Download one URL with its platform's backend, waiting until its files are converted and tagged."""
+    logger.info(f"Downloading from {BACKENDS[platform].display_name}: {url}")
+    return download(platform, url, output_format, output_dir, on_event=progress_logger())
 
-def download_soundcloud(url: str, output_format: str, output_dir: str = ".") -> List[str]:
-    """Download from SoundCloud with metadata and album art."""
-    logger.info(f"Downloading from SoundCloud: {url}")
-    
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    out_template = str(output_path / "%(title)s.%(ext)s")
-    
-    # Download with metadata
-    args = [
-        "yt-dlp",
-        "--extract-audio",
-        "--audio-format", output_format,
-        "--audio-quality", "0",  # Best quality
-        "--embed-thumbnail",  # Embed artwork
-        "--write-info-json",  # Save metadata
-        "--add-metadata",  # Add metadata to file
-        "--no-playlist",  # Don't download playlists accidentally
-        "--ignore-errors",  # Continue on errors
-        "--no-overwrites",  # Don't overwrite existing files
-        "--continue",  # Resume incomplete downloads
-        "-o", out_template,
-        url
-    ]
-    
-    if output_format == "mp3":
-        args.extend(["--postprocessor-args", "ffmpeg:-b:a 320k -ar 44100"])  # Force 320kbps, 44.1kHz
-    
-    subprocess.run(args, check=True)
-    
-    # Find downloaded files
-    downloaded_files = []
-    for file in output_path.glob(f"*.{output_format}"):
-        if file.stat().st_mtime > (os.path.getmtime(output_dir) - 60):  # Recent files
-            downloaded_files.append(str(file))
-            
-            # Download and embed album art
-            metadata = get_track_metadata(str(file), "soundcloud")
-            if metadata['artwork_url']:
-                artwork_path = str(file).replace(f'.{output_format}', '.jpg')
-                if download_image(metadata['artwork_url'], artwork_path):
-                    if output_format == "mp3":
-                        embed_metadata_mp3(str(file), metadata, artwork_path)
-                    os.remove(artwork_path)  # Clean up temp artwork
-            
-            # Clean up info json
-            info_file = str(file).replace(f'.{output_format}', '.info.json')
-            if os.path.exists(info_file):
-                os.remove(info_file)
+def list_archive(platform: Optional[str] = None):
+    """Print the download archive contents."""
+    archive = get_archive()
+    if archive is None:
+        logger.error("The download archive is disabled in config.json")
+        sys.exit(1)
     
-    return downloaded_files
+    entries = archive.entries(platform)
+    for entry in entries:
+        downloaded_at = datetime.fromtimestamp(entry['downloaded_at']).strftime("%Y-%m-%d %H:%M")
+        print(f"{entry['platform']:<11} {entry['track_id']:<40} {downloaded_at}  {entry['url']}")
+        for file in entry['files']:
+            print(f"{'':<11} • {file}")
+    print(f"{len(entries)} track(s) in archive: {archive.path}")
 
-def download_spotify(url: str, output_format: str, output_dir: str = ".") -> List[str]:
-    """Download from Spotify with metadata and album art."""
-    logger.info(f"Downloading from Spotify: {url}")
-    
-    if not is_exe('spotdl'):
-        logger.error('spotdl is required: pip install spotdl')
-        return []
-    
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    original_dir = os.getcwd()
-    os.chdir(output_path)
-    
+def dedup_scan(folder: str):
+    """Index the audio files under ``folder`` and dedupe them against each other and past downloads."""
+    mode = dedup_mode() if dedup_mode() != DEDUP_OFF else HARDLINK
+    checked = 0
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                _, existing, reclaimed = dedupe_file(path, mode)
+            except OSError as e:
+                logger.warning(f"Could not check {path}: {e}")
+                continue
+            checked += 1
+            if reclaimed:
+                logger.info(f"{path} duplicates {existing} ({mode})")
+    logger.info(f"Checked {checked} audio file(s)")
+    logger.info(reclaimed_summary() or "No duplicates found")
+
+def library_scan(folder: str):
+    """Bring the library catalog up to date with the audio files under ``folder``."""
+    catalog = get_catalog()
+    if catalog is None:
+        logger.error("The library catalog is disabled in config.json")
+        sys.exit(1)
+    start = time.perf_counter()
+    stats = catalog.rescan(folder)
+    logger.info(f"Scanned {folder} in {time.perf_counter() - start:.1f}s: {stats['added']} added, "
+                f"{stats['updated']} updated, {stats['removed']} removed, {stats['unchanged']} unchanged")
+
+def library_find(text: str):
+    """Print the cataloged tracks whose artist, album or title contain ``text``."""
+    catalog = get_catalog()
+    if catalog is None:
+        logger.error("The library catalog is disabled in config.json")
+        sys.exit(1)
+    tracks = catalog.search(text)
+    albums = set()
+    for track in tracks:
+        album = (track['artist'] or "Unknown Artist", track['album'] or "Unknown Album")
+        if album not in albums:
+            albums.add(album)
+            year = f" ({track['year'][:4]})" if track['year'] else ""
+            print(f"{album[0]} — {album[1]}{year}")
+        print(f"    {track['title'] or os.path.basename(track['path']):<40} {track['format']:<4} {track['path']}")
+    print(f"{len(tracks)} track(s) in {len(albums)} album(s) matching {text!r}")
+
+def read_batch_urls(source: str):
+    """Yield URLs from a batch file (or stdin for ``-``), skipping blanks and # comments."""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
     try:
-        # spotDL downloads as MP3 with metadata
-        cmd = ['spotdl', '--format', 'mp3', '--bitrate', '320k', url]
-        subprocess.run(cmd, check=True)
-        
-        # Find downloaded MP3 files
-        downloaded_files = []
-        mp3_files = [f for f in os.listdir('.') if f.endswith('.mp3') and 
-                     os.path.getmtime(f) > (os.path.getmtime('.') - 60)]
-        
-        for mp3_file in mp3_files:
-            if output_format == "wav":
-                # Convert to WAV
-                wav_file = mp3_file.replace('.mp3', '.wav')
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", mp3_file,
-                    "-acodec", "pcm_s16le",  # CD quality WAV
-                    "-ar", "44100",
-                    wav_file
-                ], check=True)
-                
-                # Copy metadata to WAV
-                try:
-                    mp3_audio = MP3(mp3_file)
-                    metadata = {
-                        "title": str(mp3_audio.get("TIT2", "")),
-                        "artist": str(mp3_audio.get("TPE1", "")),
-                        "album": str(mp3_audio.get("TALB", "")),
-                        "year": str(mp3_audio.get("TDRC", ""))
-                    }
-                    embed_metadata_wav(wav_file, metadata)
-                except Exception as e:
-                    logger.warning(f"Could not transfer metadata to WAV: {e}")
-                
-                os.remove(mp3_file)  # Remove original MP3
-                downloaded_files.append(str(output_path / wav_file))
-            else:
-                downloaded_files.append(str(output_path / mp3_file))
-        
-        return downloaded_files
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
     finally:
-        os.chdir(original_dir)
+        if stream is not sys.stdin:
+            stream.close()
 
-def download_applemusic(url: str, output_format: str, output_dir: str = ".") -> List[str]:
-    """Download from Apple Music with metadata and album art."""
-    logger.info(f"Downloading from Apple Music: {url}")
+def run_batch(source: str, output_format: str, output_dir: str = ".", workers: Optional[int] = None) -> int:
+    """Download every URL in a batch list concurrently, streaming one JSON line per finished item.
+
+    Results go to stdout; everything else (logs, tool output) goes to stderr so
+    stdout can be piped straight into other tooling. Returns the number of failures.
+    """
+    # Keep the real stdout for results and point fd 1 at stderr, so nothing
+    # a tool or library prints can end up in the JSONL stream
+    sys.stdout.flush()
+    results = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8', buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    
+    write_lock = threading.Lock()
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
     
-    if not is_exe('spotdl'):
-        logger.error('spotdl is required: pip install spotdl')
-        return []
+    def emit(job: Dict, status: str, error: Optional[str] = None):
+        finished = time.time()
+        started = job.get('started_at', finished)
+        record = {
+            'url': job['url'],
+            'platform': job.get('platform'),
+            'status': status,
+            'files': job.get('result') or [],
+            'queued_at': job.get('queued_at'),
+            'started_at': started,
+            'finished_at': finished,
+            'duration': round(finished - started, 3),
+            'attempts': job.get('attempts', 1),
+            'error': error,
+            'error_class': job.get('error_class'),
+        }
+        with write_lock:
+            counts[status] += 1
+            results.write(json.dumps(record) + "\n")
     
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+    def handle(job: Dict):
+        archived = find_archived(job['platform'], job['url'], output_format)
+        if archived:
+            get_metrics().count("archive_hits", platform=job['platform'])
+            job['skipped'] = True
+            return archived
+        # Returns a Future: the slot frees up while the files are converted and tagged
+        with progress_scope(job['id'], job['url']):
+            return start_download(job['platform'], job['url'], output_format, output_dir,
+                                  on_event=progress_logger())
     
-    original_dir = os.getcwd()
-    os.chdir(output_path)
+    def on_status(job: Dict, status: str, detail: str):
+        # Tracks of a set are reported through the set's own line
+        if 'parent' in job:
+            return
+        if status == RUNNING:
+            job['started_at'] = time.time()
+        elif status == DONE:
+            emit(job, 'skipped' if job.get('skipped') else 'done')
+        elif status == FAILED:
+            emit(job, 'failed', job.get('error'))
     
+    scheduler = DownloadScheduler(handle, max_workers=workers, status_callback=on_status)
+    scheduler.start()
     try:
-        # spotDL also supports Apple Music URLs
-        cmd = ['spotdl', '--format', 'mp3', '--bitrate', '320k', url]
-        subprocess.run(cmd, check=True)
-        
-        # Find downloaded MP3 files
-        downloaded_files = []
-        mp3_files = [f for f in os.listdir('.') if f.endswith('.mp3') and 
-                     os.path.getmtime(f) > (os.path.getmtime('.') - 60)]
-        
-        for mp3_file in mp3_files:
-            if output_format == "wav":
-                # Convert to WAV
-                wav_file = mp3_file.replace('.mp3', '.wav')
-                subprocess.run([
-                    "ffmpeg", "-y", "-i", mp3_file,
-                    "-acodec", "pcm_s16le",  # CD quality WAV
-                    "-ar", "44100",
-                    wav_file
-                ], check=True)
-                
-                # Copy metadata to WAV
-                try:
-                    mp3_audio = MP3(mp3_file)
-                    metadata = {
-                        "title": str(mp3_audio.get("TIT2", "")),
-                        "artist": str(mp3_audio.get("TPE1", "")),
-                        "album": str(mp3_audio.get("TALB", "")),
-                        "year": str(mp3_audio.get("TDRC", ""))
-                    }
-                    embed_metadata_wav(wav_file, metadata)
-                except Exception as e:
-                    logger.warning(f"Could not transfer metadata to WAV: {e}")
-                
-                os.remove(mp3_file)  # Remove original MP3
-                downloaded_files.append(str(output_path / wav_file))
-            else:
-                downloaded_files.append(str(output_path / mp3_file))
-        
-        return downloaded_files
+        # Submit while reading so a long stdin stream starts downloading right away
+        for url in read_batch_urls(source):
+            job = {'url': url, 'platform': detect_platform(url), 'queued_at': time.time()}
+            if job['platform'] is None:
+                emit(job, 'failed', "Unsupported URL: could not detect platform")
+                continue
+            scheduler.submit(job)
+        scheduler.join()
     finally:
-        os.chdir(original_dir)
+        scheduler.shutdown()
+        results.close()
+    
+    logger.info(f"Batch finished: {counts['done']} downloaded, {counts['skipped']} skipped, "
+                f"{counts['failed']} failed")
+    return counts['failed']
 
 def main():
     parser = argparse.ArgumentParser(
@@ -287,6 +215,8 @@ Examples:
   %(prog)s --soundcloud https://soundcloud.com/artist/track --format mp3
   %(prog)s --spotify https://open.spotify.com/track/... --format wav --output ./downloads
   %(prog)s --applemusic https://music.apple.com/us/album/... --format mp3
+  %(prog)s --batch urls.txt --format mp3 --workers 4 > results.jsonl
+  %(prog)s --archive-list
   
 ⚠️  For educational purposes only. Respect copyright and platform ToS.
         """
@@ -296,37 +226,97 @@ Examples:
     group.add_argument('--soundcloud', help='SoundCloud track/playlist URL')
     group.add_argument('--spotify', help='Spotify track/album/playlist URL')
     group.add_argument('--applemusic', help='Apple Music track/album/playlist URL')
+    group.add_argument('--batch', metavar='FILE',
+                       help='Download every URL listed in FILE (one per line, "-" for stdin), '
+                            'auto-detecting the platform; prints one JSON result per line')
+    group.add_argument('--archive-list', nargs='?', const='all', metavar='PLATFORM',
+                       choices=['all', 'soundcloud', 'spotify', 'applemusic'],
+                       help='List tracks in the download archive (optionally for one platform) and exit')
+    group.add_argument('--library-scan', metavar='DIR',
+                       help='Catalog the audio files under DIR (only new or changed files are read) and exit')
+    group.add_argument('--library-find', metavar='TEXT',
+                       help='List cataloged tracks whose artist, album or title contain TEXT and exit')
+    group.add_argument('--dedup-scan', metavar='DIR',
+                       help='Hard-link (or, with dedup_mode "skip", delete) audio files under DIR whose audio '
+                            'is already in the library, report the space reclaimed and exit')
     
-    parser.add_argument('--format', choices=['mp3', 'wav'], required=True,
+    parser.add_argument('--format', choices=['mp3', 'wav'],
                         help='Output format: mp3 (320kbps) or wav (lossless)')
     parser.add_argument('--output', default='.',
                         help='Output directory for downloaded files (default: current directory)')
+    parser.add_argument('--workers', type=int,
+                        help='Concurrent downloads in batch mode (default: max_concurrent_downloads)')
+    parser.add_argument('--limit-rate', metavar='RATE',
+                        help='Cap the combined download speed, e.g. 2M or 500K bytes/sec (default: max_download_rate)')
+    parser.add_argument('--metrics-json', metavar='FILE', default=get_download_setting("metrics_json_file"),
+                        help='Write per-stage timings and counters for this run as JSON')
+    parser.add_argument('--metrics-prom', metavar='FILE', default=get_download_setting("metrics_prometheus_file"),
+                        help='Write the same metrics in Prometheus text format (e.g. for the node_exporter textfile collector)')
+    parser.add_argument('--no-archive', action='store_true',
+                        help='Ignore the download archive and download again')
     
     args = parser.parse_args()
 
+    if args.archive_list:
+        list_archive(None if args.archive_list == 'all' else args.archive_list)
+        return
+    if args.library_scan:
+        library_scan(args.library_scan)
+        return
+    if args.library_find:
+        library_find(args.library_find)
+        return
+    if args.dedup_scan:
+        dedup_scan(args.dedup_scan)
+        return
+    if not args.format:
+        parser.error('--format is required when downloading')
+    if args.no_archive:
+        set_download_setting("use_archive", False)
+    if args.limit_rate:
+        try:
+            parse_rate(args.limit_rate)
+        except ValueError as e:
+            parser.error(str(e))
+        set_download_setting("max_download_rate", args.limit_rate)
+    if args.workers:
+        # The bandwidth cap is split across this many slots
+        set_download_setting("max_concurrent_downloads", args.workers)
+
     # Check dependencies
     if not is_exe('ffmpeg'):
         logger.error('ffmpeg not found! Please install it from https://ffmpeg.org/')
         sys.exit(1)
-    if not is_exe('yt-dlp'):
+    if not is_exe('yt-dlp') and not use_inprocess_engine():
         logger.error('yt-dlp not found! Install: pip install yt-dlp')
         sys.exit(1)
 
     try:
-        downloaded = []
-        if args.soundcloud:
-            downloaded = download_soundcloud(args.soundcloud, args.format, args.output)
-        elif args.spotify:
-            downloaded = download_spotify(args.spotify, args.format, args.output)
-        elif args.applemusic:
-            downloaded = download_applemusic(args.applemusic, args.format, args.output)
+        if args.batch:
+            try:
+                failures = run_batch(args.batch, args.format, args.output, args.workers)
+            except OSError as e:
+                logger.error(f"Could not read batch list: {e}")
+                sys.exit(1)
+            sys.exit(1 if failures else 0)
+        
+        download_single(args)
+    finally:
+        summary = reclaimed_summary()
+        if summary:
+            logger.info(summary)
+        # Written on every exit path, including failures
+        export_metrics(args.metrics_json, args.metrics_prom)
+
+def download_single(args):
+    """Download the one URL given with --soundcloud/--spotify/--applemusic."""
+    platform, url = next((name, getattr(args, name)) for name in BACKENDS if getattr(args, name))
+    try:
+        downloaded = download_url(platform, url, args.format, args.output)
         
-        if downloaded:
-            logger.info(f"\n✅ Successfully downloaded {len(downloaded)} file(s):")
-            for file in downloaded:
-                logger.info(f"  • {file}")
-        else:
-            logger.warning("No files were downloaded.")
+        logger.info(f"\n✅ Successfully downloaded {len(downloaded)} file(s):")
+        for file in downloaded:
+            logger.info(f"  • {file}")
             
     except subprocess.CalledProcessError as e:
         logger.error(f"Download failed: {e}")
@@ -1,394 +1,79 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
-import subprocess
 import os
-import shutil
-import json
 import queue
 import sys
+import logging
+import logging.handlers
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, APIC, TDRC
-from mutagen.wave import WAVE
-import requests
-
-# Get local FFmpeg path
-SCRIPT_DIR = Path(__file__).parent
-FFMPEG_LOCAL = SCRIPT_DIR / "ffmpeg" / "ffmpeg-8.0-essentials_build" / "bin" / "ffmpeg.exe"
-
-def get_ffmpeg_path():
-    """Get FFmpeg executable path (local or system)."""
-    if FFMPEG_LOCAL.exists():
-        return str(FFMPEG_LOCAL)
-    return shutil.which("ffmpeg") or "ffmpeg"
-
-def get_python_executable():
-    """Get Python executable path."""
-    return sys.executable
+from typing import Callable, Dict, List, Optional, Union
 
-def is_exe(name):
-    """Check if an executable is available in PATH or as Python module."""
-    # Check if it's in PATH
-    if shutil.which(name) is not None:
-        return True
-    
-    # For Python packages, check if module exists
-    if name == "yt-dlp":
-        try:
-            import yt_dlp
-            return True
-        except ImportError:
-            return False
-    elif name == "spotdl":
-        try:
-            import spotdl
-            return True
-        except ImportError:
-            return False
-    elif name == "ffmpeg":
-        # Check local ffmpeg
-        return FFMPEG_LOCAL.exists() or shutil.which("ffmpeg") is not None
-    
-    return False
+from scheduler import DownloadScheduler, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from settings import get_download_setting, get_state_path, load_config
+from archive import find_archived
+from transcode import FFMPEG_LOCAL
+from pipeline import BACKENDS, start_download
+from depcheck import detect_dependencies, probe
+from metrics import export_metrics, get_metrics
+from dedup import reclaimed_summary
+from progress import format_bytes, format_eta, get_tracker, progress_scope
+from jobstore import JobStore, open_job_store
 
-def download_image(url: str, output_path: str) -> bool:
-    """Download album art from URL."""
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        return True
-    except Exception:
-        return False
-
-def get_metadata_from_file(file: str, info_json: str = None) -> Dict:
-    """Extract metadata from file or info JSON."""
-    metadata = {
-        "title": "",
-        "artist": "Unknown Artist",
-        "album": "Unknown Album",
-        "year": "",
-        "artwork_url": None
-    }
-    
-    try:
-        if info_json and os.path.exists(info_json):
-            with open(info_json, 'r', encoding='utf-8') as f:
-                info = json.load(f)
-                metadata['title'] = info.get('title', os.path.basename(file))
-                metadata['artist'] = info.get('artist') or info.get('uploader', 'Unknown Artist')
-                metadata['album'] = info.get('album', 'Unknown Album')
-                metadata['year'] = str(info.get('release_year', ''))
-                metadata['artwork_url'] = info.get('thumbnail')
-        else:
-            metadata['title'] = os.path.splitext(os.path.basename(file))[0]
-    except Exception:
-        metadata['title'] = os.path.splitext(os.path.basename(file))[0]
-    
-    return metadata
+# How often the progress bar and throughput readout refresh while downloading
+PROGRESS_REFRESH_MS = 500
+# How often queued log lines are flushed into the log widget, and at most how many per flush
+LOG_FLUSH_MS = 100
+LOG_FLUSH_BATCH = 500
 
-def set_mp3_metadata(file: str, metadata: Dict, cover: str = None):
-    """Embed metadata into MP3 file."""
-    try:
-        audio = MP3(file, ID3=ID3)
-        try:
-            audio.add_tags()
-        except:
-            pass
-        
-        audio.tags["TIT2"] = TIT2(encoding=3, text=metadata["title"])
-        audio.tags["TPE1"] = TPE1(encoding=3, text=metadata["artist"])
-        audio.tags["TALB"] = TALB(encoding=3, text=metadata["album"])
-        
-        if metadata.get("year"):
-            audio.tags["TDRC"] = TDRC(encoding=3, text=metadata["year"])
-        
-        if cover and os.path.exists(cover):
-            with open(cover, 'rb') as img:
-                audio.tags.add(
-                    APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,
-                        desc='Cover',
-                        data=img.read()
-                    )
-                )
-        audio.save()
-    except Exception as e:
-        raise Exception(f"Failed to embed MP3 metadata: {e}")
-
-def set_wav_metadata(file: str, metadata: Dict):
-    """Embed metadata into WAV file."""
-    try:
-        audio = WAVE(file)
-        audio["INAM"] = metadata["title"]
-        audio["IART"] = metadata["artist"]
-        audio["IPRD"] = metadata["album"]
-        if metadata.get("year"):
-            audio["ICRD"] = metadata["year"]
-        audio.save()
-    except Exception as e:
-        raise Exception(f"Failed to embed WAV metadata: {e}")
-
-def run_cmd(cmd: List[str], error_callback=None, output_callback=None, use_python_module=False, module_name=None):
-    """Run command and capture output."""
+def setup_file_logging() -> Optional[logging.Logger]:
+    """Rotating log file with the full activity log (the widget only keeps the tail)."""
+    config = load_config().get("logging", {})
+    if not config.get("enabled", True) or not config.get("save_to_file", True):
+        return None
+    
+    log_file = os.path.expanduser(config.get("log_file") or "downloader.log")
+    if not os.path.isabs(log_file):
+        log_file = get_state_path(log_file)
     try:
-        # If using Python module, prepend python -m
-        if use_python_module and module_name:
-            python_exe = get_python_executable()
-            cmd = [python_exe, "-m", module_name] + cmd[1:]
-        
-        # Replace ffmpeg with local path if needed
-        if cmd[0] == "ffmpeg":
-            cmd[0] = get_ffmpeg_path()
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
+        handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=int(float(config.get("max_file_mb", 5)) * 1024 * 1024),
+            backupCount=int(config.get("backup_count", 3)),
+            encoding='utf-8'
         )
-        
-        for line in process.stdout:
-            if output_callback:
-                output_callback(line.strip())
-        
-        process.wait()
-        if process.returncode != 0:
-            stderr = process.stderr.read()
-            raise subprocess.CalledProcessError(process.returncode, cmd, stderr)
-            
-    except subprocess.CalledProcessError as e:
-        if error_callback:
-            error_callback(f"Command failed: {' '.join(cmd)}\n{e}")
-        raise
-    except Exception as e:
-        if error_callback:
-            error_callback(f"Error: {e}")
-        raise
-
-def download_soundcloud(url: str, fmt: str, output_dir: str, status_callback, error_callback, log_callback):
-    """Download from SoundCloud with metadata and album art."""
-    status_callback("Downloading from SoundCloud...")
-    log_callback(f"URL: {url}")
-    
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    out_template = str(output_path / "%(title)s.%(ext)s")
-    
-    # Use python -m yt_dlp if yt-dlp not in PATH
-    use_module = shutil.which("yt-dlp") is None
-    
-    cmd = [
-        "yt-dlp" if not use_module else "yt_dlp",
-        "--extract-audio",
-        "--audio-format", fmt,
-        "--audio-quality", "0",
-        "--embed-thumbnail",
-        "--write-info-json",
-        "--add-metadata",
-        "--no-playlist",
-        "--ignore-errors",
-        "--no-overwrites",
-        "--continue",
-        "--ffmpeg-location", get_ffmpeg_path(),
-        "-o", out_template,
-        url
-    ]
-    
-    if fmt == "mp3":
-        cmd.extend(["--postprocessor-args", "ffmpeg:-b:a 320k -ar 44100"])
-    
-    run_cmd(cmd, error_callback=error_callback, output_callback=log_callback, 
-            use_python_module=use_module, module_name="yt_dlp")
-    
-    # Find and process downloaded files
-    downloaded_files = []
-    for file in output_path.glob(f"*.{fmt}"):
-        downloaded_files.append(str(file))
-        
-        # Process metadata and artwork
-        info_file = str(file).replace(f'.{fmt}', '.info.json')
-        metadata = get_metadata_from_file(str(file), info_file)
-        
-        if metadata['artwork_url']:
-            artwork_path = str(file).replace(f'.{fmt}', '.jpg')
-            if download_image(metadata['artwork_url'], artwork_path):
-                if fmt == "mp3":
-                    try:
-                        set_mp3_metadata(str(file), metadata, artwork_path)
-                    except Exception as e:
-                        log_callback(f"Warning: {e}")
-                os.remove(artwork_path)
-        
-        if os.path.exists(info_file):
-            os.remove(info_file)
-    
-    if downloaded_files:
-        status_callback(f"✅ Downloaded {len(downloaded_files)} file(s)")
-        for f in downloaded_files:
-            log_callback(f"Saved: {os.path.basename(f)}")
-    else:
-        error_callback("No files were downloaded.")
-    
-    return downloaded_files
-
-def download_spotify(url: str, fmt: str, output_dir: str, status_callback, error_callback, log_callback):
-    """Download from Spotify with metadata and album art."""
-    status_callback("Downloading from Spotify...")
-    log_callback(f"URL: {url}")
-    
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        print(f"Could not open log file {log_file}: {e}", file=sys.stderr)
+        return None
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
     
-    original_dir = os.getcwd()
-    os.chdir(output_path)
-    
-    try:
-        # Use python -m spotdl if spotdl not in PATH
-        use_module = shutil.which("spotdl") is None
-        
-        cmd = ['spotdl' if not use_module else 'spotdl', 
-               '--format', 'mp3', 
-               '--bitrate', '320k',
-               '--ffmpeg', get_ffmpeg_path(),
-               url]
-        run_cmd(cmd, error_callback=error_callback, output_callback=log_callback,
-                use_python_module=use_module, module_name="spotdl")
-        
-        status_callback("Processing files...")
-        
-        # Find downloaded MP3 files
-        downloaded_files = []
-        mp3_files = [f for f in os.listdir('.') if f.endswith('.mp3')]
-        
-        for mp3_file in mp3_files:
-            if fmt == "wav":
-                wav_file = mp3_file.replace('.mp3', '.wav')
-                log_callback(f"Converting to WAV: {mp3_file}")
-                
-                subprocess.run([
-                    get_ffmpeg_path(), "-y", "-i", mp3_file,
-                    "-acodec", "pcm_s16le",
-                    "-ar", "44100",
-                    wav_file
-                ], check=True, capture_output=True)
-                
-                # Transfer metadata to WAV
-                try:
-                    mp3_audio = MP3(mp3_file)
-                    metadata = {
-                        "title": str(mp3_audio.get("TIT2", "")),
-                        "artist": str(mp3_audio.get("TPE1", "")),
-                        "album": str(mp3_audio.get("TALB", "")),
-                        "year": str(mp3_audio.get("TDRC", ""))
-                    }
-                    set_wav_metadata(wav_file, metadata)
-                except Exception as e:
-                    log_callback(f"Warning: Could not transfer metadata: {e}")
-                
-                os.remove(mp3_file)
-                downloaded_files.append(str(output_path / wav_file))
-                log_callback(f"Saved: {wav_file}")
-            else:
-                downloaded_files.append(str(output_path / mp3_file))
-                log_callback(f"Saved: {mp3_file}")
-        
-        if downloaded_files:
-            status_callback(f"✅ Downloaded {len(downloaded_files)} file(s)")
-        else:
-            error_callback("No files found after download.")
-        
-        return downloaded_files
-    finally:
-        os.chdir(original_dir)
+    file_logger = logging.getLogger("gui.activity")
+    file_logger.setLevel(config.get("level", "INFO"))
+    file_logger.propagate = False
+    file_logger.addHandler(handler)
+    return file_logger
 
-def download_applemusic(url: str, fmt: str, output_dir: str, status_callback, error_callback, log_callback):
-    """Download from Apple Music with metadata and album art."""
-    status_callback("Downloading from Apple Music...")
-    log_callback(f"URL: {url}")
-    
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    original_dir = os.getcwd()
-    os.chdir(output_path)
-    
-    try:
-        # spotDL also supports Apple Music URLs
-        use_module = shutil.which("spotdl") is None
-        
-        cmd = ['spotdl' if not use_module else 'spotdl', 
-               '--format', 'mp3', 
-               '--bitrate', '320k',
-               '--ffmpeg', get_ffmpeg_path(),
-               url]
-        run_cmd(cmd, error_callback=error_callback, output_callback=log_callback,
-                use_python_module=use_module, module_name="spotdl")
-        
-        status_callback("Processing files...")
-        
-        # Find downloaded MP3 files
-        downloaded_files = []
-        mp3_files = [f for f in os.listdir('.') if f.endswith('.mp3')]
-        
-        for mp3_file in mp3_files:
-            if fmt == "wav":
-                wav_file = mp3_file.replace('.mp3', '.wav')
-                log_callback(f"Converting to WAV: {mp3_file}")
-                
-                subprocess.run([
-                    get_ffmpeg_path(), "-y", "-i", mp3_file,
-                    "-acodec", "pcm_s16le",
-                    "-ar", "44100",
-                    wav_file
-                ], check=True, capture_output=True)
-                
-                # Transfer metadata to WAV
-                try:
-                    mp3_audio = MP3(mp3_file)
-                    metadata = {
-                        "title": str(mp3_audio.get("TIT2", "")),
-                        "artist": str(mp3_audio.get("TPE1", "")),
-                        "album": str(mp3_audio.get("TALB", "")),
-                        "year": str(mp3_audio.get("TDRC", ""))
-                    }
-                    set_wav_metadata(wav_file, metadata)
-                except Exception as e:
-                    log_callback(f"Warning: Could not transfer metadata: {e}")
-                
-                os.remove(mp3_file)
-                downloaded_files.append(str(output_path / wav_file))
-                log_callback(f"Saved: {wav_file}")
-            else:
-                downloaded_files.append(str(output_path / mp3_file))
-                log_callback(f"Saved: {mp3_file}")
-        
-        if downloaded_files:
-            status_callback(f"✅ Downloaded {len(downloaded_files)} file(s)")
-        else:
-            error_callback("No files found after download.")
-        
-        return downloaded_files
-    finally:
-        os.chdir(original_dir)
+def is_exe(name):
+    """Check if an executable is available in PATH or as Python module (without importing it)."""
+    local = str(FFMPEG_LOCAL) if name == "ffmpeg" else None
+    return probe(name, local)['available']
 
 class DownloadQueue:
-    """Manages download queue for batch processing."""
-    def __init__(self):
+    """Manages download queue for batch processing, journaled to disk when a store is given."""
+    def __init__(self, store: Optional[JobStore] = None):
         self.queue = queue.Queue()
         self.active = False
+        self.store = store
+    
+    def track(self, item: Dict):
+        """Journal a task so it survives restarts (assigns its id)."""
+        if self.store is not None and 'id' not in item:
+            item['id'] = self.store.add(item)
     
     def add(self, item: Dict):
         """Add download task to queue."""
+        self.track(item)
         self.queue.put(item)
     
     def get(self):
@@ -402,6 +87,42 @@ class DownloadQueue:
     def size(self):
         """Get queue size."""
         return self.queue.qsize()
+    
+    def drain(self) -> List[Dict]:
+        """Remove and return all queued tasks."""
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get())
+        return items
+    
+    def clear(self):
+        """Drop all queued tasks, including their journal entries."""
+        self.drain()
+        if self.store is not None:
+            self.store.clear_pending()
+    
+    def restore(self) -> List[Dict]:
+        """Re-queue tasks left unfinished by a previous session."""
+        if self.store is None:
+            return []
+        items = self.store.unfinished()
+        for item in items:
+            self.queue.put(item)
+        return items
+    
+    def record(self, item: Dict, status: str):
+        """Journal a task's state change reported by the scheduler."""
+        if self.store is None or 'id' not in item:
+            return
+        try:
+            if status == RUNNING:
+                self.store.mark_running(item['id'])
+            elif status == DONE:
+                self.store.mark_done(item['id'], item.get('result') or [])
+            elif status == FAILED:
+                self.store.mark_failed(item['id'], item.get('error', ''))
+        except Exception as e:
+            print(f"Could not update job journal: {e}", file=sys.stderr)
 
 
 class App:
@@ -416,14 +137,32 @@ class App:
         self.url = tk.StringVar()
         self.output_dir = tk.StringVar(value=str(Path.home() / "Downloads" / "Music"))
         self.status = tk.StringVar(value="Ready")
+        self.throughput = tk.StringVar(value="")
+        
+        # Log lines and widget updates from any thread go through this queue; a Tk timer flushes them
+        self.log_queue: "queue.SimpleQueue[Union[str, Callable[[], None]]]" = queue.SimpleQueue()
+        self.max_log_lines = int(load_config().get("ui_settings", {}).get("max_log_lines", 2000))
+        self.file_log = setup_file_logging()
         
         # Download queue
-        self.download_queue = DownloadQueue()
+        self.download_queue = DownloadQueue(open_job_store())
+        self.queue_items: List[Dict] = []  # Rows shown in the queue list, in order
         self.is_downloading = False
+        self.resume_pending = False
+        
+        # Worker pool stays alive between batches so engine state is reused
+        self.scheduler = DownloadScheduler(
+            self.run_item,
+            max_workers=get_download_setting("max_concurrent_downloads", 3),
+            platform_limits=get_download_setting("platform_concurrency", {}),
+            status_callback=self.on_item_status
+        )
         
         # UI Setup
         self.setup_ui()
+        self.root.after(LOG_FLUSH_MS, self.flush_log)
         self.check_dependencies()
+        self.resume_unfinished()
         
         # Create output directory
         Path(self.output_dir.get()).mkdir(parents=True, exist_ok=True)
@@ -583,6 +322,13 @@ class App:
             foreground='#0066cc'
         ).grid(row=0, column=0, sticky=tk.W)
         
+        ttk.Label(
+            status_frame,
+            textvariable=self.throughput,
+            font=self.status_font
+        ).grid(row=0, column=1, sticky=tk.E)
+        status_frame.columnconfigure(1, weight=1)
+        
         # Log output
         log_frame = ttk.LabelFrame(main_frame, text="Activity Log", padding="5")
         log_frame.grid(row=9, column=0, columnspan=4, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
@@ -612,36 +358,41 @@ class App:
         disclaimer.grid(row=10, column=0, columnspan=4, pady=(5, 0))
 
     def check_dependencies(self):
-        """Check if required dependencies are installed."""
+        """Probe dependencies on a background thread so the window is usable right away."""
+        self.download_button.config(state='disabled')
+        self.status.set("Checking dependencies...")
+        
+        def probe_in_background():
+            try:
+                results = detect_dependencies(["ffmpeg", "yt-dlp", "spotdl"], {"ffmpeg": str(FFMPEG_LOCAL)})
+            except Exception as e:
+                self.log(f"⚠️ Dependency cache unavailable: {e}")
+                results = {name: probe(name, str(FFMPEG_LOCAL) if name == "ffmpeg" else None)
+                           for name in ("ffmpeg", "yt-dlp", "spotdl")}
+            self.call_in_ui(self.apply_dependencies, results)
+        
+        threading.Thread(target=probe_in_background, name="dependency-probe", daemon=True).start()
+
+    def apply_dependencies(self, results: Dict[str, Dict]):
+        """Report probe results and enable downloading (runs on the Tk thread)."""
         missing = []
-        warnings = []
         
         # Check FFmpeg
-        if not is_exe('ffmpeg'):
+        if not results['ffmpeg']['available']:
             missing.append('FFmpeg')
+        elif results['ffmpeg']['source'] == 'local':
+            self.log(f"✅ Using local FFmpeg: {FFMPEG_LOCAL}")
         else:
-            if FFMPEG_LOCAL.exists():
-                self.log(f"✅ Using local FFmpeg: {FFMPEG_LOCAL}")
+            self.log(f"✅ FFmpeg found in system PATH")
+        
+        # Check yt-dlp and spotdl
+        for name in ("yt-dlp", "spotdl"):
+            if not results[name]['available']:
+                missing.append(name)
+            elif results[name]['source'] == 'path':
+                self.log(f"✅ {name} found in PATH")
             else:
-                self.log(f"✅ FFmpeg found in system PATH")
-        
-        # Check yt-dlp
-        if not is_exe('yt-dlp'):
-            missing.append('yt-dlp')
-        else:
-            if shutil.which("yt-dlp"):
-                self.log(f"✅ yt-dlp found in PATH")
-            else:
-                self.log(f"✅ yt-dlp will run as Python module")
-        
-        # Check spotdl
-        if not is_exe('spotdl'):
-            missing.append('spotdl')
-        else:
-            if shutil.which("spotdl"):
-                self.log(f"✅ spotdl found in PATH")
-            else:
-                self.log(f"✅ spotdl will run as Python module")
+                self.log(f"✅ {name} will run as Python module")
         
         if missing:
             msg = f"❌ MISSING DEPENDENCIES\n\n"
@@ -658,9 +409,27 @@ class App:
             self.add_button.config(state='disabled')
             self.download_button.config(state='disabled')
             self.status.set("❌ Missing dependencies")
-        else:
-            self.log("✅ All dependencies are ready!")
-            self.status.set("Ready to download")
+            return
+        
+        self.log("✅ All dependencies are ready!")
+        self.download_button.config(state='normal')
+        self.status.set("Ready to download")
+        
+        # Items restored from the last session start once we know we can run them
+        if self.resume_pending and not self.is_downloading:
+            self.resume_pending = False
+            self.start_queue_processing()
+
+    def resume_unfinished(self):
+        """Reload items a previous session didn't finish; they start once dependencies check out."""
+        restored = self.download_queue.restore()
+        if not restored:
+            return
+        for item in restored:
+            self.add_queue_row(item)
+        self.log(f"🔁 Resuming {len(restored)} unfinished item(s) from the last session")
+        # Started by apply_dependencies once the dependency probe succeeds
+        self.resume_pending = True
 
     def browse_output_dir(self):
         """Browse for output directory."""
@@ -670,16 +439,52 @@ class App:
             self.log(f"Output directory changed to: {directory}")
 
     def log(self, message: str):
-        """Add message to log."""
+        """Add message to log (safe to call from any thread)."""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        self.log_queue.put(f"[{timestamp}] {message}\n")
+        if self.file_log is not None:
+            self.file_log.info(message)
+
+    def call_in_ui(self, func: Callable, *args):
+        """Run ``func(*args)`` on the Tk thread, after everything queued before it (safe from any thread)."""
+        self.log_queue.put(lambda: func(*args))
+
+    def flush_log(self):
+        """Timer: apply queued widget updates in order, inserting log lines in one go between them."""
+        entries = []
+        try:
+            while len(entries) < LOG_FLUSH_BATCH:
+                entries.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        
+        try:
+            lines = []
+            for entry in entries:
+                if isinstance(entry, str):
+                    lines.append(entry)
+                    continue
+                self.write_log(lines)
+                lines = []
+                entry()
+            self.write_log(lines)
+        finally:
+            # Come back sooner while there's a backlog
+            self.root.after(1 if len(entries) == LOG_FLUSH_BATCH else LOG_FLUSH_MS, self.flush_log)
+
+    def write_log(self, lines: List[str]):
+        """Insert lines into the log widget, keeping only the newest lines."""
+        if not lines:
+            return
+        self.log_text.insert(tk.END, "".join(lines))
+        line_count = int(self.log_text.index('end-1c').split('.')[0])
+        if line_count > self.max_log_lines:
+            self.log_text.delete('1.0', f"{line_count - self.max_log_lines + 1}.0")
         self.log_text.see(tk.END)
-        self.root.update_idletasks()
 
     def update_status(self, text: str):
-        """Update status label."""
-        self.status.set(text)
-        self.root.update_idletasks()
+        """Update status label (safe to call from any thread)."""
+        self.call_in_ui(self.status.set, text)
 
     def on_error(self, msg: str):
         """Handle error."""
@@ -701,12 +506,15 @@ class App:
             'output_dir': self.output_dir.get()
         }
         
-        self.download_queue.add(item)
+        # Skip tracks we already have without scheduling any work
+        if find_archived(item['platform'], url, item['format']):
+            get_metrics().count("archive_hits", platform=item['platform'])
+            self.log(f"⏭️ Already downloaded (archive), not queued: {url}")
+            self.url.set("")
+            return
         
-        # Add to visual queue
-        platform_icon = "🎧" if item['platform'] == "soundcloud" else "🎵"
-        format_text = f"[{item['format'].upper()}]"
-        self.queue_list.insert(tk.END, f"{platform_icon} {format_text} {url[:60]}...")
+        self.download_queue.add(item)
+        self.add_queue_row(item)
         
         self.log(f"Added to queue: {url}")
         self.status.set(f"Queue: {self.download_queue.size()} items")
@@ -714,11 +522,35 @@ class App:
         # Clear URL entry
         self.url.set("")
 
+    def add_queue_row(self, item: Dict):
+        """Append an item to the visual queue."""
+        item['row'] = len(self.queue_items)
+        item['status_text'] = "queued"
+        self.queue_items.append(item)
+        self.queue_list.insert(tk.END, self.format_queue_row(item))
+
+    def format_queue_row(self, item: Dict) -> str:
+        """Build the queue list text for an item."""
+        platform_icon = "🎧" if item['platform'] == "soundcloud" else "🎵"
+        format_text = f"[{item['format'].upper()}]"
+        return f"{platform_icon} {format_text} {item['status_text']} - {item['url'][:60]}..."
+
+    def set_item_status(self, item: Dict, text: str):
+        """Update an item's row in the queue list (safe to call from worker threads)."""
+        def refresh():
+            item['status_text'] = text
+            row = item['row']
+            if row < self.queue_list.size() and self.queue_items[row] is item:
+                self.queue_list.delete(row)
+                self.queue_list.insert(row, self.format_queue_row(item))
+        
+        self.call_in_ui(refresh)
+
     def clear_queue(self):
         """Clear download queue."""
         if not self.is_downloading:
-            while not self.download_queue.is_empty():
-                self.download_queue.get()
+            self.download_queue.clear()
+            self.queue_items = []
             self.queue_list.delete(0, tk.END)
             self.status.set("Queue cleared")
             self.log("Queue cleared")
@@ -738,70 +570,168 @@ class App:
         self.is_downloading = True
         self.download_button.config(state='disabled')
         self.add_button.config(state='disabled')
+        self.progress.config(mode='indeterminate')
         self.progress.start()
+        self.root.after(PROGRESS_REFRESH_MS, self.refresh_progress)
         
         thread = threading.Thread(target=self.process_queue, daemon=True)
         thread.start()
 
-    def process_queue(self):
-        """Process all items in queue."""
-        total = self.download_queue.size()
-        completed = 0
+    def refresh_progress(self):
+        """Timer: show aggregate progress/throughput and per-item progress while downloading."""
+        if not self.is_downloading:
+            return
         
-        self.log(f"Starting batch download: {total} items")
+        tracker = get_tracker()
+        totals = tracker.aggregate()
+        if totals['percent'] is not None:
+            if str(self.progress.cget('mode')) != 'determinate':
+                self.progress.stop()
+                self.progress.config(mode='determinate', maximum=100)
+            self.progress['value'] = totals['percent']
+        elif str(self.progress.cget('mode')) != 'indeterminate':
+            self.progress.config(mode='indeterminate')
+            self.progress.start()
+        
+        if totals['active']:
+            self.throughput.set(f"⬇️ {totals['active']} active · {format_bytes(totals['speed'])}/s · "
+                                f"ETA {format_eta(totals['eta'])}")
+        else:
+            self.throughput.set("")
         
-        while not self.download_queue.is_empty():
-            item = self.download_queue.get()
-            completed += 1
-            
-            self.update_status(f"Processing {completed}/{total}...")
-            self.log(f"\n{'='*60}")
-            self.log(f"Processing item {completed}/{total}")
-            
-            # Remove from visual queue
-            self.root.after(0, lambda: self.queue_list.delete(0))
-            
-            try:
-                if item['platform'] == "soundcloud":
-                    download_soundcloud(
-                        item['url'],
-                        item['format'],
-                        item['output_dir'],
-                        self.update_status,
-                        self.on_error,
-                        self.log
-                    )
-                elif item['platform'] == "spotify":
-                    download_spotify(
-                        item['url'],
-                        item['format'],
-                        item['output_dir'],
-                        self.update_status,
-                        self.on_error,
-                        self.log
-                    )
-                elif item['platform'] == "applemusic":
-                    download_applemusic(
-                        item['url'],
-                        item['format'],
-                        item['output_dir'],
-                        self.update_status,
-                        self.on_error,
-                        self.log
-                    )
-            except Exception as e:
-                self.log(f"❌ Failed: {str(e)}")
+        items = {item.get('id'): item for item in self.queue_items}
+        for job in tracker.jobs():
+            item = items.get(job.key)
+            if item is not None and item.get('status') == RUNNING:
+                text = f"running · {job.describe()}"
+                if item['status_text'] != text:
+                    self.set_item_status(item, text)
         
-        self.progress.stop()
+        self.root.after(PROGRESS_REFRESH_MS, self.refresh_progress)
+
+    def playlist_track_filter(self, item: Dict) -> Callable[[Dict], bool]:
+        """on_track hook for a set's tracks: journal each one and give it a queue row.
+
+        Tracks journaled before a restart are resumed on their own, and
+        archived ones are left out.
+        """
+        already_queued = None
+        
+        def on_track(track: Dict) -> bool:
+            nonlocal already_queued
+            if already_queued is None:
+                store = self.download_queue.store
+                already_queued = set(store.child_urls(item['id'])) if store is not None and 'id' in item else set()
+                item['expanded'] = item['skipped'] = 0
+            if track['url'] in already_queued or find_archived(track['platform'], track['url'], track['format']):
+                item['skipped'] += 1
+                return False
+            item['expanded'] += 1
+            with self.batch_lock:
+                self.batch_total += 1
+            self.download_queue.track(track)
+            # Queued ahead of the track's status updates, so its row exists when they are applied
+            self.call_in_ui(self.add_queue_row, track)
+            return True
+        
+        return on_track
+
+    def run_item(self, item: Dict):
+        """Download a single queue item (runs on a scheduler worker thread).
+
+        Returns a Future: the worker moves on to the next download while this
+        item's files are converted and tagged by the pipeline stages. A set's
+        tracks become jobs of their own on the same scheduler.
+        """
+        backend = BACKENDS[item['platform']]
+        self.log(f"URL: {item['url']}")
+        self.set_item_status(item, f"Downloading from {backend.display_name}...")
+        with progress_scope(item['id'], item['url']):
+            future = start_download(item['platform'], item['url'], item['format'], item['output_dir'],
+                                    log=self.log, on_track=self.playlist_track_filter(item))
+        if 'expanded' in item:
+            self.log(f"Playlist resolved: {item['expanded']} track(s) scheduled, "
+                     f"{item['skipped']} already downloaded")
+            self.set_item_status(item, f"📂 playlist: {item['expanded']} track(s) queued")
+        elif not future.done():
+            self.set_item_status(item, "⚙️ processing")
+        return future
+
+    def on_item_status(self, item: Dict, status: str, detail: str):
+        """Scheduler callback: journal job state changes and reflect them in the UI."""
+        self.download_queue.record(item, status)
+        
+        if status == RUNNING:
+            self.log(f"▶️ Started: {item['url']}")
+            self.set_item_status(item, "running")
+        elif status == DONE:
+            self.log(f"✅ Finished: {item['url']}")
+            self.set_item_status(item, f"✅ done ({len(item['result'])} file(s))")
+        elif status == FAILED:
+            self.log(f"❌ Failed: {item['url']} - {detail}")
+            self.set_item_status(item, f"❌ failed ({item.get('error_class') or 'error'})")
+        elif status == CANCELLED:
+            self.set_item_status(item, "⏹️ cancelled")
+        elif status == QUEUED:
+            self.set_item_status(item, "queued")
+        
+        if status in (DONE, FAILED):
+            with self.batch_lock:
+                self.batch_counts[status] += 1
+                finished = self.batch_counts[DONE] + self.batch_counts[FAILED]
+            self.update_status(f"Completed {finished}/{self.batch_total}...")
+
+    def process_queue(self):
+        """Process all items in queue with a pool of concurrent workers."""
+        items = self.download_queue.drain()
+        total = len(items)
+        self.batch_total = total
+        self.batch_counts = {DONE: 0, FAILED: 0}
+        self.batch_lock = threading.Lock()
+        
+        scheduler = self.scheduler
+        
+        self.log(f"Starting batch download: {total} items ({scheduler.max_workers} at a time)")
+        self.update_status(f"Processing 0/{total}...")
+        
+        for item in items:
+            scheduler.submit(item)
+        scheduler.start()
+        scheduler.join()
+        
+        # Tracks that sets fanned out into count too
+        total = self.batch_total
+        succeeded = self.batch_counts[DONE]
+        self.log(f"\n{'='*60}")
+        self.log(f"✅ Batch download completed: {succeeded}/{total} successful")
+        self.log_stage_summary()
+        export_metrics(get_download_setting("metrics_json_file"), get_download_setting("metrics_prometheus_file"))
+        self.call_in_ui(self.finish_batch, succeeded, total)
+
+    def log_stage_summary(self):
+        """Log where the time went so far, slowest stage first, and the space dedup saved."""
+        stages = {}
+        for entry in get_metrics().snapshot()['stages']:
+            stages[entry['stage']] = stages.get(entry['stage'], 0) + entry['seconds']
+        if stages:
+            summary = " · ".join(f"{stage} {seconds:.1f}s"
+                                 for stage, seconds in sorted(stages.items(), key=lambda s: -s[1]))
+            self.log(f"⏱️ Time by stage: {summary}")
+        reclaimed = reclaimed_summary()
+        if reclaimed:
+            self.log(reclaimed)
+
+    def finish_batch(self, succeeded: int, total: int):
+        """Reset the UI after a batch (runs on the Tk thread)."""
         self.is_downloading = False
+        self.progress.stop()
+        self.progress.config(mode='indeterminate')
+        self.throughput.set("")
         self.download_button.config(state='normal')
         self.add_button.config(state='normal')
+        self.status.set(f"✅ Completed {succeeded}/{total} downloads")
         
-        self.update_status(f"✅ Completed {completed}/{total} downloads")
-        self.log(f"\n{'='*60}")
-        self.log(f"✅ Batch download completed: {completed}/{total} successful")
-        
-        messagebox.showinfo("Complete", f"Downloaded {completed} items successfully!")
+        messagebox.showinfo("Complete", f"Downloaded {succeeded} of {total} items successfully!")
 
 if __name__ == "__main__":
     root = tk.Tk()
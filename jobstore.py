@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+from settings import get_state_path
+
+logger = logging.getLogger(__name__)
+
+# Journal states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Finished jobs are kept this long for inspection, then pruned
+HISTORY_SECONDS = 7 * 24 * 3600
+
+class JobStore:
+    """On-disk journal of queue items so a batch survives a crash or restart.
+
+    Every item is written when it is queued and its state is updated as it
+    runs. On startup, ``unfinished()`` returns what still has to be done
+    (jobs that were running when the process died go back to pending).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                platform TEXT NOT NULL,
+                format TEXT NOT NULL,
+                output_dir TEXT NOT NULL,
+                parent INTEGER,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                files TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def add(self, item: Dict) -> int:
+        """Journal a new pending item and return its id."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (url, platform, format, output_dir, parent, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (item['url'], item['platform'], item['format'], item['output_dir'],
+                 item.get('parent'), PENDING, now, now)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def mark_running(self, job_id: int):
+        """Record that an item started (counts as one attempt)."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def mark_done(self, job_id: int, files: List[str]):
+        """Record a finished item and the files it produced."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, files = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(files), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def mark_failed(self, job_id: int, error: str):
+        """Record an item that failed for good."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def unfinished(self) -> List[Dict]:
+        """Items still pending or interrupted while running, oldest first."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, RUNNING))
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT id, url, platform, format, output_dir, parent, attempts FROM jobs "
+                "WHERE state = ? ORDER BY id", (PENDING,)
+            ).fetchall()
+        return [
+            {
+                'id': row[0],
+                'url': row[1],
+                'platform': row[2],
+                'format': row[3],
+                'output_dir': row[4],
+                'parent': row[5],
+                'attempts': row[6],
+            }
+            for row in rows
+        ]
+
+    def child_urls(self, parent_id: int) -> List[str]:
+        """URLs already journaled as tracks of an expanded playlist."""
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM jobs WHERE parent = ?", (parent_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def clear_pending(self):
+        """Drop every item that hasn't started."""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE state = ?", (PENDING,))
+            self._conn.commit()
+
+    def prune(self, max_age: float = HISTORY_SECONDS):
+        """Forget finished items older than ``max_age`` seconds."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - max_age)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def open_job_store() -> Optional[JobStore]:
+    """Open the per-user job journal, or return None if it can't be used."""
+    try:
+        store = JobStore(get_state_path("jobs.db"))
+        store.prune()
+        return store
+    except Exception as e:
+        logger.warning(f"Job journal unavailable, queue will not survive restarts: {e}")
+        return None
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+from settings import get_download_setting, get_state_path
+from urls import normalize_url, track_id_from_url
+
+logger = logging.getLogger(__name__)
+
+# The track fields the tagging code uses; everything else in an info JSON is dropped
+TRACK_FIELDS = ("title", "artist", "album", "year", "artwork_url")
+
+def metadata_key(platform: str, url: str) -> str:
+    """Cache key for a URL: the platform's track id when it has one, else the normalized URL."""
+    track_id = track_id_from_url(platform, url)
+    return f"{platform}:{track_id}" if track_id else f"{platform}:{normalize_url(url)}"
+
+class MetadataStore:
+    """SQLite cache of track metadata and resolved playlist entries.
+
+    Filled from yt-dlp's info JSON (only ``TRACK_FIELDS``) and from playlist
+    resolution, so retries and re-runs within the TTL don't have to ask the
+    platform again. Expired rows are ignored and pruned when the store opens.
+    """
+
+    def __init__(self, path: str, track_ttl: float, playlist_ttl: float):
+        self.path = path
+        self.track_ttl = track_ttl
+        self.playlist_ttl = playlist_ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                metadata TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS playlists (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                entries TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        now = time.time()
+        self._conn.execute("DELETE FROM tracks WHERE fetched_at < ?", (now - track_ttl,))
+        self._conn.execute("DELETE FROM playlists WHERE fetched_at < ?", (now - playlist_ttl,))
+        self._conn.commit()
+
+    def get_track(self, platform: str, url: str) -> Optional[Dict]:
+        """Cached metadata for a track URL, or None if unknown or expired."""
+        with self._lock:
+            row = self._conn.execute("SELECT metadata, fetched_at FROM tracks WHERE key = ?",
+                                     (metadata_key(platform, url),)).fetchone()
+        if row is None or time.time() - row[1] > self.track_ttl:
+            return None
+        return json.loads(row[0])
+
+    def put_track(self, platform: str, url: str, metadata: Dict):
+        """Remember the tagging fields of a track's metadata."""
+        slim = {field: metadata.get(field) for field in TRACK_FIELDS}
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks (key, url, metadata, fetched_at) VALUES (?, ?, ?, ?)",
+                (metadata_key(platform, url), url, json.dumps(slim), time.time())
+            )
+            self._conn.commit()
+
+    def get_playlist(self, platform: str, url: str) -> Optional[List[Dict]]:
+        """Cached track entries of a playlist/set URL, or None if unknown or expired."""
+        with self._lock:
+            row = self._conn.execute("SELECT entries, fetched_at FROM playlists WHERE key = ?",
+                                     (metadata_key(platform, url),)).fetchone()
+        if row is None or time.time() - row[1] > self.playlist_ttl:
+            return None
+        return json.loads(row[0])
+
+    def put_playlist(self, platform: str, url: str, entries: List[Dict]):
+        """Remember the resolved entries (``url``, ``id``, ``title``) of a playlist."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlists (key, url, entries, fetched_at) VALUES (?, ?, ?, ?)",
+                (metadata_key(platform, url), url, json.dumps(entries), time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_store: Optional[MetadataStore] = None
+_store_lock = threading.Lock()
+
+def get_metadata_store() -> Optional[MetadataStore]:
+    """Return the shared metadata store, or None when disabled in config or unavailable."""
+    global _store
+    track_hours = get_download_setting("metadata_ttl_hours", 168)
+    if not track_hours:
+        return None
+    with _store_lock:
+        if _store is None:
+            playlist_minutes = get_download_setting("playlist_ttl_minutes", 60) or 0
+            try:
+                _store = MetadataStore(get_state_path("metadata.db"), track_ttl=track_hours * 3600,
+                                       playlist_ttl=playlist_minutes * 60)
+            except Exception as e:
+                logger.warning(f"Metadata store unavailable: {e}")
+                return None
+        return _store
+
+def cached_track(platform: str, url: str) -> Optional[Dict]:
+    """Cached metadata for a track, or None (also when the store is off or fails)."""
+    store = get_metadata_store()
+    if store is None:
+        return None
+    try:
+        return store.get_track(platform, url)
+    except Exception as e:
+        logger.warning(f"Could not read metadata store: {e}")
+        return None
+
+def remember_track(platform: str, url: str, metadata: Dict):
+    """Store a track's metadata; failures only log a warning."""
+    store = get_metadata_store()
+    if store is None or not url:
+        return
+    try:
+        store.put_track(platform, url, metadata)
+    except Exception as e:
+        logger.warning(f"Could not update metadata store: {e}")
+
+def cached_playlist(platform: str, url: str) -> Optional[List[Dict]]:
+    """Cached entries of a playlist, or None (also when the store is off or fails)."""
+    store = get_metadata_store()
+    if store is None:
+        return None
+    try:
+        return store.get_playlist(platform, url)
+    except Exception as e:
+        logger.warning(f"Could not read metadata store: {e}")
+        return None
+
+def remember_playlist(platform: str, url: str, entries: List[Dict]):
+    """Store a playlist's resolved entries; failures only log a warning."""
+    store = get_metadata_store()
+    if store is None or not store.playlist_ttl:
+        return
+    try:
+        store.put_playlist(platform, url, entries)
+    except Exception as e:
+        logger.warning(f"Could not update metadata store: {e}")
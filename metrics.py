@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every exported Prometheus metric
+NAMESPACE = "umd"
+
+# Pipeline stages timed across the downloaders
+RESOLVE = "resolve"  # Playlist/set resolution
+DOWNLOAD = "download"  # yt-dlp/spotdl run, including their own postprocessing
+TRANSCODE = "transcode"  # MP3 -> WAV
+ARTWORK = "artwork"  # Album art fetch (cache or network)
+TAGGING = "tagging"  # Writing ID3/WAV tags
+DEDUP = "dedup"  # Audio hashing and hard-linking duplicates
+
+_HELP = {
+    "stage_seconds": "Time spent per pipeline stage",
+    "jobs": "Download jobs finished, by outcome",
+    "files": "Audio files produced",
+    "bytes": "Bytes of audio files produced",
+    "retries": "Retried attempts, by stage and failure class",
+    "archive_hits": "Jobs skipped because the download archive already had them",
+    "artwork_cache": "Album art lookups, by result (memory, disk, revalidated, fetched, error)",
+    "dedup_files": "Downloaded files found to duplicate audio already in the library",
+    "dedup_bytes": "Bytes reclaimed by hard-linking or dropping duplicates",
+    "tag_writes": "Tag updates by format and result (written, or unchanged and skipped)",
+    "rate_limit_wait_seconds": "Time spent waiting on the bandwidth and per-host rate limits",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+class Metrics:
+    """Thread-safe counters and stage timers for one run of the program."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        # name -> labels -> [count, sum, min, max]
+        self._timers: Dict[str, Dict[LabelKey, list]] = {}
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Add ``value`` to a counter."""
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, stage: str, seconds: float, **labels):
+        """Record one timed run of a stage."""
+        key = _labels(dict(labels, stage=stage))
+        with self._lock:
+            series = self._timers.setdefault("stage_seconds", {})
+            entry = series.get(key)
+            if entry is None:
+                series[key] = [1, seconds, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = min(entry[2], seconds)
+                entry[3] = max(entry[3], seconds)
+
+    @contextmanager
+    def timed(self, stage: str, **labels):
+        """Time the block as one run of ``stage`` (recorded even if it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def record_files(self, files, **labels):
+        """Count produced files and their size on disk."""
+        size = 0
+        for path in files:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        self.count("files", len(files), **labels)
+        self.count("bytes", size, **labels)
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly summary of the run so far."""
+        with self._lock:
+            counters = {name: [dict(key, value=value) for key, value in series.items()]
+                        for name, series in self._counters.items()}
+            stages = []
+            for key, (n, total, low, high) in self._timers.get("stage_seconds", {}).items():
+                stages.append(dict(key, count=n, seconds=round(total, 3), min=round(low, 3),
+                                   max=round(high, 3), mean=round(total / n, 3)))
+        now = time.time()
+        return {
+            'started_at': self.started_at,
+            'finished_at': now,
+            'wall_seconds': round(now - self.started_at, 3),
+            'stages': sorted(stages, key=lambda s: -s['seconds']),
+            'counters': counters,
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            timers = {name: dict(series) for name, series in self._timers.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name, series in sorted(timers.items()):
+            metric = f"{NAMESPACE}_{name}"
+            lines.append(f"# HELP {metric} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {metric} summary")
+            for key, (n, total, _, _) in sorted(series.items()):
+                lines.append(f"{metric}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{metric}_count{_format_labels(key)} {n}")
+
+        for name, series in sorted(counters.items()):
+            metric = f"{NAMESPACE}_{name}_total"
+            lines.append(f"# HELP {metric} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{metric}{_format_labels(key)} {value:g}")
+
+        lines.append(f"# HELP {NAMESPACE}_start_time_seconds Unix time the process started collecting")
+        lines.append(f"# TYPE {NAMESPACE}_start_time_seconds gauge")
+        lines.append(f"{NAMESPACE}_start_time_seconds {self.started_at:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        _write_atomic(path, json.dumps(self.snapshot(), indent=2))
+
+    def write_prometheus(self, path: str):
+        # Atomic replace, as the node_exporter textfile collector expects
+        _write_atomic(path, self.to_prometheus())
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+def _write_atomic(path: str, text: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+_metrics = Metrics()
+
+def get_metrics() -> Metrics:
+    """Process-wide metrics registry."""
+    return _metrics
+
+def export_metrics(json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+    """Write the run's metrics to the given files (either may be None)."""
+    metrics = get_metrics()
+    for path, write in ((json_path, metrics.write_json), (prometheus_path, metrics.write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(os.path.expanduser(path))
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
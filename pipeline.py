@@ -0,0 +1,476 @@
+import os
+import sys
+import queue
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from archive import find_archived, record_download
+from artwork import fetch_artwork, prefetch_artwork
+from catalog import catalog_files
+from dedup import OFF, dedup_mode, dedupe_file
+from depcheck import PYTHON_MODULES, probe
+from metastore import cached_playlist, cached_track, remember_playlist, remember_track
+from metrics import ARTWORK, DEDUP, DOWNLOAD, RESOLVE, TAGGING, TRANSCODE, get_metrics
+from procrunner import cancel_scope, current_cancel_event, run_command
+from progress import ProgressEvent, ProgressMonitor, current_job, progress_scope
+from ratelimit import get_rate_limiter
+from retry import CANCELLED, OperationCancelled, with_retries
+from scheduler import DownloadScheduler, current_scheduler
+from settings import get_download_setting
+from spotdl_runner import build_spotdl_args, read_m3u_files
+from tagging import (default_metadata, has_cover, info_json_path, read_info_json, read_mp3_tags, read_source_url,
+                     write_mp3_tags, write_wav_tags)
+from transcode import convert_to_wav, get_ffmpeg_path, transcode_workers, wav_path_for
+from urls import detect_platform, is_soundcloud_playlist
+from ytdlp_engine import build_soundcloud_args, resolve_playlist, run_ytdlp
+
+logger = logging.getLogger(__name__)
+
+LogCallback = Callable[[str], None]
+EventCallback = Optional[Callable[[ProgressEvent], None]]
+
+# Cover fetches are network-bound; tag writes and hashing are short bursts of disk I/O
+ARTWORK_WORKERS = 4
+TAGGING_WORKERS = 2
+DEDUP_WORKERS = 2
+# Tracks that may wait in front of a stage before the stage feeding it blocks
+STAGE_QUEUE_SIZE = 32
+
+def tool_command(name: str) -> List[str]:
+    """Command that starts an external tool: the executable on PATH, else ``python -m`` its module."""
+    if shutil.which(name) is None and name in PYTHON_MODULES:
+        return [sys.executable, "-m", PYTHON_MODULES[name]]
+    return [name]
+
+def run_tool(cmd: List[str], log: LogCallback, on_event: EventCallback = None):
+    """Run a downloader tool: progress lines feed the tracker, everything else goes to ``log``."""
+    monitor = ProgressMonitor(on_event=on_event)
+
+    def on_line(line: str):
+        if not monitor.feed(line):
+            log(line)
+
+    run_command(cmd, on_stdout=on_line, on_stderr=on_line, stall_check=monitor.stall_check)
+
+# -- platform backends ------------------------------------------------------
+
+class Backend:
+    """Drives one platform's download tool.
+
+    ``download`` runs on the caller's (scheduler worker) thread and returns
+    one track dict per file the tool produced, with ``path`` and ``source``
+    keys; converting, cover art and tagging are left to the pipeline stages.
+    """
+    platform = ""
+    display_name = ""
+
+    def resolve(self, url: str, log: LogCallback) -> Optional[List[Dict]]:
+        """Track entries (``url``, ``id``, ``title``) if ``url`` should be split into per-track jobs."""
+        return None
+
+    def download(self, url: str, fmt: str, output_dir: str, log: LogCallback,
+                 on_event: EventCallback = None) -> List[Dict]:
+        raise NotImplementedError
+
+class YtDlpBackend(Backend):
+    """SoundCloud through yt-dlp (in-process engine or subprocess)."""
+    platform = "soundcloud"
+    display_name = "SoundCloud"
+
+    def resolve(self, url: str, log: LogCallback) -> Optional[List[Dict]]:
+        if not (get_download_setting("soundcloud_playlist_mode", True) and is_soundcloud_playlist(url)):
+            return None
+        entries = cached_playlist(self.platform, url)
+        if entries is not None:
+            log(f"Using cached track list for {url}")
+            return entries
+        with get_metrics().timed(RESOLVE, platform=self.platform):
+            entries = with_retries(lambda: self._resolve(url), stage="playlist resolution", on_retry=log)
+        remember_playlist(self.platform, url, entries)
+        return entries
+
+    def _resolve(self, url: str) -> List[Dict]:
+        get_rate_limiter().admit(url)
+        return resolve_playlist(url, tool_command("yt-dlp"))
+
+    def download(self, url: str, fmt: str, output_dir: str, log: LogCallback,
+                 on_event: EventCallback = None) -> List[Dict]:
+        output_path = Path(os.path.abspath(output_dir))
+        output_path.mkdir(parents=True, exist_ok=True)
+        out_template = str(output_path / "%(title)s.%(ext)s")
+        limiter = get_rate_limiter()
+
+        # Covers are only embedded in MP3s; get them while the audio downloads
+        if fmt == "mp3":
+            prefetch_artwork((cached_track(self.platform, url) or {}).get('artwork_url'))
+
+        def on_progress(event: ProgressEvent):
+            if fmt == "mp3" and event.thumbnail:
+                prefetch_artwork(event.thumbnail)
+            if on_event:
+                on_event(event)
+
+        def attempt() -> List[str]:
+            # Each attempt is admitted by the host's limits and takes its share of the bandwidth cap
+            limiter.admit(url)
+            with limiter.transfer() as rate:
+                args = build_soundcloud_args(fmt, out_template, ffmpeg_location=get_ffmpeg_path())
+                # The engine reports exactly which files this job produced
+                return run_ytdlp(args, url, lambda full_args: run_tool(tool_command("yt-dlp") + full_args,
+                                                                        log, on_progress),
+                                 log_callback=log, on_event=on_progress, limit_rate=rate)
+
+        with get_metrics().timed(DOWNLOAD, platform=self.platform):
+            files = with_retries(attempt, on_retry=log)
+        return [{'path': path, 'source': 'ytdlp'} for path in files]
+
+class SpotdlBackend(Backend):
+    """Spotify and Apple Music through spotdl, which always produces tagged MP3s."""
+
+    def __init__(self, platform: str, display_name: str):
+        self.platform = platform
+        self.display_name = display_name
+
+    def download(self, url: str, fmt: str, output_dir: str, log: LogCallback,
+                 on_event: EventCallback = None) -> List[Dict]:
+        if not probe("spotdl")['available']:
+            raise RuntimeError("spotdl is required: pip install spotdl")
+        output_path = Path(os.path.abspath(output_dir))
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(prefix="umd-") as tmp:
+            m3u_path = os.path.join(tmp, "job.m3u8")
+            limiter = get_rate_limiter()
+
+            def attempt():
+                limiter.admit(url)
+                with limiter.transfer() as rate:
+                    cmd = tool_command("spotdl") + build_spotdl_args(url, str(output_path), m3u_path,
+                                                                     ffmpeg=get_ffmpeg_path(), limit_rate=rate)
+                    run_tool(cmd, log, on_event)
+
+            with get_metrics().timed(DOWNLOAD, platform=self.platform):
+                with_retries(attempt, on_retry=log)
+
+            # spotdl reports the songs it handled in the m3u file
+            files = [f for f in read_m3u_files(m3u_path, str(output_path)) if f.endswith('.mp3')]
+        # Each song's own track URL, so the songs of an album or playlist are archived one by one
+        return [{'path': path, 'source': 'spotdl', 'source_url': read_source_url(path)} for path in files]
+
+BACKENDS: Dict[str, Backend] = {
+    "soundcloud": YtDlpBackend(),
+    "spotify": SpotdlBackend("spotify", "Spotify"),
+    "applemusic": SpotdlBackend("applemusic", "Apple Music"),
+}
+
+# -- post-processing stages ---------------------------------------------------
+
+def track_metadata(track: Dict) -> Optional[Dict]:
+    """Metadata of a yt-dlp track from its info JSON, kept in the metadata store.
+
+    When the JSON is gone (e.g. a retry after tagging already deleted it),
+    the stored copy is used; None if neither is there.
+    """
+    path = track['path']
+    if os.path.exists(info_json_path(path)):
+        metadata = read_info_json(path)
+        remember_track(track['platform'], metadata['url'] or track['url'], metadata)
+        return metadata
+    cached = cached_track(track['platform'], track['url'])
+    return dict(default_metadata(path), **cached) if cached else None
+
+def fetch_cover(track: Dict):
+    """Artwork stage: read the track's metadata and get the cover art for MP3s.
+
+    The cover was usually prefetched while the audio downloaded, so this is
+    a memory hit. Files that already have a cover keep it.
+    """
+    if track['source'] != 'ytdlp':
+        return  # spotdl embeds its own
+    track['metadata'] = metadata = track_metadata(track)
+    if (metadata and metadata['artwork_url'] and track['format'] == "mp3"
+            and not has_cover(track['path'])):
+        track['cover'] = fetch_artwork(metadata['artwork_url'])
+
+def transcode(track: Dict):
+    """Transcode stage: turn spotdl's MP3s into WAV when WAV was asked for."""
+    if track['format'] != "wav" or not track['path'].endswith('.mp3'):
+        return
+    mp3_file = track['path']
+    wav_file = wav_path_for(mp3_file)
+    with_retries(lambda: convert_to_wav(mp3_file, wav_file, get_ffmpeg_path()), stage="transcode",
+                 on_retry=track['log'])
+    track['mp3_file'] = mp3_file
+    track['path'] = wav_file
+
+def write_tags(track: Dict):
+    """Tagging stage: bring the tags to their final state in at most one write, then clean up.
+
+    WAVs get the tags of the MP3 they were converted from; yt-dlp MP3s get
+    the info JSON metadata and cover art. Text that --add-metadata already
+    wrote is left alone, and files whose tags already match aren't saved.
+    """
+    log = track['log']
+    try:
+        if track.get('mp3_file'):
+            with get_metrics().timed(TAGGING, format="wav"):
+                written = write_wav_tags(track['path'], read_mp3_tags(track['mp3_file']))
+            get_metrics().count("tag_writes", format="wav", result="written" if written else "unchanged")
+        elif track.get('metadata') and track['path'].endswith('.mp3'):
+            with get_metrics().timed(TAGGING, format="mp3"):
+                written = write_mp3_tags(track['path'], track['metadata'], cover_data=track.get('cover'))
+            get_metrics().count("tag_writes", format="mp3", result="written" if written else "unchanged")
+    except Exception as e:
+        log(f"Warning: could not write tags to {os.path.basename(track['path'])}: {e}")
+
+    if track.get('mp3_file'):
+        os.remove(track['mp3_file'])
+    if track['source'] == 'ytdlp':
+        info_file = info_json_path(track['path'])
+        if os.path.exists(info_file):
+            os.remove(info_file)
+    log(f"Saved: {os.path.basename(track['path'])}")
+
+def dedupe(track: Dict):
+    """Dedup stage: hard-link (or drop) a file whose audio is already in the library."""
+    if dedup_mode() == OFF:
+        return
+    name = os.path.basename(track['path'])
+    try:
+        with get_metrics().timed(DEDUP):
+            path, existing, reclaimed = dedupe_file(track['path'])
+    except Exception as e:
+        track['log'](f"Warning: could not check {name} for duplicates: {e}")
+        return
+    if reclaimed:
+        action = "hard-linked" if path == track['path'] else "kept the existing copy"
+        track['log'](f"♻️ {name} duplicates {existing}: {action}, "
+                     f"{reclaimed / (1024 * 1024):.1f} MB reclaimed")
+    track['path'] = path
+
+class Stage:
+    """One post-processing step with its own worker pool and bounded input queue."""
+
+    def __init__(self, name: str, handler: Callable[[Dict], None], workers: int,
+                 queue_size: int = STAGE_QUEUE_SIZE):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=queue_size)
+
+class Pipeline:
+    """Moves downloaded tracks through the stages in order.
+
+    Each stage drains its own queue with its own threads, so a track can be
+    tagged while the next one converts and the downloader threads are
+    already fetching more. Queues are bounded: when a stage falls behind,
+    the stage in front of it (and ultimately ``submit``) blocks.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for index, stage in enumerate(self.stages):
+                for i in range(stage.workers):
+                    worker = threading.Thread(target=self._worker, args=(index,),
+                                              name=f"{stage.name}-{i + 1}", daemon=True)
+                    worker.start()
+            self._started = True
+
+    def submit(self, track: Dict) -> Future:
+        """Queue a track; the returned Future resolves to the track once every stage is done."""
+        self.start()
+        track['future'] = Future()
+        self.stages[0].queue.put(track)
+        return track['future']
+
+    def pending(self) -> Dict[str, int]:
+        """Tracks waiting in front of each stage."""
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        while True:
+            track = stage.queue.get()
+            try:
+                # A cancelled job also stops its conversions
+                with cancel_scope(track.get('cancel_event')):
+                    stage.handler(track)
+            except Exception as e:
+                track['future'].set_exception(e)
+                continue
+            if index + 1 < len(self.stages):
+                self.stages[index + 1].queue.put(track)
+            else:
+                track['future'].set_result(track)
+
+_pipeline: Optional[Pipeline] = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline() -> Pipeline:
+    """Process-wide post-processing pipeline shared by all jobs."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = Pipeline([
+                Stage(ARTWORK, fetch_cover, ARTWORK_WORKERS),
+                Stage(TRANSCODE, transcode, transcode_workers()),
+                Stage(TAGGING, write_tags, TAGGING_WORKERS),
+                Stage(DEDUP, dedupe, DEDUP_WORKERS),
+            ])
+        return _pipeline
+
+# -- jobs ---------------------------------------------------------------------
+
+def _completed(result) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+def _collect(platform: str, url: str, tracks: List[Future], log: LogCallback) -> Future:
+    """Future for a job's files, resolved once all of its tracks are through the pipeline."""
+    job = Future()
+    remaining = [len(tracks)]
+    lock = threading.Lock()
+
+    def track_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        errors = [future.exception() for future in tracks if future.exception() is not None]
+        for error in errors:
+            log(f"❌ Post-processing failed: {error}")
+        if errors:
+            job.set_exception(errors[0])
+            return
+        files = [future.result()['path'] for future in tracks]
+        get_metrics().record_files(files, platform=platform)
+        record_download(platform, url, files)
+        for future in tracks:
+            track = future.result()
+            if track.get('source_url') and track['source_url'] != url:
+                record_download(detect_platform(track['source_url']), track['source_url'], [track['path']])
+        catalog_files(files)
+        job.set_result(files)
+
+    for future in tracks:
+        future.add_done_callback(track_done)
+    return job
+
+def start_download(platform: str, url: str, fmt: str, output_dir: str,
+                   log: Optional[LogCallback] = None, on_event: EventCallback = None,
+                   on_track: Optional[Callable[[Dict], bool]] = None) -> Future:
+    """Download ``url`` on this thread and hand its tracks to the post-processing pipeline.
+
+    Returns a Future for the job's final files, so a scheduler slot is free
+    for the next download as soon as the tool exits. Raises if nothing was
+    downloaded; archived URLs resolve immediately to their recorded files.
+    Sets are fanned out with download_collection, which passes each track
+    job to ``on_track``.
+    """
+    log = log or logger.info
+    archived = find_archived(platform, url, fmt)
+    if archived:
+        log(f"Already in download archive, skipping: {url}")
+        get_metrics().count("archive_hits", platform=platform)
+        return _completed(archived)
+
+    backend = BACKENDS[platform]
+    entries = backend.resolve(url, log)
+    if entries is not None:
+        return download_collection(platform, entries, fmt, output_dir, log, on_track)
+
+    tracks = backend.download(url, fmt, output_dir, log, on_event)
+    if not tracks:
+        raise RuntimeError("No files were downloaded")
+    cancel_event = current_cancel_event()
+    futures = []
+    for track in tracks:
+        track.update(platform=platform, url=url, format=fmt, log=log, cancel_event=cancel_event)
+        futures.append(get_pipeline().submit(track))
+    return _collect(platform, url, futures, log)
+
+def download(platform: str, url: str, fmt: str, output_dir: str,
+             log: Optional[LogCallback] = None, on_event: EventCallback = None) -> List[str]:
+    """Download ``url`` and wait for its files to be converted and tagged."""
+    return start_download(platform, url, fmt, output_dir, log, on_event).result()
+
+def download_collection(platform: str, entries: List[Dict], fmt: str, output_dir: str,
+                        log: LogCallback, on_track: Optional[Callable[[Dict], bool]] = None) -> Future:
+    """Queue resolved playlist entries as per-track jobs; returns a Future for all their files.
+
+    The tracks go to the scheduler running the calling job, next to its
+    other jobs and under the same worker and platform caps. Outside a
+    scheduler (a single CLI download) they get one of their own.
+    ``on_track(job)`` sees each track job before it is queued and can leave
+    it out by returning False. Failed tracks are logged; the Future fails
+    only if no track produced files.
+    """
+    log(f"Playlist contains {len(entries)} track(s)")
+    if not entries:
+        raise RuntimeError("No files were downloaded")
+    cancel_event = current_cancel_event()
+    parent = current_job()
+    jobs = [{'platform': platform, 'url': entry['url'], 'thumbnail': entry.get('thumbnail'), 'format': fmt,
+             'output_dir': output_dir, 'parent': parent, 'index': index}
+            for index, entry in enumerate(entries)]
+    if on_track is not None:
+        jobs = [job for job in jobs if on_track(job)]
+    collection = Future()
+    if not jobs:
+        collection.set_result([])
+        return collection
+    remaining = [len(jobs)]
+    lock = threading.Lock()
+
+    def track_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        files, errors = [], []
+        for job in jobs:
+            done = job['future']
+            if done.exception() is None:
+                files.extend(done.result())
+            else:
+                log(f"Track failed: {job['url']}: {done.exception()}")
+                errors.append(done.exception())
+        if files:
+            collection.set_result(files)
+        else:
+            collection.set_exception(errors[0])
+
+    def run_track(job: Dict) -> Future:
+        # Tracks still queued when the set is cancelled don't start at all
+        if cancel_event is not None and cancel_event.is_set():
+            error = OperationCancelled(f"Cancelled: {job['url']}")
+            error.error_class = CANCELLED
+            raise error
+        if fmt == "mp3":
+            prefetch_artwork(job.get('thumbnail'))
+        with cancel_scope(cancel_event), progress_scope(job['id'], job['url']):
+            return start_download(platform, job['url'], fmt, output_dir, log)
+
+    scheduler = current_scheduler()
+    if scheduler is None:
+        scheduler = DownloadScheduler(run_track)
+        scheduler.start()
+        collection.add_done_callback(lambda _: scheduler.shutdown(wait=False))
+    for job in jobs:
+        job['handler'] = run_track
+        # The scheduler resolves the job's Future however it ends, even if it is dropped unstarted
+        scheduler.submit(job)['future'].add_done_callback(track_done)
+    return collection
@@ -0,0 +1,268 @@
+import os
+import sys
+import signal
+import atexit
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, List, NamedTuple, Optional
+
+from settings import get_download_setting
+from retry import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+LineCallback = Optional[Callable[[str], None]]
+# Polled while a child runs; returns a reason string to kill it as stalled
+StallCheck = Optional[Callable[[], Optional[str]]]
+
+# stderr lines kept for error messages and failure classification
+STDERR_TAIL_LINES = 500
+# How long a child gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE_SECONDS = 3.0
+# How often a running child checks its cancel event and stall watchdog
+WATCH_POLL_SECONDS = 0.25
+_READ_CHUNK = 64 * 1024
+
+class ProcessResult(NamedTuple):
+    returncode: int
+    stdout: str  # Only filled when capture_stdout is set
+    stderr: str  # Last STDERR_TAIL_LINES lines
+
+class ProcessTimeout(subprocess.TimeoutExpired):
+    """A child ran past its timeout and was killed along with its children."""
+    def __str__(self):
+        return f"Command '{self.cmd[0]}' timed out after {self.timeout:g} seconds"
+
+class ProcessStalled(subprocess.SubprocessError):
+    """A child stopped making progress and was killed (retried as a network failure)."""
+    def __init__(self, cmd: List[str], reason: str, stderr: str = ""):
+        super().__init__(f"Command '{cmd[0]}' {reason}")
+        self.cmd = cmd
+        self.reason = reason
+        self.stderr = stderr
+
+# -- shared event loop ----------------------------------------------------
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_live_processes = set()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Background event loop that drives every child process of this program.
+
+    One loop multiplexes the pipes of all running children, so worker threads
+    just wait on a future instead of each pumping its own pipes.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="process-runner", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+# -- cancellation ---------------------------------------------------------
+
+_scope = threading.local()
+
+@contextmanager
+def cancel_scope(event: threading.Event):
+    """Make ``event`` cancel every command this thread runs inside the block."""
+    previous = getattr(_scope, 'event', None)
+    _scope.event = event
+    try:
+        yield event
+    finally:
+        _scope.event = previous
+
+def current_cancel_event() -> Optional[threading.Event]:
+    return getattr(_scope, 'event', None)
+
+# -- process tree handling ------------------------------------------------
+
+def _spawn_options() -> dict:
+    # Give each child its own process group so the whole tree can be signalled
+    # (yt-dlp and spotdl both start ffmpeg children of their own)
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+def _signal_tree(pid: int, force: bool):
+    try:
+        if os.name == 'nt':
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(pid)], capture_output=True)
+        else:
+            os.killpg(pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+async def _terminate_tree(process: asyncio.subprocess.Process):
+    """Stop a child and everything it started: SIGTERM, then SIGKILL after a grace period."""
+    if process.returncode is not None:
+        return
+    _signal_tree(process.pid, force=os.name == 'nt')
+    try:
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        _signal_tree(process.pid, force=True)
+        await process.wait()
+
+@atexit.register
+def _kill_leftovers():
+    # Children run in their own session, so Ctrl+C on the parent doesn't reach them
+    for pid in list(_live_processes):
+        _signal_tree(pid, force=True)
+
+# -- running --------------------------------------------------------------
+
+async def _pump(stream: asyncio.StreamReader, on_line: LineCallback, sink):
+    """Read a pipe to EOF, splitting on newlines and carriage returns (progress bars)."""
+    pending = b""
+    while True:
+        chunk = await stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        pending += chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        *lines, pending = pending.split(b"\n")
+        for raw in lines:
+            _emit(raw, on_line, sink)
+    if pending:
+        _emit(pending, on_line, sink)
+
+def _emit(raw: bytes, on_line: LineCallback, sink):
+    line = raw.decode('utf-8', errors='replace').rstrip()
+    if sink is not None:
+        sink.append(line)
+    if on_line and line:
+        on_line(line)
+
+def _guard_callbacks(cmd: List[str], *callbacks: LineCallback) -> List[LineCallback]:
+    """Wrap one run's line callbacks so a failing one can't stop the pipes being drained.
+
+    The first failure of the run is logged with its traceback; later ones
+    are dropped so a broken callback doesn't log once per output line.
+    """
+    reported = [False]
+
+    def guard(on_line: LineCallback) -> LineCallback:
+        if on_line is None:
+            return None
+
+        def call(line: str):
+            try:
+                on_line(line)
+            except Exception:
+                if not reported[0]:
+                    reported[0] = True
+                    logger.exception(f"Output callback for '{cmd[0]}' failed (further failures in this run "
+                                     f"are not logged)")
+        return call
+
+    return [guard(on_line) for on_line in callbacks]
+
+async def _watch(cancel_event: Optional[threading.Event], stall_check: StallCheck) -> str:
+    """Return "cancelled" or a stall reason, whichever happens first."""
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            return "cancelled"
+        if stall_check is not None:
+            reason = stall_check()
+            if reason:
+                return reason
+        await asyncio.sleep(WATCH_POLL_SECONDS)
+
+async def run_process(cmd: List[str], on_stdout: LineCallback = None, on_stderr: LineCallback = None,
+                      timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None,
+                      capture_stdout: bool = False, cwd: Optional[str] = None,
+                      stall_check: StallCheck = None) -> ProcessResult:
+    """Run a command, draining stdout and stderr concurrently.
+
+    Lines are handed to the callbacks as they arrive. If ``timeout`` passes,
+    ``cancel_event`` is set or ``stall_check`` reports a stall, the process
+    tree is killed and ProcessTimeout / OperationCancelled / ProcessStalled
+    is raised.
+    """
+    on_stdout, on_stderr = _guard_callbacks(cmd, on_stdout, on_stderr)
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=cwd, **_spawn_options()
+    )
+    _live_processes.add(process.pid)
+
+    stdout_lines = [] if capture_stdout else None
+    stderr_lines = deque(maxlen=STDERR_TAIL_LINES)
+    work = asyncio.ensure_future(asyncio.gather(
+        _pump(process.stdout, on_stdout, stdout_lines),
+        _pump(process.stderr, on_stderr, stderr_lines),
+        process.wait(),
+    ))
+    watchers = {work}
+    watch = None
+    if cancel_event is not None or stall_check is not None:
+        watch = asyncio.ensure_future(_watch(cancel_event, stall_check))
+        watchers.add(watch)
+
+    try:
+        done, _ = await asyncio.wait(watchers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if work not in done:
+            await _terminate_tree(process)
+            await asyncio.gather(work, return_exceptions=True)
+            stderr = "\n".join(stderr_lines)
+            if watch is None or watch not in done:
+                raise ProcessTimeout(cmd, timeout, stderr=stderr)
+            if watch.result() == "cancelled":
+                raise OperationCancelled(f"Cancelled: {cmd[0]}")
+            raise ProcessStalled(cmd, watch.result(), stderr=stderr)
+        work.result()
+    except asyncio.CancelledError:
+        await _terminate_tree(process)
+        raise
+    finally:
+        if watch is not None:
+            watch.cancel()
+        _live_processes.discard(process.pid)
+
+    return ProcessResult(
+        process.returncode,
+        "\n".join(stdout_lines) if capture_stdout else "",
+        "\n".join(stderr_lines),
+    )
+
+def run_command(cmd: List[str], on_stdout: LineCallback = None, on_stderr: LineCallback = None,
+                timeout: Optional[float] = None, cancel_event: Optional[threading.Event] = None,
+                capture_stdout: bool = False, check: bool = True, cwd: Optional[str] = None,
+                stall_check: StallCheck = None) -> ProcessResult:
+    """Blocking front end to ``run_process`` on the shared loop.
+
+    ``timeout`` defaults to ``process_timeout_seconds`` and ``cancel_event``
+    to the thread's ``cancel_scope``. With ``check``, a non-zero exit raises
+    CalledProcessError carrying the stderr tail.
+    """
+    if timeout is None:
+        timeout = get_download_setting("process_timeout_seconds")
+    if cancel_event is None:
+        cancel_event = current_cancel_event()
+    if cancel_event is not None and cancel_event.is_set():
+        raise OperationCancelled(f"Cancelled: {cmd[0]}")
+
+    future = asyncio.run_coroutine_threadsafe(
+        run_process(cmd, on_stdout, on_stderr, timeout, cancel_event, capture_stdout, cwd, stall_check),
+        get_loop()
+    )
+    try:
+        result = future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+        raise
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd, output=result.stdout, stderr=result.stderr)
+    return result
+
+def echo_stderr(line: str):
+    """Line callback that passes a child's output through to our stderr."""
+    sys.stderr.write(line + "\n")
@@ -0,0 +1,338 @@
+import re
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from settings import get_download_setting
+
+logger = logging.getLogger(__name__)
+
+# Stages reported in progress events
+DOWNLOADING = "downloading"
+POSTPROCESSING = "postprocessing"
+FINISHED = "finished"
+
+YTDLP_PROGRESS_TAG = "[umd-progress]"
+YTDLP_STAGE_TAG = "[umd-stage]"
+
+# Machine-readable yt-dlp progress: one line per update, fields separated by |
+YTDLP_PROGRESS_ARGS = [
+    "--newline",
+    "--progress-template",
+    f"download:{YTDLP_PROGRESS_TAG} %(progress.status)s|%(progress.downloaded_bytes)s|%(progress.total_bytes)s|"
+    "%(progress.total_bytes_estimate)s|%(progress.speed)s|%(progress.eta)s|%(info.id)s|%(info.thumbnail)s",
+    "--progress-template",
+    f"postprocess:{YTDLP_STAGE_TAG} %(progress.status)s|%(progress.postprocessor)s",
+]
+
+# spotdl --simple-tui lines
+_SPOTDL_FOUND = re.compile(r"^Found (\d+) songs? in (.+)$")
+_SPOTDL_DONE = re.compile(r'^(?:Downloaded "(.+)"|Skipping (.+?) \(.*(?:already exists|duplicate).*\))')
+_SPOTDL_FAILED = re.compile(r"^(?:LookupError|AudioProviderError|DownloaderError|Failed to download)\b")
+
+class ProgressEvent(NamedTuple):
+    stage: str
+    downloaded_bytes: Optional[int] = None
+    total_bytes: Optional[int] = None
+    speed: Optional[float] = None  # bytes/s
+    eta: Optional[float] = None  # seconds
+    items_done: Optional[int] = None  # spotdl: songs finished in this run
+    items_total: Optional[int] = None
+    detail: str = ""
+    thumbnail: str = ""  # yt-dlp: cover art URL of the item being downloaded
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # yt-dlp prints NA for unknown fields
+
+def _int(value) -> Optional[int]:
+    number = _number(value)
+    return int(number) if number is not None else None
+
+def parse_ytdlp_line(line: str) -> Optional[ProgressEvent]:
+    """Parse a line printed through YTDLP_PROGRESS_ARGS."""
+    if line.startswith(YTDLP_PROGRESS_TAG):
+        fields = line[len(YTDLP_PROGRESS_TAG):].strip().split("|", 7)
+        if len(fields) < 7:
+            return None
+        status, done, total, estimate, speed, eta, item = fields[:7]
+        thumbnail = fields[7] if len(fields) > 7 and fields[7] != "NA" else ""
+        return ProgressEvent(
+            stage=FINISHED if status == "finished" else DOWNLOADING,
+            downloaded_bytes=_int(done),
+            total_bytes=_int(total) or _int(estimate),
+            speed=_number(speed),
+            eta=_number(eta),
+            detail=item if item != "NA" else "",
+            thumbnail=thumbnail,
+        )
+    if line.startswith(YTDLP_STAGE_TAG):
+        fields = line[len(YTDLP_STAGE_TAG):].strip().split("|")
+        return ProgressEvent(stage=POSTPROCESSING, detail=fields[-1])
+    return None
+
+class _SpotdlCounter:
+    """spotdl reports songs, not bytes: count them to get item progress."""
+    def __init__(self):
+        self.total: Optional[int] = None
+        self.done = 0
+
+    def parse(self, line: str) -> Optional[ProgressEvent]:
+        match = _SPOTDL_FOUND.match(line)
+        if match:
+            self.total = int(match.group(1))
+            return ProgressEvent(stage=DOWNLOADING, items_done=self.done, items_total=self.total,
+                                 detail=match.group(2))
+        match = _SPOTDL_DONE.match(line)
+        if match or _SPOTDL_FAILED.match(line):
+            self.done += 1
+            return ProgressEvent(stage=DOWNLOADING, items_done=self.done, items_total=self.total,
+                                 detail=(match.group(1) or match.group(2)) if match else line)
+        return None
+
+def event_from_hook(status: Dict) -> ProgressEvent:
+    """Build an event from a yt-dlp progress_hooks dict (in-process engine)."""
+    return ProgressEvent(
+        stage=FINISHED if status.get('status') == "finished" else DOWNLOADING,
+        downloaded_bytes=status.get('downloaded_bytes'),
+        total_bytes=status.get('total_bytes') or status.get('total_bytes_estimate'),
+        speed=status.get('speed'),
+        eta=status.get('eta'),
+        detail=(status.get('info_dict') or {}).get('id', ""),
+        thumbnail=(status.get('info_dict') or {}).get('thumbnail') or "",
+    )
+
+def format_bytes(size: Optional[float]) -> str:
+    if size is None:
+        return "?"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f}{unit}" if unit != "B" else f"{int(size)}B"
+        size /= 1024
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+# -- tracking -------------------------------------------------------------
+
+class JobProgress:
+    """Latest known progress of one job."""
+    def __init__(self, key, label: str = ""):
+        self.key = key
+        self.label = label
+        self.stage = DOWNLOADING
+        self.started = time.time()
+        self.updated = self.started
+        self.last_advance = self.started
+        self.downloaded = 0  # Bytes of files finished in this job
+        self.current = 0  # Bytes of the file being downloaded
+        self.total: Optional[int] = None
+        self.speed: Optional[float] = None
+        self.eta: Optional[float] = None
+        self.items_done: Optional[int] = None
+        self.items_total: Optional[int] = None
+
+    def apply(self, event: ProgressEvent):
+        now = time.time()
+        advanced = event.stage != self.stage
+        self.stage = event.stage
+        if event.downloaded_bytes is not None:
+            advanced = advanced or event.downloaded_bytes > self.current
+            self.current = event.downloaded_bytes
+            if event.stage == FINISHED:
+                self.downloaded += self.current
+                self.current = 0
+        if event.total_bytes is not None:
+            self.total = event.total_bytes
+        self.speed = event.speed if event.stage == DOWNLOADING else None
+        self.eta = event.eta
+        if event.items_done is not None:
+            advanced = advanced or event.items_done != self.items_done
+            self.items_done = event.items_done
+        if event.items_total is not None:
+            self.items_total = event.items_total
+        self.updated = now
+        if advanced:
+            self.last_advance = now
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.items_total:
+            return 100.0 * (self.items_done or 0) / self.items_total
+        if self.total and self.stage == DOWNLOADING:
+            return min(100.0, 100.0 * self.current / self.total)
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            'key': self.key,
+            'label': self.label,
+            'stage': self.stage,
+            'downloaded_bytes': self.downloaded + self.current,
+            'total_bytes': self.total,
+            'speed': self.speed,
+            'eta': self.eta,
+            'items_done': self.items_done,
+            'items_total': self.items_total,
+            'percent': self.percent,
+            'idle_seconds': round(time.time() - self.last_advance, 1),
+        }
+
+    def describe(self) -> str:
+        """Short human-readable progress, e.g. for a queue row."""
+        if self.stage == POSTPROCESSING:
+            return "⚙️ processing"
+        parts = []
+        if self.percent is not None:
+            parts.append(f"{self.percent:.0f}%")
+        if self.items_total:
+            parts.append(f"{self.items_done or 0}/{self.items_total} songs")
+        if self.speed:
+            parts.append(f"{format_bytes(self.speed)}/s")
+        if self.eta is not None and self.stage == DOWNLOADING:
+            parts.append(f"ETA {format_eta(self.eta)}")
+        return " · ".join(parts) or "⏳ working"
+
+class ProgressTracker:
+    """Progress of every active job in the process, for UIs and aggregate throughput."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[object, JobProgress] = {}
+        self._listeners: List[Callable[[JobProgress], None]] = []
+
+    def add_listener(self, listener: Callable[[JobProgress], None]):
+        """Call ``listener`` with a job's progress after each update (on the reporting thread)."""
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def begin(self, key, label: str = ""):
+        with self._lock:
+            self._jobs[key] = JobProgress(key, label)
+
+    def end(self, key):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def update(self, key, event: ProgressEvent):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = JobProgress(key)
+            job.apply(event)
+            listeners = self._listeners
+        for listener in listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"Progress listener failed: {e}")
+
+    def get(self, key) -> Optional[JobProgress]:
+        with self._lock:
+            return self._jobs.get(key)
+
+    def jobs(self) -> List[JobProgress]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def aggregate(self) -> Dict:
+        """Totals across all active jobs: combined speed, bytes and ETA."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        speed = sum(job.speed or 0 for job in jobs)
+        remaining = sum(max(0, job.total - job.current) for job in jobs
+                        if job.total and job.stage == DOWNLOADING)
+        known = [job.percent for job in jobs if job.percent is not None]
+        return {
+            'active': len(jobs),
+            'speed': speed,
+            'downloaded_bytes': sum(job.downloaded + job.current for job in jobs),
+            'eta': remaining / speed if speed else None,
+            'percent': sum(known) / len(known) if known else None,
+        }
+
+_tracker = ProgressTracker()
+_scope = threading.local()
+
+def get_tracker() -> ProgressTracker:
+    return _tracker
+
+@contextmanager
+def progress_scope(key, label: str = ""):
+    """Attribute progress reported by this thread inside the block to job ``key``."""
+    previous = getattr(_scope, 'key', None)
+    _scope.key = key
+    _tracker.begin(key, label)
+    try:
+        yield
+    finally:
+        _tracker.end(key)
+        _scope.key = previous
+
+def current_job():
+    return getattr(_scope, 'key', None)
+
+def report(event: ProgressEvent):
+    """Record an event for the current thread's job, if it has one."""
+    key = current_job()
+    if key is not None:
+        _tracker.update(key, event)
+
+class ProgressMonitor:
+    """Turns one tool run's output lines into progress events and watches for stalls.
+
+    Created on the job's thread (to pick up its progress_scope) and fed lines
+    from the process runner, or events from yt-dlp's progress hooks through
+    ``observe``. ``feed`` returns True for lines it consumed.
+    """
+
+    def __init__(self, on_event: Optional[Callable[[ProgressEvent], None]] = None,
+                 stall_timeout: Optional[float] = None):
+        self.key = current_job()
+        self.on_event = on_event
+        if stall_timeout is None:
+            stall_timeout = get_download_setting("stall_timeout_seconds")
+        self.stall_timeout = float(stall_timeout) if stall_timeout else None
+        self.last_advance = time.time()
+        self._spotdl = _SpotdlCounter()
+        self._last_bytes = -1
+        self._armed = False
+
+    def feed(self, line: str) -> bool:
+        event = parse_ytdlp_line(line)
+        consumed = event is not None
+        if event is None:
+            event = self._spotdl.parse(line)
+        if event is None:
+            return False
+        self.observe(event)
+        return consumed  # spotdl lines are still worth logging
+
+    def observe(self, event: ProgressEvent):
+        """Record an event for the job and the stall watchdog."""
+        # Only byte-level transfers are watched: extraction, ffmpeg and
+        # spotdl's per-song work can be legitimately quiet for a long time
+        self._armed = event.stage == DOWNLOADING and event.downloaded_bytes is not None
+        if not self._armed or event.downloaded_bytes > self._last_bytes:
+            self.last_advance = time.time()
+        self._last_bytes = event.downloaded_bytes if self._armed else -1
+
+        if self.key is not None:
+            _tracker.update(self.key, event)
+        if self.on_event:
+            self.on_event(event)
+
+    def stall_check(self) -> Optional[str]:
+        """Watchdog for the process runner: a message once progress stops for too long."""
+        if self._armed and self.stall_timeout and time.time() - self.last_advance > self.stall_timeout:
+            return f"stalled: no progress for {self.stall_timeout:g} seconds"
+        return None
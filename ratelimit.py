@@ -0,0 +1,190 @@
+import re
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Union
+from urllib.parse import urlparse
+
+from settings import get_download_setting
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Chunk size when reading a throttled HTTP body
+READ_CHUNK = 64 * 1024
+
+_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+def parse_rate(value: Union[str, int, float, None]) -> Optional[int]:
+    """Bytes/sec from a number or a yt-dlp style string such as ``"500K"`` or ``"2.5M"``.
+
+    Returns None for null, zero or empty values, meaning "no limit".
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        rate = int(value)
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)i?[bB]?\s*", str(value))
+        if not match:
+            raise ValueError(f"Invalid rate: {value!r} (expected e.g. 500K or 2M)")
+        rate = int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+    return rate if rate > 0 else None
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second.
+
+    ``acquire`` reserves tokens even when the bucket is short and then sleeps
+    off the debt, so concurrent callers are served in arrival order and a
+    request larger than ``capacity`` still goes through.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> float:
+        """Take ``amount`` tokens, blocking until they are available. Returns the time waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class _Host:
+    """Concurrency slots and request bucket for one host rule."""
+
+    def __init__(self, max_concurrent: Optional[int], requests_per_second: Optional[float]):
+        self.slots = threading.BoundedSemaphore(int(max_concurrent)) if max_concurrent else None
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+
+class RateLimiter:
+    """Bandwidth and per-host limits shared by every worker of the process.
+
+    ``max_rate`` (bytes/sec) caps the combined download speed. Our own HTTP
+    reads (artwork) draw from a token bucket holding one share of the cap,
+    and the yt-dlp/spotdl runs split the rest, each started with its part
+    through ``--limit-rate``, so the two never add up to more than the cap.
+    ``host_limits`` maps
+    a host (matching subdomains too, e.g. ``sndcdn.com``) or ``default`` to
+    ``max_concurrent`` requests in flight and ``requests_per_second``.
+    """
+
+    def __init__(self, max_rate: Optional[int] = None, host_limits: Optional[Dict[str, Dict]] = None,
+                 slots: int = 1):
+        self.max_rate = max_rate
+        self.slots = max(1, int(slots))
+        # One share for our own reads, as if they were one more slot
+        self._own_rate = max_rate // (self.slots + 1) if max_rate else None
+        self._bandwidth = TokenBucket(self._own_rate) if max_rate else None
+        self._rules = {host.lower(): rule or {} for host, rule in (host_limits or {}).items()}
+        self._hosts: Dict[str, _Host] = {}
+        self._lock = threading.Lock()
+        self._transfers = 0
+
+    def _host(self, url: str) -> _Host:
+        """The limits for ``url``'s host: the longest matching rule, else its own copy of ``default``."""
+        hostname = (urlparse(url).hostname or "").lower()
+        name = None
+        for rule in self._rules:
+            if rule != "default" and (hostname == rule or hostname.endswith("." + rule)):
+                if name is None or len(rule) > len(name):
+                    name = rule
+        # A named rule is shared by its subdomains; any other host is limited on its own
+        key = name or hostname
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                rule = self._rules.get(name or "default", {})
+                host = self._hosts[key] = _Host(rule.get("max_concurrent"), rule.get("requests_per_second"))
+            return host
+
+    @contextmanager
+    def host_slot(self, url: str) -> Iterator[None]:
+        """Hold one of the host's concurrency slots and spend one request token."""
+        host = self._host(url)
+        waited = time.monotonic()
+        if host.slots:
+            host.slots.acquire()
+        try:
+            if host.requests:
+                host.requests.acquire()
+            waited = time.monotonic() - waited
+            if waited > 0.001:
+                get_metrics().count("rate_limit_wait_seconds", waited, limit="host")
+            yield
+        finally:
+            if host.slots:
+                host.slots.release()
+
+    def admit(self, url: str):
+        """Wait until ``url``'s host would accept a request, before starting a tool run.
+
+        yt-dlp and spotdl make their own requests, so a run counts as one
+        request when it starts rather than holding a slot for the whole
+        transfer, which would keep artwork fetches from the same host waiting.
+        """
+        with self.host_slot(url):
+            pass
+
+    def throttle(self, nbytes: int):
+        """Account for ``nbytes`` read by this process, sleeping to stay under the global cap."""
+        if self._bandwidth and nbytes > 0:
+            waited = self._bandwidth.acquire(nbytes)
+            if waited:
+                get_metrics().count("rate_limit_wait_seconds", waited, limit="bandwidth")
+
+    def read_body(self, response) -> bytes:
+        """Read a ``stream=True`` requests response under the bandwidth cap."""
+        if not self._bandwidth:
+            return response.content
+        chunks = []
+        for chunk in response.iter_content(READ_CHUNK):
+            self.throttle(len(chunk))
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @contextmanager
+    def transfer(self) -> Iterator[Optional[int]]:
+        """Register a download tool run; yields the bytes/sec it may use (None = unlimited).
+
+        What the cap leaves after our own reads' share is split across the
+        scheduler's slots, or across the runs actually in flight when there
+        are more of them (e.g. a daemon started with more --workers), so
+        concurrent tool runs and artwork fetches stay under ``max_rate`` together.
+        """
+        with self._lock:
+            self._transfers += 1
+            share = None
+            if self.max_rate:
+                share = max(1024, (self.max_rate - self._own_rate) // max(self.slots, self._transfers))
+        try:
+            yield share
+        finally:
+            with self._lock:
+                self._transfers -= 1
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter, built from ``download_settings``."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            try:
+                max_rate = parse_rate(get_download_setting("max_download_rate"))
+            except ValueError as e:
+                logger.warning(f"Ignoring max_download_rate: {e}")
+                max_rate = None
+            _limiter = RateLimiter(max_rate, get_download_setting("host_limits", {}),
+                                   slots=get_download_setting("max_concurrent_downloads", 3))
+        return _limiter
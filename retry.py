@@ -0,0 +1,119 @@
+import re
+import time
+import random
+import logging
+import subprocess
+from typing import Callable, Optional, TypeVar
+
+from settings import get_download_setting
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Failure classes
+THROTTLED = "throttled"
+NETWORK = "network"
+EXTRACTOR = "extractor"
+FFMPEG = "ffmpeg"
+LOCAL = "local"  # Missing executables, permissions, full disk
+CANCELLED = "cancelled"
+UNKNOWN = "unknown"
+
+# Classes worth another attempt; the rest fail fast
+TRANSIENT = {THROTTLED, NETWORK, UNKNOWN}
+
+# Checked in order, so the more specific causes win
+_PATTERNS = [
+    (THROTTLED, re.compile(r"HTTP Error 429|Too Many Requests|rate[- ]?limit|throttl", re.I)),
+    (NETWORK, re.compile(
+        r"Connection (?:reset|refused|aborted)|timed? ?out|Temporary failure in name resolution|"
+        r"Name or service not known|getaddrinfo failed|Network is unreachable|RemoteDisconnected|"
+        r"IncompleteRead|EOF occurred|SSL|HTTP Error 5\d\d|Unable to download webpage|"
+        r"Got error: \d+ bytes read|stalled: no progress", re.I)),
+    (FFMPEG, re.compile(
+        r"ffmpeg|ffprobe|Postprocessing|Conversion failed|Invalid data found|Error while decoding", re.I)),
+    (EXTRACTOR, re.compile(
+        r"Unsupported URL|ExtractorError|Unable to extract|HTTP Error 4\d\d|is not a valid URL|"
+        r"not available|private|has been removed|DRM|No (?:video )?formats|LookupError|"
+        r"No results found|Could not match", re.I)),
+]
+
+class OperationCancelled(Exception):
+    """The user cancelled a running job; never retried."""
+
+def error_text(error: BaseException) -> str:
+    """Collect what an error says about its cause, including a failed command's stderr.
+
+    The command line itself is left out: every yt-dlp/spotdl command names
+    ffmpeg in its options, which would make any failure look like an ffmpeg one.
+    """
+    if isinstance(error, subprocess.CalledProcessError):
+        parts = [f"exit status {error.returncode}"]
+    elif isinstance(error, subprocess.TimeoutExpired):
+        parts = [f"timed out after {error.timeout:g} seconds"]
+    elif isinstance(error, subprocess.SubprocessError) and hasattr(error, 'cmd'):
+        parts = [getattr(error, 'reason', "")]
+    else:
+        parts = [str(error)]
+    for stream in (getattr(error, 'stderr', None), getattr(error, 'output', None)):
+        if isinstance(stream, bytes):
+            stream = stream.decode('utf-8', errors='replace')
+        if stream:
+            parts.append(stream)
+    return "\n".join(parts)
+
+def classify_error(error: BaseException) -> str:
+    """Sort a failure into throttled/network/extractor/ffmpeg/local/cancelled/unknown."""
+    if isinstance(error, OperationCancelled):
+        return CANCELLED
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return NETWORK
+    if isinstance(error, OSError) and not isinstance(error, subprocess.SubprocessError):
+        return LOCAL
+    text = error_text(error)
+    for kind, pattern in _PATTERNS:
+        if pattern.search(text):
+            return kind
+    return UNKNOWN
+
+def backoff_delay(attempt: int, kind: str, base_delay: float = 2.0, max_delay: float = 60.0) -> float:
+    """Exponential backoff with jitter; throttling backs off harder."""
+    if kind == THROTTLED:
+        base_delay *= 3
+    delay = min(max_delay, base_delay * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def with_retries(func: Callable[[], T], stage: str = "download", retries: Optional[int] = None,
+                 on_retry: Optional[Callable[[str], None]] = None,
+                 sleep: Callable[[float], None] = time.sleep) -> T:
+    """Run ``func``, retrying transient failures with backoff.
+
+    ``retries`` defaults to ``retry_attempts`` from config. The exception
+    that finally escapes carries ``error_class`` and ``attempts`` attributes.
+    """
+    if retries is None:
+        retries = int(get_download_setting("retry_attempts", 3))
+    base_delay = float(get_download_setting("retry_backoff_seconds", 2.0))
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func()
+        except Exception as e:
+            kind = classify_error(e)
+            e.error_class = kind
+            e.attempts = attempt
+            if kind not in TRANSIENT or attempt > retries:
+                raise
+            get_metrics().count("retries", stage=stage, error_class=kind)
+            delay = backoff_delay(attempt, kind, base_delay)
+            message = (f"{stage} failed ({kind}), retrying in {delay:.1f}s "
+                       f"[attempt {attempt + 1}/{retries + 1}]")
+            if on_retry:
+                on_retry(message)
+            else:
+                logger.warning(message)
+            sleep(delay)
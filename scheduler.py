@@ -0,0 +1,228 @@
+import threading
+import itertools
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from settings import get_download_setting
+from metrics import get_metrics
+from retry import CANCELLED as CANCELLED_CLASS, OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+# Job states reported through the status callback
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_job_ids = itertools.count(1)
+_current = threading.local()
+
+def new_job_id() -> int:
+    """Return a process-wide unique job id."""
+    return next(_job_ids)
+
+def current_scheduler() -> Optional["DownloadScheduler"]:
+    """The scheduler whose job is running on this thread, if any."""
+    return getattr(_current, 'scheduler', None)
+
+class DownloadScheduler:
+    """Runs download jobs on a pool of worker threads.
+
+    At most ``max_workers`` jobs run at once, and each platform is further
+    capped by ``platform_limits`` so that a long batch for one service does
+    not hog every slot. Jobs are plain dicts with at least a ``platform`` key;
+    ``handler(job)`` does the actual work and its return value is stored in
+    ``job['result']``. A handler may instead return a Future: the slot is
+    freed right away and the job finishes with the Future, which lets
+    post-processing overlap the next download. A job with a ``handler`` key
+    of its own (e.g. a track a set was fanned out into) runs that instead.
+
+    ``job['future']`` resolves when the job is over: with its result, its
+    error, or OperationCancelled if it was dropped before it started.
+    """
+
+    def __init__(self, handler: Callable[[Dict], object], max_workers: Optional[int] = None,
+                 platform_limits: Optional[Dict[str, int]] = None,
+                 status_callback: Optional[Callable[[Dict, str, str], None]] = None):
+        if max_workers is None:
+            max_workers = get_download_setting("max_concurrent_downloads", 3)
+        if platform_limits is None:
+            platform_limits = get_download_setting("platform_concurrency", {})
+
+        self.handler = handler
+        self.max_workers = max(1, int(max_workers))
+        self.platform_limits = {k: max(1, int(v)) for k, v in (platform_limits or {}).items()}
+        self.status_callback = status_callback
+
+        self._pending = deque()
+        self._running: Dict[str, int] = {}
+        self._active = 0
+        self._deferred = 0
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._stopping = False
+
+    def submit(self, job: Dict) -> Dict:
+        """Queue a job and return it (with an ``id`` assigned)."""
+        job.setdefault('id', new_job_id())
+        job['status'] = QUEUED
+        job['future'] = Future()
+        with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+        self._report(job, QUEUED, "")
+        return job
+
+    def start(self):
+        """Start the worker threads."""
+        with self._cond:
+            self._stopping = False
+            if self._workers:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._worker, name=f"download-worker-{i + 1}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted job has finished."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and self._active == 0 and self._deferred == 0, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers once they finish their current job. Pending jobs are cancelled."""
+        with self._cond:
+            self._stopping = True
+            dropped = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        for job in dropped:
+            self._drop(job)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._workers = []
+
+    def cancel(self, job_id) -> bool:
+        """Drop a job that hasn't started yet. Returns False if it is running, finished or unknown."""
+        with self._cond:
+            job = next((j for j in self._pending if j.get('id') == job_id), None)
+            if job is None:
+                return False
+            self._pending.remove(job)
+            self._cond.notify_all()
+        self._drop(job)
+        return True
+
+    def pending_count(self) -> int:
+        """Number of jobs waiting for a free slot."""
+        with self._cond:
+            return len(self._pending)
+
+    def active_count(self) -> int:
+        """Number of jobs currently running (downloading or finishing)."""
+        with self._cond:
+            return self._active + self._deferred
+
+    def _has_capacity(self, platform: str) -> bool:
+        limit = self.platform_limits.get(platform)
+        return limit is None or self._running.get(platform, 0) < limit
+
+    def _next_runnable(self) -> Optional[Dict]:
+        """Pop the oldest pending job whose platform has a free slot."""
+        for job in self._pending:
+            if self._has_capacity(job.get('platform', '')):
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopping:
+                    job = self._next_runnable()
+                    if job is not None:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    return
+                platform = job.get('platform', '')
+                self._running[platform] = self._running.get(platform, 0) + 1
+                self._active += 1
+
+            self._run(job)
+
+            with self._cond:
+                self._running[platform] -= 1
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _run(self, job: Dict):
+        job['status'] = RUNNING
+        self._report(job, RUNNING, "")
+        handler = job.get('handler') or self.handler
+        previous = current_scheduler()
+        _current.scheduler = self
+        try:
+            result = handler(job)
+        except Exception as e:
+            self._fail(job, e)
+            return
+        finally:
+            _current.scheduler = previous
+        if isinstance(result, Future):
+            with self._cond:
+                self._deferred += 1
+            result.add_done_callback(lambda future: self._finish_deferred(job, future))
+        else:
+            self._succeed(job, result)
+
+    def _finish_deferred(self, job: Dict, future: Future):
+        error = future.exception()
+        if error is None:
+            self._succeed(job, future.result())
+        else:
+            self._fail(job, error)
+        with self._cond:
+            self._deferred -= 1
+            self._cond.notify_all()
+
+    def _succeed(self, job: Dict, result):
+        job['result'] = result
+        job['status'] = DONE
+        get_metrics().count("jobs", platform=job.get('platform'), outcome=DONE)
+        self._report(job, DONE, "")
+        job['future'].set_result(result)
+
+    def _fail(self, job: Dict, e: BaseException):
+        job['error'] = str(e)
+        job['error_class'] = getattr(e, 'error_class', None)
+        job['attempts'] = getattr(e, 'attempts', 1)
+        job['status'] = FAILED
+        get_metrics().count("jobs", platform=job.get('platform'), outcome=FAILED,
+                            error_class=job['error_class'])
+        self._report(job, FAILED, str(e))
+        job['future'].set_exception(e)
+
+    def _drop(self, job: Dict):
+        """Cancel a job that was taken off the queue before it started."""
+        error = OperationCancelled(f"Cancelled: {job.get('url', job['id'])}")
+        error.error_class = CANCELLED_CLASS
+        job['error'] = str(error)
+        job['error_class'] = CANCELLED_CLASS
+        job['status'] = CANCELLED
+        self._report(job, CANCELLED, "")
+        job['future'].set_exception(error)
+
+    def _report(self, job: Dict, status: str, detail: str):
+        if self.status_callback:
+            try:
+                self.status_callback(job, status, detail)
+            except Exception as e:
+                logger.warning(f"Status callback failed: {e}")
@@ -0,0 +1,110 @@
+import json
+import copy
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = Path(__file__).parent
+CONFIG_FILE = SCRIPT_DIR / "config.json"
+
+# Defaults used when config.json is missing or incomplete (e.g. frozen builds)
+DEFAULT_CONFIG = {
+    "state_dir": "~/.universal_music_downloader",
+    "default_output_dir": "~/Downloads/Music",
+    "default_format": "mp3",
+    "default_platform": "soundcloud",
+    "download_settings": {
+        "embed_metadata": True,
+        "embed_artwork": True,
+        "save_info_json": False,
+        "max_concurrent_downloads": 3,
+        "platform_concurrency": {
+            "soundcloud": 3,
+            "spotify": 2,
+            "applemusic": 2
+        },
+        "max_download_rate": None,
+        "host_limits": {
+            "default": {"max_concurrent": 4, "requests_per_second": None}
+        },
+        "retry_attempts": 3,
+        "retry_backoff_seconds": 2,
+        "ytdlp_engine": "auto",
+        "use_archive": True,
+        "archive_file": None,
+        "artwork_cache_mb": 200,
+        "dedup_mode": "off",
+        "use_library_catalog": True,
+        "library_catalog_file": None,
+        "metadata_ttl_hours": 168,
+        "playlist_ttl_minutes": 60,
+        "transcode_workers": None,
+        "process_timeout_seconds": None,
+        "stall_timeout_seconds": 120,
+        "metrics_json_file": None,
+        "metrics_prometheus_file": None,
+        "soundcloud_playlist_mode": True
+    },
+    "daemon": {
+        "host": "127.0.0.1",
+        "port": 8765
+    },
+    "ui_settings": {
+        "max_log_lines": 2000
+    },
+    "logging": {
+        "enabled": True,
+        "level": "INFO",
+        "save_to_file": True,
+        "log_file": "downloader.log",
+        "max_file_mb": 5,
+        "backup_count": 3
+    }
+}
+
+_config_cache: Optional[Dict] = None
+
+def _merge(base: Dict, override: Dict) -> Dict:
+    """Recursively merge override into a copy of base."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def load_config(path: Optional[str] = None, reload: bool = False) -> Dict:
+    """Load config.json merged over the built-in defaults."""
+    global _config_cache
+    if _config_cache is not None and path is None and not reload:
+        return _config_cache
+
+    config_path = Path(path) if path else CONFIG_FILE
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    try:
+        if config_path.exists():
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = _merge(config, json.load(f))
+    except Exception as e:
+        logger.warning(f"Could not read config file {config_path}: {e}")
+
+    if path is None:
+        _config_cache = config
+    return config
+
+def get_download_setting(key: str, default: Any = None) -> Any:
+    """Get a value from the download_settings section of the config."""
+    return load_config().get("download_settings", {}).get(key, default)
+
+def set_download_setting(key: str, value: Any):
+    """Override a download setting for the rest of this run (e.g. from CLI flags)."""
+    load_config().setdefault("download_settings", {})[key] = value
+
+def get_state_path(name: str) -> str:
+    """Path of a file in the per-user state directory (archive, caches, ...)."""
+    state_dir = Path(load_config().get("state_dir") or DEFAULT_CONFIG["state_dir"]).expanduser()
+    state_dir.mkdir(parents=True, exist_ok=True)
+    return str(state_dir / name)
@@ -0,0 +1,44 @@
+import os
+from typing import List, Optional
+
+# spotdl's default file name, anchored to the output directory
+OUTPUT_TEMPLATE = "{artists} - {title}.{output-ext}"
+
+def build_spotdl_args(url: str, output_dir: str, m3u_path: str, ffmpeg: Optional[str] = None,
+                      limit_rate: Optional[int] = None) -> List[str]:
+    """spotdl command-line options (without the executable) for an MP3 download.
+
+    Files are written under ``output_dir`` through an absolute ``--output``
+    template, so the download doesn't depend on the working directory.
+    spotdl writes the paths of the songs it handled to ``m3u_path``, which is
+    how callers learn exactly which files a job produced. ``limit_rate``
+    (bytes/sec) is handed to the yt-dlp that spotdl downloads the audio with.
+    """
+    output_template = os.path.join(os.path.abspath(output_dir), OUTPUT_TEMPLATE)
+    # --simple-tui prints one line per song, which is what progress parsing reads
+    args = ['--format', 'mp3', '--bitrate', '320k', '--output', output_template, '--simple-tui']
+    if ffmpeg:
+        args.extend(['--ffmpeg', ffmpeg])
+    if limit_rate:
+        args.extend(['--yt-dlp-args', f'--limit-rate {limit_rate}'])
+    args.extend(['--m3u', m3u_path, url])
+    return args
+
+def read_m3u_files(m3u_path: str, base_dir: str) -> List[str]:
+    """Return the existing audio files listed in a spotdl m3u playlist as absolute paths.
+
+    spotdl lists every song of the query, including ones that failed, so
+    entries that don't exist on disk are dropped.
+    """
+    files = []
+    if not os.path.exists(m3u_path):
+        return files
+    with open(m3u_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = line.strip()
+            if not entry or entry.startswith('#'):
+                continue
+            path = os.path.abspath(os.path.join(base_dir, entry))
+            if path not in files and os.path.exists(path):
+                files.append(path)
+    return files
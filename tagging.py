@@ -0,0 +1,161 @@
+import os
+import json
+from typing import Dict, List, Optional
+
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TPE1, TALB, APIC, TDRC
+from mutagen.wave import WAVE
+
+from artwork import image_mime
+
+# Padding left after the ID3 tag when it has to be rewritten, so later edits fit in place
+ID3_PADDING = 16 * 1024
+
+UNKNOWN_ARTIST = "Unknown Artist"
+UNKNOWN_ALBUM = "Unknown Album"
+# Stand-ins for fields the source didn't give; never written to a file
+PLACEHOLDERS = {"artist": UNKNOWN_ARTIST, "album": UNKNOWN_ALBUM}
+
+def default_metadata(file_path: str) -> Dict:
+    return {
+        "title": os.path.splitext(os.path.basename(file_path))[0],
+        "artist": UNKNOWN_ARTIST,
+        "album": UNKNOWN_ALBUM,
+        "year": "",
+        "artwork_url": None,
+        "url": None
+    }
+
+def info_json_path(file_path: str) -> str:
+    """Where yt-dlp's --write-info-json put the info for a downloaded file."""
+    return os.path.splitext(file_path)[0] + '.info.json'
+
+def read_info_json(file_path: str) -> Dict:
+    """Track metadata from the yt-dlp info JSON next to a file (file name as title otherwise)."""
+    metadata = default_metadata(file_path)
+    info_file = info_json_path(file_path)
+    try:
+        if os.path.exists(info_file):
+            with open(info_file, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            metadata['title'] = info.get('title', os.path.basename(file_path))
+            metadata['artist'] = info.get('artist') or info.get('uploader') or UNKNOWN_ARTIST
+            metadata['album'] = info.get('album') or UNKNOWN_ALBUM
+            metadata['year'] = str(info.get('release_year') or '')
+            metadata['artwork_url'] = info.get('thumbnail')
+            metadata['url'] = info.get('webpage_url')
+    except (OSError, ValueError):
+        pass
+    return metadata
+
+def read_mp3_tags(mp3_file: str) -> Dict:
+    """Read the tags spotDL wrote into an MP3."""
+    mp3_audio = MP3(mp3_file)
+    return {
+        "title": str(mp3_audio.get("TIT2", "")),
+        "artist": str(mp3_audio.get("TPE1", "")),
+        "album": str(mp3_audio.get("TALB", "")),
+        "year": str(mp3_audio.get("TDRC", ""))
+    }
+
+def read_source_url(mp3_file: str) -> Optional[str]:
+    """The track URL spotDL stores in an MP3's WOAS frame (e.g. the Spotify track), if any."""
+    try:
+        frames = ID3(mp3_file).getall("WOAS")
+    except (MutagenError, OSError):
+        return None
+    return frames[0].url if frames else None
+
+def read_tags(file_path: str) -> Dict:
+    """Title, artist, album and year from an MP3's or WAV's ID3 tags (empty when untagged).
+
+    Only the tag is parsed, not the audio stream, so this is cheap enough
+    for scanning a whole library.
+    """
+    if file_path.lower().endswith('.wav'):
+        tags = WAVE(file_path).tags
+    else:
+        try:
+            tags = ID3(file_path)
+        except ID3NoHeaderError:
+            tags = None
+
+    def text(frame_id: str) -> str:
+        frame = tags.get(frame_id) if tags is not None else None
+        return str(frame) if frame is not None else ""
+
+    return {"title": text("TIT2"), "artist": text("TPE1"), "album": text("TALB"), "year": text("TDRC")}
+
+def _text_frames(metadata: Dict) -> List:
+    """The ID3 text frames for our metadata fields.
+
+    Empty and placeholder values are left alone: a SoundCloud track has no
+    album, and "Unknown Album" is not worth rewriting the file for.
+    """
+    fields = {key: value for key, value in metadata.items()
+              if value and value != PLACEHOLDERS.get(key)}
+    frames = []
+    for key, frame_class in (("title", TIT2), ("artist", TPE1), ("album", TALB), ("year", TDRC)):
+        if fields.get(key):
+            frames.append(frame_class(encoding=3, text=fields[key]))
+    return frames
+
+def _update_tags(tags: ID3, metadata: Dict, cover_data: Optional[bytes] = None) -> bool:
+    """Bring ``tags`` to the final tag set; returns False if they already matched.
+
+    A cover that is already embedded is kept, so cover art never ends up
+    in the file twice.
+    """
+    changed = False
+    for frame in _text_frames(metadata):
+        current = [str(text) for old in tags.getall(frame.FrameID) for text in old.text]
+        wanted = [str(text) for text in frame.text]
+        if frame.FrameID == "TDRC" and len(current) == 1 and current[0].startswith(wanted[0]):
+            continue  # A full date (yt-dlp writes the upload date) already covers the year
+        if current != wanted:
+            tags.setall(frame.FrameID, [frame])
+            changed = True
+    if cover_data and not tags.getall("APIC"):
+        tags.setall("APIC", [APIC(encoding=3, mime=image_mime(cover_data), type=3, desc='Cover',
+                                  data=cover_data)])
+        changed = True
+    return changed
+
+def _padding(info) -> int:
+    """Keep whatever padding fits; when the tag outgrows it, rewrite once with room to spare."""
+    return info.padding if info.padding >= 0 else ID3_PADDING
+
+def has_cover(file_path: str) -> bool:
+    """Check whether an MP3 already has embedded cover art."""
+    try:
+        return bool(ID3(file_path).getall("APIC"))
+    except (MutagenError, OSError):
+        return False
+
+def write_mp3_tags(file_path: str, metadata: Dict, cover_data: Optional[bytes] = None) -> bool:
+    """Embed metadata and cover art into an MP3, saving only if something changed.
+
+    Returns True if the file was written.
+    """
+    try:
+        tags = ID3(file_path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    if not _update_tags(tags, metadata, cover_data):
+        return False
+    tags.save(file_path, padding=_padding)
+    return True
+
+def write_wav_tags(file_path: str, metadata: Dict) -> bool:
+    """Embed metadata into a WAV file (as an ID3 chunk, which is what mutagen writes).
+
+    Returns True if the file was written.
+    """
+    audio = WAVE(file_path)
+    if audio.tags is None:
+        audio.add_tags()
+    if not _update_tags(audio.tags, metadata):
+        return False
+    audio.save(padding=_padding)
+    return True
@@ -0,0 +1,34 @@
+import os
+import shutil
+from pathlib import Path
+
+from settings import get_download_setting
+from procrunner import run_command
+from metrics import TRANSCODE, get_metrics
+
+# FFmpeg bundled with the Windows build
+FFMPEG_LOCAL = Path(__file__).parent / "ffmpeg" / "ffmpeg-8.0-essentials_build" / "bin" / "ffmpeg.exe"
+
+def get_ffmpeg_path() -> str:
+    """FFmpeg executable: the bundled one if present, else the one on PATH."""
+    if FFMPEG_LOCAL.exists():
+        return str(FFMPEG_LOCAL)
+    return shutil.which("ffmpeg") or "ffmpeg"
+
+def transcode_workers() -> int:
+    """Parallel ffmpeg conversions: each drives one ffmpeg process, so default to the CPU count."""
+    return int(get_download_setting("transcode_workers") or os.cpu_count() or 1)
+
+def wav_path_for(mp3_file: str) -> str:
+    """Output path of the WAV converted from an MP3."""
+    return os.path.splitext(mp3_file)[0] + '.wav'
+
+def convert_to_wav(src: str, dst: str, ffmpeg: str = "ffmpeg"):
+    """Convert one file to CD-quality WAV, raising CalledProcessError on failure."""
+    with get_metrics().timed(TRANSCODE):
+        run_command([
+            ffmpeg, "-nostdin", "-y", "-i", src,
+            "-acodec", "pcm_s16le",  # CD quality WAV
+            "-ar", "44100",
+            dst
+        ])
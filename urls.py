@@ -0,0 +1,102 @@
+import re
+from typing import Optional
+from urllib.parse import urlencode, urlparse, parse_qsl, parse_qs
+
+# SoundCloud path segments that are listings rather than tracks
+_SOUNDCLOUD_RESERVED = {"sets", "likes", "tracks", "albums", "reposts", "popular-tracks", "followers", "following"}
+
+_SPOTIFY_TRACK = re.compile(r"^/(?:intl-[a-z-]+/)?track/([A-Za-z0-9]+)")
+_APPLE_SONG = re.compile(r"/song/(?:[^/]+/)?(\d+)$")
+
+# Share/tracking query parameters that don't change what a URL points to
+_TRACKING_PARAMS = {"si", "ref", "feature", "context"}
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for cache keys: lower-case host, no fragment,
+    trailing slash or tracking parameters (``?si=``, ``utm_*``)."""
+    url = url.strip()
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return url
+    if not parsed.netloc:
+        return url  # e.g. spotify:track:... URIs
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+             if k not in _TRACKING_PARAMS and not k.startswith("utm_")]
+    return parsed._replace(scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(),
+                           path=parsed.path.rstrip("/"), params="", query=urlencode(sorted(query)),
+                           fragment="").geturl()
+
+def track_id_from_url(platform: str, url: str) -> Optional[str]:
+    """Derive a stable track id from a URL without touching the network.
+
+    Returns None for playlists, albums, sets and short links, whose tracks
+    can only be known after resolving them.
+    """
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or "").lower()
+    path = parsed.path.rstrip("/")
+
+    if platform == "spotify":
+        if host.endswith("spotify.com"):
+            match = _SPOTIFY_TRACK.match(path)
+            if match:
+                return match.group(1)
+        elif url.startswith("spotify:track:"):
+            return url.split(":")[-1]
+        return None
+
+    if platform == "applemusic":
+        if not host.endswith("music.apple.com"):
+            return None
+        song_id = parse_qs(parsed.query).get("i")
+        if song_id:
+            return song_id[0]
+        match = _APPLE_SONG.search(path)
+        return match.group(1) if match else None
+
+    if platform == "soundcloud":
+        if not host.endswith("soundcloud.com") or host.startswith("on."):
+            return None
+        parts = [p for p in path.split("/") if p]
+        if len(parts) == 2 and parts[1] not in _SOUNDCLOUD_RESERVED:
+            return f"{parts[0]}/{parts[1]}".lower()
+        return None
+
+    return None
+
+def is_soundcloud_playlist(url: str) -> bool:
+    """Check if a SoundCloud URL is a set or a listing rather than a single track."""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return False
+    host = (parsed.hostname or "").lower()
+    if not host.endswith("soundcloud.com") or host.startswith("on."):
+        return False
+    parts = [p for p in parsed.path.split("/") if p]
+    if len(parts) == 1:
+        return True  # Artist page: all their tracks
+    if len(parts) == 2:
+        return parts[1] in _SOUNDCLOUD_RESERVED
+    return len(parts) >= 3 and parts[1] == "sets"
+
+def detect_platform(url: str) -> Optional[str]:
+    """Guess the platform (soundcloud/spotify/applemusic) from a URL's host."""
+    url = url.strip()
+    if url.startswith("spotify:"):
+        return "spotify"
+    try:
+        host = (urlparse(url).hostname or "").lower()
+    except ValueError:
+        return None
+    if host == "snd.sc" or host.endswith("soundcloud.com"):
+        return "soundcloud"
+    if host.endswith("spotify.com") or host == "spotify.link":
+        return "spotify"
+    if host.endswith("music.apple.com"):
+        return "applemusic"
+    return None
@@ -0,0 +1,305 @@
+import os
+import json
+import threading
+import tempfile
+import importlib.util
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from settings import get_download_setting
+from procrunner import ProcessStalled, current_cancel_event, run_command
+from retry import OperationCancelled
+from progress import (POSTPROCESSING, YTDLP_PROGRESS_ARGS, ProgressEvent, ProgressMonitor, event_from_hook,
+                      report)
+
+logger = logging.getLogger(__name__)
+
+# Instances kept alive per worker thread (one per distinct option set)
+MAX_INSTANCES_PER_THREAD = 4
+
+_yt_dlp = None
+_import_lock = threading.Lock()
+
+def _load_yt_dlp():
+    """Import yt_dlp on first use so startup doesn't pay for the extractor import."""
+    global _yt_dlp
+    with _import_lock:
+        if _yt_dlp is None:
+            import yt_dlp
+            _yt_dlp = yt_dlp
+    return _yt_dlp
+
+def inprocess_available() -> bool:
+    """Check whether the yt_dlp package can be imported in this interpreter."""
+    return _yt_dlp is not None or importlib.util.find_spec("yt_dlp") is not None
+
+def use_inprocess_engine() -> bool:
+    """Decide between the in-process engine and spawning yt-dlp, per config."""
+    mode = get_download_setting("ytdlp_engine", "auto")
+    if mode == "subprocess":
+        return False
+    if mode == "inprocess":
+        return True
+    return inprocess_available()
+
+def build_soundcloud_args(fmt: str, out_template: str, ffmpeg_location: Optional[str] = None) -> List[str]:
+    """yt-dlp command-line options shared by the subprocess and in-process engines.
+
+    Cover art isn't embedded by yt-dlp: the pipeline prefetches it through
+    the artwork cache and writes it together with the other tags.
+    """
+    args = [
+        "--extract-audio",
+        "--audio-format", fmt,
+        "--audio-quality", "0",  # Best quality
+        "--write-info-json",  # Save metadata
+        "--add-metadata",  # Add metadata to file
+        "--no-playlist",  # Don't download playlists accidentally
+        "--ignore-errors",  # Continue on errors
+        "--no-overwrites",  # Don't overwrite existing files
+        "--continue",  # Resume incomplete downloads
+    ]
+    if ffmpeg_location:
+        args.extend(["--ffmpeg-location", ffmpeg_location])
+    args.extend(["-o", out_template])
+
+    if fmt == "mp3":
+        args.extend(["--postprocessor-args", "ffmpeg:-b:a 320k -ar 44100"])  # Force 320kbps, 44.1kHz
+
+    return args
+
+class YtDlpError(Exception):
+    """Raised when an in-process yt-dlp download reports errors."""
+
+class _JobSink:
+    """Collects the current job's log lines, errors and output files from YoutubeDL."""
+    def __init__(self):
+        self.callback: Optional[Callable[[str], None]] = None
+        self.cancel_event: Optional[threading.Event] = None
+        self.monitor: Optional[ProgressMonitor] = None
+        self.stalled: Optional[str] = None
+        self.errors: List[str] = []
+        self.files: List[str] = []
+
+    def reset(self, callback: Optional[Callable[[str], None]], cancel_event: Optional[threading.Event] = None,
+              on_event: Optional[Callable[[ProgressEvent], None]] = None):
+        """Start a job; called on the job's thread so the monitor picks up its progress_scope."""
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.monitor = ProgressMonitor(on_event)
+        self.stalled = None
+        self.errors = []
+        self.files = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def on_progress(self, status: Dict):
+        """progress_hooks entry: report progress, and abort once the job is cancelled or stalls.
+
+        yt-dlp keeps calling the hook while it retries a stuck transfer, so
+        the same idle check as the subprocess watchdog applies here.
+        """
+        if self.cancelled:
+            raise OperationCancelled("Cancelled: yt-dlp")
+        if self.stalled is None and self.monitor is not None:
+            self.monitor.observe(event_from_hook(status))
+            self.stalled = self.monitor.stall_check()
+        if self.stalled:
+            raise ProcessStalled(["yt-dlp"], self.stalled)
+
+    def on_postprocess(self, status: Dict):
+        """postprocessor_hooks entry."""
+        report(ProgressEvent(stage=POSTPROCESSING, detail=status.get('postprocessor', "")))
+
+    def add_file(self, filepath: str):
+        """post_hooks entry: called with the final path once postprocessing is done."""
+        if filepath not in self.files:
+            self.files.append(filepath)
+
+    def debug(self, msg: str):
+        if msg.startswith('[debug] '):
+            return
+        self._emit(msg)
+
+    def info(self, msg: str):
+        self._emit(msg)
+
+    def warning(self, msg: str):
+        self._emit(msg)
+
+    def error(self, msg: str):
+        self.errors.append(msg)
+        self._emit(msg)
+
+    def _emit(self, msg: str):
+        if self.callback:
+            self.callback(msg)
+        else:
+            logger.info(msg)
+
+class YtDlpEngine:
+    """Runs yt-dlp through its Python API instead of a subprocess per URL.
+
+    Each worker thread keeps its own long-lived ``YoutubeDL`` instances
+    (YoutubeDL is not thread-safe), keyed by the option list, so the
+    extractor import and HTTP session are paid once rather than per job.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _instances(self) -> "OrderedDict":
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = OrderedDict()
+        return instances
+
+    def _get(self, args: List[str]):
+        """Return the (YoutubeDL, sink) pair for this thread and option set."""
+        instances = self._instances()
+        key = tuple(args)
+        if key in instances:
+            instances.move_to_end(key)
+            return instances[key]
+
+        yt_dlp = _load_yt_dlp()
+        opts = yt_dlp.parse_options(list(args)).ydl_opts
+        sink = _JobSink()
+        opts['logger'] = sink
+        opts['noprogress'] = True
+        opts['post_hooks'] = [sink.add_file]
+        opts['progress_hooks'] = [sink.on_progress]
+        opts['postprocessor_hooks'] = [sink.on_postprocess]
+        entry = (yt_dlp.YoutubeDL(opts), sink)
+        instances[key] = entry
+
+        while len(instances) > MAX_INSTANCES_PER_THREAD:
+            _, (old_ydl, _) = instances.popitem(last=False)
+            old_ydl.close()
+        return entry
+
+    def download(self, args: List[str], url: str, log_callback: Optional[Callable[[str], None]] = None,
+                 on_event: Optional[Callable[[ProgressEvent], None]] = None,
+                 limit_rate: Optional[int] = None) -> List[str]:
+        """Download ``url`` with the given yt-dlp options and return the files produced.
+
+        ``limit_rate`` (bytes/sec) changes from job to job, so it is set on
+        the reused instance rather than being part of its option set.
+        Raises YtDlpError if yt-dlp reported errors, ProcessStalled if the
+        transfer stopped advancing for ``stall_timeout_seconds`` (retried like
+        a stalled subprocess), or OperationCancelled if the thread's
+        cancel_scope was triggered.
+        """
+        ydl, sink = self._get(args)
+        sink.reset(log_callback, current_cancel_event(), on_event)
+        ydl._download_retcode = 0  # Reset the error state left by the previous job
+        ydl.params['ratelimit'] = limit_rate
+        try:
+            retcode = ydl.download([url])
+        except Exception as e:
+            if sink.cancelled:
+                raise OperationCancelled(f"Cancelled: {url}") from e
+            if sink.stalled:
+                raise ProcessStalled(["yt-dlp", url], sink.stalled) from e
+            raise YtDlpError(str(e)) from e
+        finally:
+            sink.callback = None
+            sink.cancel_event = None
+            sink.monitor = None
+
+        if sink.cancelled:
+            raise OperationCancelled(f"Cancelled: {url}")
+        # With --ignore-errors the hook's exception only ends up as a reported error
+        if sink.stalled:
+            raise ProcessStalled(["yt-dlp", url], sink.stalled)
+
+        if retcode != 0:
+            raise YtDlpError("\n".join(sink.errors) or f"yt-dlp exited with code {retcode}")
+        return list(sink.files)
+
+    def extract_flat(self, url: str) -> Dict:
+        """Resolve a playlist into its entries without extracting each track."""
+        ydl, sink = self._get(["--flat-playlist", "--ignore-errors"])
+        sink.reset(None)
+        try:
+            return ydl.extract_info(url, download=False) or {}
+        except Exception as e:
+            raise YtDlpError(str(e)) from e
+
+    def close(self):
+        """Close the instances owned by the calling thread."""
+        instances = self._instances()
+        while instances:
+            _, (ydl, _) = instances.popitem()
+            ydl.close()
+
+def read_file_report(report_path: str) -> List[str]:
+    """Read the final file paths written by ``--print-to-file after_move:filepath``."""
+    files = []
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                path = line.strip()
+                if path and path not in files and os.path.exists(path):
+                    files.append(path)
+    return files
+
+def run_ytdlp(args: List[str], url: str, subprocess_runner: Callable[[List[str]], None],
+              log_callback: Optional[Callable[[str], None]] = None,
+              on_event: Optional[Callable[[ProgressEvent], None]] = None,
+              limit_rate: Optional[int] = None) -> List[str]:
+    """Download ``url`` with the configured engine and return exactly the files it produced.
+
+    ``subprocess_runner`` is called with the full yt-dlp argument list (without
+    the executable) when the subprocess engine is in use; it is expected to
+    parse the progress lines itself. The in-process engine passes its
+    progress events to ``on_event``. ``limit_rate`` caps the transfer in
+    bytes/sec (``--limit-rate``).
+    """
+    if use_inprocess_engine():
+        return get_engine().download(args, url, log_callback=log_callback, on_event=on_event,
+                                     limit_rate=limit_rate)
+
+    if limit_rate:
+        args = args + ["--limit-rate", str(limit_rate)]
+    with tempfile.TemporaryDirectory(prefix="umd-") as tmp:
+        report_path = os.path.join(tmp, "files.txt")
+        subprocess_runner(args + YTDLP_PROGRESS_ARGS + ["--print-to-file", "after_move:filepath", report_path, url])
+        return read_file_report(report_path)
+
+def resolve_playlist(url: str, subprocess_prefix: List[str]) -> List[Dict]:
+    """Flat-resolve a playlist/set URL into ``{'url', 'id', 'title', 'thumbnail'}`` track entries.
+
+    ``subprocess_prefix`` is the command that starts yt-dlp (e.g.
+    ``["yt-dlp"]``) and is only used by the subprocess engine.
+    """
+    if use_inprocess_engine():
+        info = get_engine().extract_flat(url)
+    else:
+        result = run_command(subprocess_prefix + ["--flat-playlist", "-J", url], capture_stdout=True)
+        info = json.loads(result.stdout or "{}")
+
+    tracks = []
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        track_url = entry.get("url") or entry.get("webpage_url")
+        if track_url:
+            thumbnails = entry.get("thumbnails") or [{}]
+            tracks.append({"url": track_url, "id": entry.get("id"), "title": entry.get("title"),
+                           "thumbnail": entry.get("thumbnail") or thumbnails[-1].get("url")})
+    return tracks
+
+_engine: Optional[YtDlpEngine] = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> YtDlpEngine:
+    """Return the shared in-process engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = YtDlpEngine()
+        return _engine